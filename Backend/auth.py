@@ -3,18 +3,106 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from pydantic import BaseModel
-from database import SessionLocal
+from passlib.context import CryptContext
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from database import get_db
 from models import User
+import threading
+import asyncio
+import time
+import os
 
 SECRET_KEY = "your-secret-key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(min(4, os.cpu_count() or 1))))
+# Usernames allowed to use operator tools such as request profiling.
+ADMIN_USERS = {name.strip() for name in os.getenv("ADMIN_USERS", "").split(",") if name.strip()}
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user/login")
 
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# bcrypt is deliberately slow; it runs on its own small pool so that a burst
+# of logins neither blocks the event loop nor takes every threadpool worker.
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_CONCURRENCY, thread_name_prefix="bcrypt")
+
 class TokenData(BaseModel):
     username: str
 
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    email: str
+
+class PrincipalCache:
+    """Size-bounded TTL cache of token -> Principal.
+
+    Entries never outlive the token itself. Each process has its own cache,
+    so a change made elsewhere is picked up after at most AUTH_CACHE_TTL.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return principal
+
+    def put(self, token: str, principal: Principal, token_expires_in: float):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + min(self.ttl, token_expires_in)
+        with self._lock:
+            self._entries[token] = (principal, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in [t for t, (p, _) in self._entries.items() if p.id == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+principal_cache = PrincipalCache(AUTH_CACHE_TTL, AUTH_CACHE_SIZE)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_principal(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
+
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, pwd_context.hash, password)
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, pwd_context.verify, password,
+                                                            hashed_password)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -22,7 +110,10 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+def _load_user(db: Session, username: str):
+    return db.query(User).filter(User.username == username).first()
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -36,11 +127,25 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    db = SessionLocal()
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    # Same session as the route (FastAPI resolves get_db once per request).
+    user = await run_in_threadpool(_load_user, db, token_data.username)
+    if user is None:
+        raise credentials_exception
+    principal = Principal(id=user.id, username=user.username, email=user.email)
+    principal_cache.put(token, principal, payload.get("exp", 0) - time.time())
+    return principal
+
+def is_admin_request(authorization: Optional[str]) -> bool:
+    # For middleware, which runs before any dependency: true only for a valid
+    # bearer token of a user listed in ADMIN_USERS.
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token or not ADMIN_USERS:
+        return False
     try:
-        user = db.query(User).filter(User.username == token_data.username).first()
-        if user is None:
-            raise credentials_exception
-        return user
-    finally:
-        db.close()
\ No newline at end of file
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return payload.get("sub") in ADMIN_USERS
@@ -0,0 +1,141 @@
+"""Latency of the per-user listing queries (/user/files, /user/history).
+
+Fills a scratch database with --rows files and as many analysis requests,
+spread over --users users, then times loading a user's whole listing and
+one keyset page of it, with and without the per-user indexes. Run from
+Backend/:
+
+    python -m benchmarks.listing_latency --rows 1000000
+    DATABASE_URL=postgresql+psycopg2://... python -m benchmarks.listing_latency --url-from-env
+"""
+from datetime import datetime, timedelta
+import statistics
+import argparse
+import tempfile
+import random
+import time
+import os
+import sys
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url-from-env", action="store_true",
+                        help="use DATABASE_URL instead of a scratch SQLite file (the tables must be empty)")
+    return parser.parse_args()
+
+
+def populate(engine, users: int, rows: int, batch: int):
+    from models import User, UserFile, AnalysisRequest
+
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {"id": i, "username": f"user{i}", "hashed_password": "x", "email": f"user{i}@example.com"}
+            for i in range(1, users + 1)
+        ])
+    for offset in range(0, rows, batch):
+        ids = range(offset + 1, min(rows, offset + batch) + 1)
+        with engine.begin() as conn:
+            conn.execute(UserFile.__table__.insert(), [
+                {"id": i, "user_id": i % users + 1, "file_path": f"uploads/objects/{i:064x}.mp3", "file_type": "MP3",
+                 "filename": f"evidence_{i}.mp3", "file_size": 1 << 20, "upload_date": start + timedelta(seconds=i)}
+                for i in ids
+            ])
+            conn.execute(AnalysisRequest.__table__.insert(), [
+                {"id": i, "user_id": i % users + 1, "file_id": i, "json_path": f"documents/report_{i}.json",
+                 "request_date": start + timedelta(seconds=i)}
+                for i in ids
+            ])
+
+
+def time_queries(session_factory, users: int, rows: int, queries: int, seed: int) -> dict:
+    from models import UserFile, AnalysisRequest
+    from routes.users import FILE_LIST_COLUMNS, REQUEST_LIST_COLUMNS
+    from utils.pagination import DEFAULT_PAGE_SIZE, encode_cursor, keyset_page
+
+    def full_listing(db, model, columns, user_id):
+        db.query(model).filter(model.user_id == user_id).all()
+
+    def keyset(db, model, columns, user_id):
+        # A page from a random point of the user's history, as /user/files does.
+        cursor = encode_cursor(None, rng.randint(1, rows))
+        keyset_page(db.query(*columns).filter(model.user_id == user_id), model.id, model.id, True,
+                    DEFAULT_PAGE_SIZE, cursor)
+
+    rng = random.Random(seed)
+    results = {}
+    for name, model, columns, fetch in (("files (all rows)", UserFile, FILE_LIST_COLUMNS, full_listing),
+                                        ("history (all rows)", AnalysisRequest, REQUEST_LIST_COLUMNS, full_listing),
+                                        ("files (page)", UserFile, FILE_LIST_COLUMNS, keyset),
+                                        ("history (page)", AnalysisRequest, REQUEST_LIST_COLUMNS, keyset)):
+        timings = []
+        with session_factory() as db:
+            for _ in range(queries):
+                user_id = rng.randint(1, users)
+                started = time.perf_counter()
+                fetch(db, model, columns, user_id)
+                timings.append((time.perf_counter() - started) * 1000)
+                db.expunge_all()
+        timings.sort()
+        results[name] = {
+            "p50_ms": round(statistics.median(timings), 2),
+            "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+            "max_ms": round(timings[-1], 2),
+        }
+    return results
+
+
+def set_listing_indexes(engine, present: bool):
+    from models import UserFile, AnalysisRequest
+
+    indexes = [index for model in (UserFile, AnalysisRequest) for index in model.__table__.indexes
+               if index.name.startswith(("ix_user_files_user_id", "ix_analysis_requests_user_id"))]
+    for index in indexes:
+        if present:
+            index.create(engine, checkfirst=True)
+        else:
+            index.drop(engine, checkfirst=True)
+
+
+def main():
+    args = parse_args()
+    scratch = None
+    if not args.url_from_env:
+        scratch = tempfile.mkdtemp(prefix="listing_bench_")
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from database import engine, SessionLocal
+    from migrations import migrate
+
+    migrate(engine)
+    print(f"database: {engine.url.render_as_string(hide_password=True)}")
+    started = time.perf_counter()
+    populate(engine, args.users, args.rows, args.batch)
+    print(f"inserted {args.rows} files and {args.rows} requests in {time.perf_counter() - started:.1f}s")
+
+    for label, present in (("without listing indexes", False), ("with listing indexes", True)):
+        set_listing_indexes(engine, present)
+        with engine.connect() as conn:
+            if engine.dialect.name == "sqlite":
+                conn.exec_driver_sql("ANALYZE")
+        results = time_queries(SessionLocal, args.users, args.rows, args.queries, args.seed)
+        print(label)
+        for name, stats in results.items():
+            print(f"  {name}: {stats}")
+
+    if scratch is not None:
+        engine.dispose()
+        for name in os.listdir(scratch):
+            os.remove(os.path.join(scratch, name))
+        os.rmdir(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""Offline benchmarks of the analysis pipeline, with JSON results.
+
+Media comes from ffmpeg test sources and transcripts from a fake
+transcriber (see benchmarks.synthetic), so no Whisper API key or real
+recordings are needed. Everything runs in a scratch directory with its own
+SQLite database. Run from Backend/:
+
+    python -m benchmarks.pipeline --duration 600 --output before.json
+    python -m benchmarks.pipeline --duration 600 --output after.json
+    python -m benchmarks.pipeline --compare before.json after.json
+
+--compare exits with status 1 when a p50 got slower by more than --threshold.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from datetime import datetime
+import statistics
+import subprocess
+import threading
+import argparse
+import platform
+import tempfile
+import logging
+import shutil
+import socket
+import struct
+import json
+import time
+import sys
+import os
+
+BENCHMARKS = ("extract_audio", "stream_pcm", "match_keywords", "analyze_text", "analyze_media",
+              "extract_text_insights", "generate_pdf_report", "analyze_route")
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=300, help="seconds of synthetic audio/video")
+    parser.add_argument("--segments", type=int, default=2000,
+                        help="segments of the synthetic transcript (spread over --duration for analyze_media)")
+    parser.add_argument("--keyword-density", type=float, default=0.1, help="share of segments with a keyword")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=16, help="analyses submitted to /audio/analyze")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent API clients")
+    parser.add_argument("--workers", type=int, default=4, help="analysis worker threads of the API")
+    parser.add_argument("--job-duration", type=float, default=60, help="seconds of audio per analysed file")
+    parser.add_argument("--transcribe-latency", type=float, default=0.0,
+                        help="simulated transcription latency per request, in seconds")
+    parser.add_argument("--transport", choices=("http", "asgi"), default="http",
+                        help="serve the API with uvicorn (http) or call it in process (asgi)")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="run only these benchmarks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed p50 slowdown for --compare")
+    return parser.parse_args()
+
+
+def summarize(samples_ms: list[float], **extra) -> dict:
+    ordered = sorted(samples_ms)
+    return {
+        "runs": len(ordered),
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[max(0, int(len(ordered) * 0.95 + 0.5) - 1)], 3),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "min_ms": round(ordered[0], 3),
+        "max_ms": round(ordered[-1], 3),
+        **extra
+    }
+
+
+def repeat(fn, runs: int, cleanup=None) -> list[float]:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+        if cleanup is not None:
+            cleanup(result)
+    return samples
+
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+
+def environment(args) -> dict:
+    def command_output(command):
+        try:
+            return subprocess.run(command, capture_output=True, text=True, check=True,
+                                  cwd=BACKEND_DIR).stdout.splitlines()[0].strip()
+        except (OSError, IndexError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "commit": command_output(["git", "rev-parse", "HEAD"]),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "ffmpeg": command_output(["ffmpeg", "-hide_banner", "-version"]),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    }
+
+
+def unique_wav(base: bytes, index: int) -> bytes:
+    # Distinct content per upload, so neither dedup nor the result cache
+    # turns the load test into cache hits.
+    return base[:44] + struct.pack("<q", index) + base[52:]
+
+
+def bench_stages(args, scratch: str, results: dict, selected):
+    from utils.analysis import analyze_media, extract_audio_from_video, get_keyword_matcher, match_keywords
+    from utils.analysis import load_keywords_from_file
+    from utils.audio_io import stream_pcm
+    from utils.text_analytics import analyze_text
+    from utils.pdf_generator import extract_text_insights, generate_pdf_report
+    from utils.transcribers import set_transcriber
+    from benchmarks.synthetic import SyntheticTranscriber, make_audio, make_transcript, make_video
+
+    keywords = load_keywords_from_file()
+    matcher = get_keyword_matcher()
+    transcript = make_transcript(args.segments, args.keyword_density, keywords, args.seed)
+    transcript_meta = {"segments": args.segments, "characters": len(transcript.text)}
+
+    if selected("extract_audio") or selected("stream_pcm"):
+        log(f"generating {args.duration:.0f}s test video")
+        video = make_video(os.path.join(scratch, "synthetic.mp4"), args.duration)
+        media_meta = {"media_seconds": args.duration, "bytes": os.path.getsize(video)}
+        if selected("extract_audio"):
+            samples = repeat(lambda: extract_audio_from_video(video, os.path.join(scratch, "temp")), args.runs,
+                             cleanup=lambda path: path and os.remove(path))
+            results["extract_audio"] = summarize(samples, **media_meta)
+        if selected("stream_pcm"):
+            samples = repeat(lambda: sum(len(block) for block in stream_pcm(video)), args.runs)
+            results["stream_pcm"] = summarize(samples, **media_meta)
+
+    if selected("match_keywords"):
+        samples = repeat(lambda: match_keywords(transcript.segments, matcher), args.runs)
+        results["match_keywords"] = summarize(samples, keywords=len(matcher), **transcript_meta)
+    if selected("analyze_text"):
+        samples = repeat(lambda: analyze_text(transcript.segments, matcher), args.runs)
+        results["analyze_text"] = summarize(samples, **transcript_meta)
+    if selected("extract_text_insights"):
+        samples = repeat(lambda: extract_text_insights(transcript.text), args.runs)
+        results["extract_text_insights"] = summarize(samples, **transcript_meta)
+
+    if selected("analyze_media") or selected("generate_pdf_report"):
+        log(f"generating {args.duration:.0f}s test audio")
+        audio = make_audio(os.path.join(scratch, "synthetic.wav"), args.duration)
+        # Segments are spread over the audio so the analysed transcript has --segments of them.
+        set_transcriber(SyntheticTranscriber(keywords, args.keyword_density, args.duration / args.segments,
+                                             latency=args.transcribe_latency, seed=args.seed))
+        try:
+            # No media_hash, so the result cache is bypassed and every run does the work.
+            analysis = analyze_media(audio)
+            if selected("analyze_media"):
+                samples = repeat(lambda: analyze_media(audio), args.runs)
+                results["analyze_media"] = summarize(samples, media_seconds=args.duration,
+                                                     segments=len(analysis["segments"]),
+                                                     hits=len(analysis["drug_timestamps"]))
+        finally:
+            set_transcriber(None)
+        if selected("generate_pdf_report"):
+            report = os.path.join(scratch, "report.pdf")
+            samples = repeat(lambda: generate_pdf_report(analysis, report), args.runs)
+            results["generate_pdf_report"] = summarize(samples, segments=len(analysis["segments"]),
+                                                       hits=len(analysis["drug_timestamps"]),
+                                                       bytes=os.path.getsize(report))
+
+
+@contextmanager
+def api_client(transport: str):
+    """A client of the API, with startup and shutdown around it.
+
+    "http" serves the app with uvicorn on a local port; "asgi" calls it in
+    process through Starlette's TestClient, which leaves out the HTTP server.
+    """
+    import main as api
+
+    if transport == "asgi":
+        from fastapi.testclient import TestClient
+
+        with TestClient(api.app) as client:
+            yield lambda: nullcontext(client)
+        return
+
+    import httpx
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield lambda: httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=600)
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def bench_route(args, scratch: str, results: dict):
+    from utils.analysis import load_keywords_from_file
+    from utils.transcribers import set_transcriber
+    from benchmarks.synthetic import SyntheticTranscriber, make_audio
+
+    with open(make_audio(os.path.join(scratch, "job.wav"), args.job_duration), "rb") as f:
+        base = f.read()
+    set_transcriber(SyntheticTranscriber(load_keywords_from_file(), args.keyword_density,
+                                         latency=args.transcribe_latency, seed=args.seed))
+    try:
+        with api_client(args.transport) as new_client:
+            with new_client() as client:
+                client.post("/user/register", json={"username": "bench", "password": "bench",
+                                                    "email": "bench@example.com"})
+                token = client.post("/user/login", data={"username": "bench", "password": "bench"}) \
+                    .json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+
+            def run_job(index: int) -> dict:
+                with new_client() as client:
+                    started = time.perf_counter()
+                    file_id = client.post("/audio/upload", headers=headers,
+                                          files={"file": (f"job_{index}.wav", unique_wav(base, index))}) \
+                        .json()["file_id"]
+                    uploaded = time.perf_counter()
+                    job_id = client.post(f"/audio/analyze/{file_id}", headers=headers).json()["job_id"]
+                    final = None
+                    with client.stream("GET", f"/audio/jobs/{job_id}/events", headers=headers) as stream:
+                        for line in stream.iter_lines():
+                            if line.startswith("event: "):
+                                final = line[7:]
+                    finished = time.perf_counter()
+                return {"upload_ms": (uploaded - started) * 1000, "job_ms": (finished - uploaded) * 1000,
+                        "status": final}
+
+            log(f"running {args.jobs} analyses through the API ({args.transport}), {args.concurrency} clients, "
+                f"{args.workers} workers")
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                jobs = list(pool.map(run_job, range(args.jobs)))
+            wall = time.perf_counter() - started
+    finally:
+        set_transcriber(None)
+
+    completed = [job for job in jobs if job["status"] == "completed"]
+    results["analyze_route"] = summarize([job["job_ms"] for job in completed] or [0.0],
+                                         transport=args.transport, jobs=args.jobs, completed=len(completed),
+                                         concurrency=args.concurrency, workers=args.workers,
+                                         job_media_seconds=args.job_duration,
+                                         wall_seconds=round(wall, 3),
+                                         jobs_per_second=round(len(completed) / wall, 3),
+                                         audio_seconds_per_second=round(len(completed) * args.job_duration / wall, 3),
+                                         upload=summarize([job["upload_ms"] for job in jobs]))
+
+
+def compare(baseline_path: str, candidate_path: str, threshold: float) -> int:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    with open(candidate_path, "r", encoding="utf-8") as f:
+        candidate = json.load(f)["results"]
+    regressions = 0
+    print(f"{'benchmark':<24}{'baseline p50':>14}{'candidate p50':>15}{'change':>10}")
+    for name in sorted(set(baseline) & set(candidate)):
+        before, after = baseline[name]["p50_ms"], candidate[name]["p50_ms"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"{name:<24}{before:>14.3f}{after:>15.3f}{change:>+10.1%}{flag}")
+    return 1 if regressions else 0
+
+
+def main():
+    args = parse_args()
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    scratch = tempfile.mkdtemp(prefix="pipeline_bench_")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(scratch, 'bench.db')}",
+        "ANALYSIS_WORKER_BACKEND": "thread",
+        "ANALYSIS_WORKERS": str(args.workers),
+        "RESULT_CACHE_DIR": os.path.join(scratch, "cache"),
+        "SEARCH_INDEX_DIR": os.path.join(scratch, "search"),
+        # The default poll interval would dominate the measured job latency.
+        "JOB_EVENTS_POLL_INTERVAL": "0.01",
+        # Review proxies are transcoded in the background and would still be
+        # running when the scratch directory is removed.
+        "REVIEW_PROXY_ON_UPLOAD": "0",
+    })
+    sys.path.insert(0, BACKEND_DIR)
+    cwd = os.getcwd()
+    os.chdir(scratch)
+    selected = lambda name: not args.only or name in args.only
+    results = {}
+    try:
+        # The pipeline prints progress to stdout; keep stdout for the JSON.
+        with redirect_stdout(sys.stderr):
+            logging.disable(logging.INFO)
+            bench_stages(args, scratch, results, selected)
+            if selected("analyze_route"):
+                bench_route(args, scratch, results)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    output = json.dumps({"environment": environment(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        log(f"results written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Memory and time of rendering the PDF report of a long recording.
+
+Builds the analysis result of --hours of synthetic speech (one transcript
+segment per --segment-seconds) and writes it as a segment store. The
+report is then rendered the way routes.users.render_report does it, from
+the store opened afresh, and the peak Python heap growth of loading plus
+rendering (tracemalloc) and the process's maximum resident size are
+reported. Exits with status 1 when the heap growth exceeds --budget-mb.
+Run from Backend/:
+
+    python -m benchmarks.report_memory --hours 8 --budget-mb 16
+"""
+import tracemalloc
+import resource
+import argparse
+import tempfile
+import logging
+import json
+import gc
+import time
+import sys
+import os
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=float, default=8)
+    parser.add_argument("--segment-seconds", type=float, default=4.0)
+    parser.add_argument("--keyword-density", type=float, default=0.1)
+    parser.add_argument("--budget-mb", type=float, default=16,
+                        help="allowed peak heap growth while loading and rendering")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    logging.disable(logging.INFO)
+
+    from utils.analysis import get_keyword_matcher, load_keywords_from_file
+    from utils.text_analytics import analyze_text
+    from utils.pdf_generator import generate_pdf_report
+    from utils.segment_store import SegmentStore, write_store
+    from benchmarks.synthetic import make_transcript
+
+    segments = int(args.hours * 3600 / args.segment_seconds)
+    transcript = make_transcript(segments, args.keyword_density, load_keywords_from_file(), args.seed,
+                                 args.segment_seconds)
+    analytics = analyze_text(transcript.segments, get_keyword_matcher())
+    hits = len(analytics["drug_timestamps"])
+
+    with tempfile.TemporaryDirectory(prefix="report_bench_") as scratch:
+        store_path = os.path.join(scratch, "result.seg")
+        write_store(store_path, {
+            "transcription": transcript.text,
+            "duration": segments * args.segment_seconds,
+            "segments": [segment.to_dict() for segment in transcript.segments],
+            "drug_timestamps": analytics.pop("drug_timestamps"),
+            "insights": analytics,
+        })
+        del transcript, analytics
+        gc.collect()
+
+        output = os.path.join(scratch, "report.pdf")
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        with SegmentStore(store_path) as store:
+            generate_pdf_report(store.lazy_result(), output)
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+        with open(output, "rb") as f:
+            pages = f.read().count(b"/Type /Page\n")
+        size = os.path.getsize(output)
+
+    result = {"hours": args.hours, "segments": segments, "hits": hits,
+              "pages": pages, "bytes": size, "seconds": round(seconds, 2),
+              "peak_heap_mb": round(peak / 2 ** 20, 1), "budget_mb": args.budget_mb,
+              "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if peak / 2 ** 20 > args.budget_mb else 0)
+
+
+if __name__ == "__main__":
+    main()
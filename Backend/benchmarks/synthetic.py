@@ -0,0 +1,82 @@
+"""Synthetic media and transcripts for offline benchmarks.
+
+Audio and video come from ffmpeg's lavfi test sources, so nothing has to be
+downloaded; transcripts are generated from utils/keywords.txt with a chosen
+share of segments containing a keyword. Everything is seeded, so two runs
+with the same arguments process the same data.
+"""
+import random
+import math
+import time
+
+from utils.audio_io import run_ffmpeg
+from utils.transcribers import Segment, Transcriber, Transcription, audio_duration
+
+FILLER_WORDS = (
+    "we", "need", "to", "talk", "about", "the", "meeting", "tomorrow", "call", "me", "when", "you", "get", "there",
+    "it", "was", "late", "again", "and", "nobody", "answered", "phone", "car", "money", "later", "house", "friend",
+    "said", "bring", "everything", "tonight", "don't", "forget", "address", "work", "week", "told", "him", "her",
+    "already", "maybe", "corner", "store", "back", "door", "quiet", "usual", "place", "send", "message",
+)
+NAMES = ("Alex", "Marat", "Dana", "Aigerim", "Sergey", "Nurlan", "Olga", "Timur")
+
+
+def make_audio(path: str, seconds: float, rate: int = 16000):
+    """Mono 16-bit WAV of pink noise with a tone, roughly speech-band."""
+    run_ffmpeg(["-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.2:duration={seconds}:sample_rate={rate}",
+                "-f", "lavfi", "-i", f"sine=frequency=220:duration={seconds}:sample_rate={rate}",
+                "-filter_complex", "amix=inputs=2:duration=shortest", "-ac", "1", "-ar", str(rate),
+                "-c:a", "pcm_s16le", path])
+    return path
+
+
+def make_video(path: str, seconds: float, size: str = "640x360", fps: int = 25):
+    """MP4 test pattern with a 44.1 kHz stereo AAC soundtrack, like a phone recording."""
+    run_ffmpeg(["-f", "lavfi", "-i", f"testsrc2=size={size}:rate={fps}:duration={seconds}",
+                "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}:sample_rate=44100",
+                "-ac", "2", "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-shortest", path])
+    return path
+
+
+def make_transcript(segments: int, keyword_density: float, keywords: list[str], seed: int = 0,
+                    segment_seconds: float = 4.0, words_per_segment: int = 12) -> Transcription:
+    # keyword_density is the share of segments that contain one keyword.
+    rng = random.Random(seed)
+    result = []
+    for index in range(segments):
+        words = [rng.choice(FILLER_WORDS) for _ in range(words_per_segment)]
+        if rng.random() < 0.2:
+            words.insert(rng.randrange(1, len(words)), rng.choice(NAMES))
+        if keywords and rng.random() < keyword_density:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords))
+        text = " ".join(words)
+        start = index * segment_seconds
+        result.append(Segment(start=round(start, 3), end=round(start + segment_seconds, 3),
+                              text=text[0].upper() + text[1:] + "."))
+    return Transcription(text=" ".join(segment.text for segment in result), segments=result)
+
+
+class SyntheticTranscriber(Transcriber):
+    """Fake Whisper: a generated transcript covering the submitted audio.
+
+    latency (seconds per request) stands in for the API round trip, so
+    concurrency effects stay visible without a network.
+    """
+    name = "synthetic"
+
+    def __init__(self, keywords: list[str], keyword_density: float = 0.1, segment_seconds: float = 4.0,
+                 latency: float = 0.0, seed: int = 0):
+        self.keywords = keywords
+        self.keyword_density = keyword_density
+        self.segment_seconds = segment_seconds
+        self.latency = latency
+        self.seed = seed
+
+    def transcribe(self, audio, offset: float = 0.0) -> Transcription:
+        duration = audio_duration(audio) or self.segment_seconds
+        if self.latency:
+            time.sleep(self.latency)
+        segments = max(1, math.ceil(duration / self.segment_seconds))
+        return make_transcript(segments, self.keyword_density, self.keywords, self.seed + int(duration * 1000),
+                               self.segment_seconds)
@@ -1,10 +1,57 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import os
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./media_analysis.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./media_analysis.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "65536"))
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# journal_mode=WAL lets readers run next to the single writer (request
+# handlers and analysis workers share the file); with WAL, synchronous=NORMAL
+# is still crash-safe and avoids an fsync per commit.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size=-{SQLITE_CACHE_KB}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+
+def build_engine(url: str = SQLALCHEMY_DATABASE_URL):
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite":
+        # Server databases (PostgreSQL via psycopg2 etc.) get a sized pool;
+        # pre_ping drops connections the server has closed in the meantime.
+        return create_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+                             pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+
+    if url.database in (None, "", ":memory:"):
+        sqlite_engine = create_engine(url, connect_args={"check_same_thread": False})
+    else:
+        sqlite_engine = create_engine(url, connect_args={"check_same_thread": False,
+                                                         "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+                                      pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                                      pool_timeout=DB_POOL_TIMEOUT)
+
+    @event.listens_for(sqlite_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return sqlite_engine
+
+
+engine = build_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -14,4 +61,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -1,5 +1,4 @@
-from database import engine
-from models import Base
+from migrations import migrate
 
-Base.metadata.create_all(bind=engine)
-print("Database tables created successfully.")
\ No newline at end of file
+migrate()
+print("Database tables created successfully.")
@@ -1,16 +1,37 @@
-from fastapi import FastAPI, Depends
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from fastapi import FastAPI, Depends, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer
 from routes.audio import router as audio_router
 from routes.users import router as user_router
-from database import engine
-from models import Base
+from routes.search import router as search_router
+from migrations import migrate
+from auth import is_admin_request
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+from utils import jobs
+from utils.pagination import NEXT_CURSOR_HEADER
+from utils.metrics import METRICS_ENABLED, http_request_seconds, registry
+from utils.profiling import PROFILING_ENABLED, SamplingProfiler
+import time
 import os
 
-load_dotenv()
+MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "1") == "1"
+
 
-app = FastAPI(title="Media Analysis API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if MIGRATE_ON_STARTUP:
+        migrate()
+    jobs.recover_jobs()
+    yield
+    jobs.shutdown()
+
+
+app = FastAPI(title="Media Analysis API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,15 +39,46 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
-Base.metadata.create_all(bind=engine)
-
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user/login")
 
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    # With PROFILING_ENABLED=1, "?profile=1" or an X-Profile header samples
+    # the request of an admin (ADMIN_USERS); the folded stacks are written
+    # under PROFILE_DIR.
+    profiler = None
+    if (PROFILING_ENABLED and (request.query_params.get("profile") == "1" or "x-profile" in request.headers)
+            and is_admin_request(request.headers.get("authorization"))):
+        profiler = SamplingProfiler()
+        profiler.start()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    route = request.scope.get("route")
+    # Route templates, not raw paths, so ids do not explode the label set.
+    http_request_seconds.observe(time.perf_counter() - started, method=request.method,
+                                 route=route.path if route else "unmatched", status=response.status_code)
+    if profiler is not None:
+        response.headers["X-Profile-File"] = profiler.save(f"{request.method}_{request.url.path}")
+    return response
+
 app.include_router(user_router, prefix="/user", tags=["Users"])
 app.include_router(audio_router, prefix="/audio", tags=["Audio/Video Analysis"])
+app.include_router(search_router, prefix="/search", tags=["Search"])
 
 @app.get("/")
 async def root():
-    return {"message": "Media Analysis API"}
\ No newline at end of file
+    return {"message": "Media Analysis API"}
+
+
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
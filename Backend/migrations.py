@@ -0,0 +1,147 @@
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, inspect, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+from database import engine, Base
+import models  # noqa: F401  (registers the tables on Base.metadata)
+import logging
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime),
+)
+
+
+def _create_tables(conn, *names):
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables[name] for name in names])
+
+
+def _add_columns(conn, table_name: str, *column_names):
+    # Databases created before a column existed; fresh ones already have it.
+    existing = {column["name"] for column in inspect(conn).get_columns(table_name)}
+    table = Base.metadata.tables[table_name]
+    for name in column_names:
+        if name not in existing:
+            column = table.c[name]
+            ddl = f"ALTER TABLE {table_name} ADD COLUMN {name} {column.type.compile(dialect=conn.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT '{column.server_default.arg}'"
+            if not column.nullable:
+                ddl += " NOT NULL"
+            conn.exec_driver_sql(ddl)
+
+
+def _create_indexes(conn, table_name: str, *index_names):
+    indexes = {index.name: index for index in Base.metadata.tables[table_name].indexes}
+    for name in index_names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+def _initial_schema(conn):
+    _create_tables(conn, "users", "user_files", "analysis_requests")
+
+
+def _upload_sessions(conn):
+    _add_columns(conn, "user_files", "filename", "file_size", "sha256", "md5")
+    _create_indexes(conn, "user_files", "ix_user_files_sha256")
+    _create_tables(conn, "upload_sessions")
+
+
+def _analysis_jobs(conn):
+    _create_tables(conn, "analysis_batches", "analysis_jobs")
+
+
+def _listing_indexes(conn):
+    _create_indexes(conn, "user_files", "ix_user_files_user_id_id")
+    _create_indexes(conn, "analysis_requests", "ix_analysis_requests_user_id_id", "ix_analysis_requests_file_id")
+
+
+def _listing_counters(conn):
+    _add_columns(conn, "users", "file_count", "request_count")
+    _add_columns(conn, "analysis_requests", "hit_count")
+    _create_indexes(conn, "user_files", "ix_user_files_user_id_upload_date")
+    _create_indexes(conn, "analysis_requests", "ix_analysis_requests_user_id_request_date")
+    conn.exec_driver_sql(
+        "UPDATE users SET "
+        "file_count = (SELECT COUNT(*) FROM user_files WHERE user_files.user_id = users.id), "
+        "request_count = (SELECT COUNT(*) FROM analysis_requests WHERE analysis_requests.user_id = users.id)")
+    requests = Base.metadata.tables["analysis_requests"]
+    rows = conn.execute(select(requests.c.id, requests.c.json_path)
+                        .where(requests.c.hit_count.is_(None), requests.c.json_path.is_not(None))).all()
+    for request_id, json_path in rows:
+        if not os.path.exists(json_path):
+            continue
+        with open(json_path, "r", encoding="utf-8") as f:
+            hits = json.load(f).get("analysis_result", {}).get("drug_timestamps", [])
+        conn.execute(update(requests).where(requests.c.id == request_id).values(hit_count=len(hits)))
+
+
+def _keyword_versions(conn):
+    _add_columns(conn, "analysis_requests", "keyword_version")
+    _create_tables(conn, "keyword_rescans")
+
+
+def _job_events(conn):
+    _create_tables(conn, "job_events")
+
+
+def _analysis_timings(conn):
+    _add_columns(conn, "analysis_requests", "timings")
+
+
+def _segment_stores(conn):
+    _add_columns(conn, "analysis_requests", "segments_path")
+
+
+def _keyframes(conn):
+    _create_tables(conn, "keyframes", "keyframe_bands")
+
+
+# Append only: a released migration is never edited, a new one is added instead.
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "upload hashes and resumable upload sessions", _upload_sessions),
+    (3, "analysis jobs and batches", _analysis_jobs),
+    (4, "per-user listing indexes", _listing_indexes),
+    (5, "listing counters, hit counts and date indexes", _listing_counters),
+    (6, "keyword versions and rescans", _keyword_versions),
+    (7, "analysis job progress events", _job_events),
+    (8, "analysis stage timings", _analysis_timings),
+    (9, "segment stores", _segment_stores),
+    (10, "video keyframes and perceptual hashes", _keyframes),
+]
+
+
+def applied_versions(bind=engine) -> set[int]:
+    schema_migrations.create(bind, checkfirst=True)
+    with bind.connect() as conn:
+        return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def migrate(bind=engine) -> int:
+    applied = applied_versions(bind)
+    for version, description, upgrade in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            with bind.begin() as conn:
+                # Recording the version first takes the write lock, so another
+                # process migrating at the same time waits and then skips it.
+                conn.execute(insert(schema_migrations).values(version=version, description=description,
+                                                              applied_at=datetime.utcnow()))
+                upgrade(conn)
+        except IntegrityError:
+            logger.info(f"Миграция {version} уже применена другим процессом")
+            continue
+        logger.info(f"Применена миграция {version}: {description}")
+    return max(version for version, _, _ in MIGRATIONS)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Database schema is at version {migrate()}.")
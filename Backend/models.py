@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Float, Index, event, update
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -9,6 +9,8 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     email = Column(String, unique=True, index=True)
+    file_count = Column(Integer, default=0, server_default="0", nullable=False)
+    request_count = Column(Integer, default=0, server_default="0", nullable=False)
     files = relationship("UserFile", back_populates="user")
     requests = relationship("AnalysisRequest", back_populates="user")
 
@@ -18,16 +20,141 @@ class UserFile(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     file_path = Column(String)
     file_type = Column(String)
+    filename = Column(String, nullable=True)
+    file_size = Column(Integer, nullable=True)
+    sha256 = Column(String(64), nullable=True, index=True)
+    md5 = Column(String(32), nullable=True)
     upload_date = Column(DateTime, default=datetime.utcnow)
     user = relationship("User", back_populates="files")
+    __table_args__ = (Index("ix_user_files_user_id_id", "user_id", "id"),
+                      Index("ix_user_files_user_id_upload_date", "user_id", "upload_date", "id"))
 
 class AnalysisRequest(Base):
     __tablename__ = "analysis_requests"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    file_id = Column(Integer, ForeignKey("user_files.id"))
+    file_id = Column(Integer, ForeignKey("user_files.id"), index=True)
     report_path = Column(String)
     json_path = Column(String)
+    # Compact store of segments and hits (utils.segment_store); json_path is
+    # only set on analyses made before it existed.
+    segments_path = Column(String, nullable=True)
+    hit_count = Column(Integer, nullable=True)
+    keyword_version = Column(String(16), nullable=True)
+    # JSON: stage timing spans of the analysis (see utils.metrics.Timings).
+    timings = Column(Text, nullable=True)
     request_date = Column(DateTime, default=datetime.utcnow)
     user = relationship("User", back_populates="requests")
-    file = relationship("UserFile")
\ No newline at end of file
+    file = relationship("UserFile")
+    __table_args__ = (Index("ix_analysis_requests_user_id_id", "user_id", "id"),
+                      Index("ix_analysis_requests_user_id_request_date", "user_id", "request_date", "id"))
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    filename = Column(String)
+    file_ext = Column(String)
+    total_size = Column(Integer, nullable=True)
+    part_path = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class KeywordRescan(Base):
+    __tablename__ = "keyword_rescans"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    keyword_version = Column(String(16), nullable=True)
+    status = Column(String, default="queued", index=True)
+    total = Column(Integer, default=0)
+    processed = Column(Integer, default=0)
+    updated = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)
+    new_hits = Column(Integer, default=0)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    file_id = Column(Integer, ForeignKey("user_files.id"))
+    request_id = Column(Integer, ForeignKey("analysis_requests.id"), nullable=True)
+    batch_id = Column(Integer, ForeignKey("analysis_batches.id"), nullable=True, index=True)
+    status = Column(String, default="queued", index=True)
+    stage = Column(String, default="queued")
+    progress = Column(Integer, default=0)
+    error = Column(String, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    file = relationship("UserFile")
+    request = relationship("AnalysisRequest")
+    batch = relationship("AnalysisBatch", back_populates="jobs")
+
+class AnalysisBatch(Base):
+    __tablename__ = "analysis_batches"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    status = Column(String, default="queued")
+    max_concurrency = Column(Integer)
+    cancel_requested = Column(Boolean, default=False)
+    summary_path = Column(String, nullable=True)
+    report_path = Column(String, nullable=True)
+    audio_seconds = Column(Float, nullable=True)
+    files_per_minute = Column(Float, nullable=True)
+    audio_seconds_per_second = Column(Float, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    jobs = relationship("AnalysisJob", back_populates="batch", order_by="AnalysisJob.id")
+
+class JobEvent(Base):
+    __tablename__ = "job_events"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("analysis_jobs.id"), nullable=False)
+    type = Column(String, nullable=False)
+    data = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_job_events_job_id_id", "job_id", "id"),
+    )
+
+class Keyframe(Base):
+    # Scene keyframes of a video, shared by every upload of the same content.
+    __tablename__ = "keyframes"
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), nullable=False, index=True)
+    timestamp = Column(Float, nullable=False)
+    path = Column(String, nullable=False)
+    phash = Column(String(16), nullable=False)
+    scene_score = Column(Float, nullable=True)
+
+class KeyframeBand(Base):
+    # One row per band of a keyframe's perceptual hash, for near-duplicate lookup.
+    __tablename__ = "keyframe_bands"
+    keyframe_id = Column(Integer, ForeignKey("keyframes.id"), primary_key=True)
+    band = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_keyframe_bands_band_value", "band", "value"),
+    )
+
+# Per-user totals for the listing count endpoints, kept in the same
+# transaction as the insert/delete so they never drift from the rows.
+def _count_rows(counter: str, delta: int):
+    def listener(mapper, connection, target):
+        users = User.__table__
+        connection.execute(update(users).where(users.c.id == target.user_id)
+                           .values({counter: users.c[counter] + delta}))
+    return listener
+
+event.listen(UserFile, "after_insert", _count_rows("file_count", 1))
+event.listen(UserFile, "after_delete", _count_rows("file_count", -1))
+event.listen(AnalysisRequest, "after_insert", _count_rows("request_count", 1))
+event.listen(AnalysisRequest, "after_delete", _count_rows("request_count", -1))
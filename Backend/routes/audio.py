@@ -1,23 +1,70 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
 from sqlalchemy.orm import Session
-from database import get_db
-from models import User, UserFile, AnalysisRequest
+from pydantic import BaseModel
+from typing import Optional, List
+from database import get_db, SessionLocal
+from models import User, UserFile, AnalysisJob, AnalysisBatch, UploadSession, KeywordRescan
 from auth import get_current_user
-from utils.analysis import analyze_media
-from utils.pdf_generator import generate_pdf_report
-import os
-from datetime import datetime
+from utils.jobs import (ACTIVE_STATUSES, BATCH_MAX_CONCURRENCY, submit_job, submit_rescan, cancel_job,
+                        dispatch_batch, cancel_batch, batch_throughput)
+from utils.analysis import get_keyword_matcher, get_keyword_categories
+from utils.rescan import outdated_requests
+from utils.job_events import stream_job_events
+from utils.media_delivery import PROXY_ON_UPLOAD, evidence_file_response, file_sha256, submit_review_proxy
+from utils.cache import get_cache
+from utils.uploads import (CHUNK_SIZE, MAX_UPLOAD_SIZE, UploadTooLarge, save_upload, open_part_writer,
+                           save_part_state, drop_part_state, claim_part, release_part, store_content_addressed,
+                           extract_archive)
 import json
+import os
+import uuid
 
 router = APIRouter()
 
 UPLOAD_DIR = "uploads"
-REPORT_DIR = "documents"
+PARTS_DIR = os.path.join(UPLOAD_DIR, "parts")
+OBJECTS_DIR = os.path.join(UPLOAD_DIR, "objects")
 ALLOWED_EXTENSIONS = {'.mp3', '.wav', '.mp4', '.avi'}
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "1000"))
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(REPORT_DIR, exist_ok=True)
+os.makedirs(PARTS_DIR, exist_ok=True)
+os.makedirs(OBJECTS_DIR, exist_ok=True)
+
+
+class UploadInit(BaseModel):
+    filename: str
+    size: Optional[int] = None
+
+
+class BatchCreate(BaseModel):
+    file_ids: List[int]
+    max_concurrency: Optional[int] = None
+
+
+def job_to_dict(job: AnalysisJob) -> dict:
+    return {
+        "job_id": job.id,
+        "file_id": job.file_id,
+        "request_id": job.request_id,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def get_user_job(job_id: int, current_user: User, db: Session) -> AnalysisJob:
+    job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id, AnalysisJob.user_id == current_user.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
 @router.post("/upload")
@@ -26,38 +73,338 @@ async def upload_media(file: UploadFile = File(...), current_user: User = Depend
     file_ext = os.path.splitext(file.filename)[1].lower()
     if file_ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Invalid file type")
-    file_path = os.path.join(UPLOAD_DIR, f"{current_user.id}_{datetime.utcnow().timestamp()}{file_ext}")
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
-    user_file = UserFile(user_id=current_user.id, file_path=file_path, file_type=file_ext[1:].upper())
+    tmp_path = os.path.join(PARTS_DIR, f"{uuid.uuid4().hex}.upload")
+    try:
+        writer = await save_upload(file, tmp_path)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
+    sha256, md5 = writer.digests()
+    return register_upload(db, current_user, tmp_path, file_ext, writer.size, sha256, md5, file.filename)
+
+
+def create_user_file(db: Session, current_user: User, tmp_path: str, file_ext: str, size: int, sha256: str,
+                     md5: Optional[str], filename: Optional[str]) -> UserFile:
+    file_path = store_content_addressed(tmp_path, OBJECTS_DIR, sha256, file_ext)
+    user_file = UserFile(user_id=current_user.id, file_path=file_path, file_type=file_ext[1:].upper(),
+                         filename=filename, file_size=size, sha256=sha256, md5=md5)
     db.add(user_file)
+    if PROXY_ON_UPLOAD:
+        submit_review_proxy(file_path, sha256)
+    return user_file
+
+
+def register_upload(db: Session, current_user: User, tmp_path: str, file_ext: str, size: int, sha256: str,
+                    md5: Optional[str], filename: Optional[str] = None) -> dict:
+    user_file = create_user_file(db, current_user, tmp_path, file_ext, size, sha256, md5, filename)
     db.commit()
     db.refresh(user_file)
-    return {"file_id": user_file.id, "message": "File uploaded successfully"}
+    return {"file_id": user_file.id, "sha256": sha256, "md5": md5, "size": size,
+            "message": "File uploaded successfully"}
+
+
+def get_upload_session(upload_id: str, current_user: User, db: Session) -> UploadSession:
+    session = db.query(UploadSession).filter(UploadSession.id == upload_id,
+                                             UploadSession.user_id == current_user.id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
 
+def upload_status(session: UploadSession) -> dict:
+    offset = os.path.getsize(session.part_path) if os.path.exists(session.part_path) else 0
+    return {"upload_id": session.id, "offset": offset, "size": session.total_size, "chunk_size": CHUNK_SIZE}
 
-@router.post("/analyze/{file_id}")
-async def analyze_file(file_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+
+@router.post("/upload/init")
+def init_upload(body: UploadInit, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    file_ext = os.path.splitext(body.filename)[1].lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Invalid file type")
+    if body.size is not None and body.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
+    upload_id = uuid.uuid4().hex
+    session = UploadSession(id=upload_id, user_id=current_user.id, filename=body.filename, file_ext=file_ext,
+                            total_size=body.size, part_path=os.path.join(PARTS_DIR, f"{upload_id}.part"))
+    db.add(session)
+    db.commit()
+    return upload_status(session)
+
+
+@router.get("/upload/{upload_id}")
+def get_upload(upload_id: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    return upload_status(get_upload_session(upload_id, current_user, db))
+
+
+@router.put("/upload/{upload_id}")
+async def append_upload_part(upload_id: str, offset: int, request: Request,
+                             current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    session = get_upload_session(upload_id, current_user, db)
+    if not claim_part(upload_id):
+        raise HTTPException(status_code=409, detail={"message": "Upload in progress"})
+    try:
+        writer = await run_in_threadpool(open_part_writer, upload_id, session.part_path)
+        if offset != writer.size:
+            # The client is out of sync (e.g. a part was lost); tell it where to resume.
+            raise HTTPException(status_code=409, detail={"message": "Offset mismatch", "offset": writer.size})
+        try:
+            with writer:
+                async for chunk in request.stream():
+                    await writer.write(chunk)
+        except UploadTooLarge:
+            raise HTTPException(status_code=413, detail="File too large")
+        except ClientDisconnect:
+            pass
+        finally:
+            save_part_state(upload_id, writer)
+    finally:
+        release_part(upload_id)
+    return upload_status(session)
+
+
+@router.post("/upload/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, current_user: User = Depends(get_current_user),
+                          db: Session = Depends(get_db)):
+    session = get_upload_session(upload_id, current_user, db)
+    if not claim_part(upload_id):
+        raise HTTPException(status_code=409, detail={"message": "Upload in progress"})
+    try:
+        writer = await run_in_threadpool(open_part_writer, upload_id, session.part_path)
+        if session.total_size is not None and writer.size != session.total_size:
+            raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "offset": writer.size})
+        if writer.size == 0:
+            raise HTTPException(status_code=400, detail="Upload is empty")
+        drop_part_state(upload_id)
+        sha256, md5 = writer.digests()
+        part_path, file_ext, filename = session.part_path, session.file_ext, session.filename
+        db.delete(session)
+        return register_upload(db, current_user, part_path, file_ext, writer.size, sha256, md5, filename)
+    finally:
+        release_part(upload_id)
+
+
+@router.post("/analyze/{file_id}", status_code=202)
+def analyze_file(file_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     user_file = db.query(UserFile).filter(UserFile.id == file_id, UserFile.user_id == current_user.id).first()
     if not user_file:
         raise HTTPException(status_code=404, detail="File not found")
-    analysis_result = analyze_media(user_file.file_path)
-    report_path = os.path.join(REPORT_DIR, f"report_{file_id}_{datetime.utcnow().timestamp()}.pdf")
-    generate_pdf_report(analysis_result, report_path)
-
-    json_response = {
-        "analysis_result": analysis_result,
-        "request_date": datetime.utcnow().isoformat(),
-        "file_id": file_id,
-        "user_id": current_user.id
-    }
-    json_path = os.path.join(REPORT_DIR, f"report_{file_id}_{datetime.utcnow().timestamp()}.json")
-    with open(json_path, 'w', encoding='utf-8') as json_file:
-        json.dump(json_response, json_file, ensure_ascii=False, indent=4)
+    job = AnalysisJob(user_id=current_user.id, file_id=user_file.id)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    if submit_job(job.id) is None:
+        db.refresh(job)
+    return JSONResponse(status_code=202, content=job_to_dict(job))
+
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    return job_to_dict(get_user_job(job_id, current_user, db))
+
 
-    analysis_request = AnalysisRequest(user_id=current_user.id, file_id=user_file.id, report_path=report_path,
-                                       json_path=json_path)
-    db.add(analysis_request)
+@router.get("/jobs/{job_id}/events")
+def job_events(job_id: int, request: Request, last_event_id: Optional[int] = None,
+               current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    get_user_job(job_id, current_user, db)
+    header = request.headers.get("last-event-id")
+    if last_event_id is None and header and header.isdigit():
+        last_event_id = int(header)
+
+    def job_state() -> dict:
+        with SessionLocal() as session:
+            return job_to_dict(session.query(AnalysisJob).filter(AnalysisJob.id == job_id).first())
+
+    return StreamingResponse(stream_job_events(request, job_id, last_event_id or 0, job_state),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_analysis_job(job_id: int, current_user: User = Depends(get_current_user),
+                              db: Session = Depends(get_db)):
+    job = cancel_job(db, get_user_job(job_id, current_user, db))
+    return job_to_dict(job)
+
+
+def check_batch_size(count: int):
+    if not count:
+        raise HTTPException(status_code=400, detail="No files to analyze")
+    if count > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} files per batch")
+
+
+def create_batch(db: Session, current_user: User, file_ids: list[int], max_concurrency: Optional[int]) -> AnalysisBatch:
+    check_batch_size(len(file_ids))
+    owned = {file_id for (file_id,) in db.query(UserFile.id).filter(UserFile.id.in_(file_ids),
+                                                                    UserFile.user_id == current_user.id)}
+    missing = [file_id for file_id in file_ids if file_id not in owned]
+    if missing:
+        raise HTTPException(status_code=404, detail={"message": "File not found", "file_ids": missing})
+    batch = AnalysisBatch(user_id=current_user.id,
+                          max_concurrency=max(1, min(max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)))
+    db.add(batch)
+    db.flush()
+    for file_id in dict.fromkeys(file_ids):
+        db.add(AnalysisJob(user_id=current_user.id, file_id=file_id, batch_id=batch.id))
     db.commit()
+    db.refresh(batch)
+    return batch
+
+
+def batch_to_dict(batch: AnalysisBatch) -> dict:
+    if batch.summary_path and os.path.exists(batch.summary_path):
+        with open(batch.summary_path, "r", encoding="utf-8") as f:
+            summary = json.load(f)
+        summary["status"] = batch.status
+        return summary
+    jobs = batch.jobs
+    finished = [job.finished_at for job in jobs if job.finished_at]
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "error": batch.error,
+        "created_at": batch.created_at.isoformat() if batch.created_at else None,
+        "started_at": batch.started_at.isoformat() if batch.started_at else None,
+        "totals": {
+            "files": len(jobs),
+            "completed": sum(1 for job in jobs if job.status == "completed"),
+            "failed": sum(1 for job in jobs if job.status == "failed"),
+            "cancelled": sum(1 for job in jobs if job.status == "cancelled")
+        },
+        # Audio seconds are only known once the summary has been built.
+        "throughput": batch_throughput(jobs, 0.0, batch.started_at, max(finished) if finished else None),
+        "files": [job_to_dict(job) for job in jobs]
+    }
+
+
+def get_user_batch(batch_id: int, current_user: User, db: Session) -> AnalysisBatch:
+    batch = db.query(AnalysisBatch).filter(AnalysisBatch.id == batch_id,
+                                           AnalysisBatch.user_id == current_user.id).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+
+@router.post("/batch", status_code=202)
+async def analyze_batch(body: BatchCreate, current_user: User = Depends(get_current_user),
+                        db: Session = Depends(get_db)):
+    batch = create_batch(db, current_user, body.file_ids, body.max_concurrency)
+    await run_in_threadpool(dispatch_batch, batch.id)
+    db.refresh(batch)
+    return JSONResponse(status_code=202, content=batch_to_dict(batch))
+
+
+@router.post("/batch/upload", status_code=202)
+async def upload_batch(archive: UploadFile = File(...), max_concurrency: Optional[int] = None,
+                       current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    archive_path = os.path.join(PARTS_DIR, f"{uuid.uuid4().hex}.archive")
+    try:
+        await save_upload(archive, archive_path)
+        extracted = await run_in_threadpool(extract_archive, archive_path, PARTS_DIR, ALLOWED_EXTENSIONS,
+                                            MAX_BATCH_FILES)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
+    except (ValueError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid archive: {e}")
+    finally:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+    if not extracted:
+        raise HTTPException(status_code=400, detail="Archive contains no supported media files")
+    # Checked before anything is stored: the new files are the user's own, so
+    # only the count can fail create_batch.
+    try:
+        check_batch_size(len(extracted))
+    except HTTPException:
+        for _, tmp_path, _, _ in extracted:
+            os.remove(tmp_path)
+        raise
+    user_files = []
+    for filename, tmp_path, file_ext, writer in extracted:
+        sha256, md5 = writer.digests()
+        user_files.append(create_user_file(db, current_user, tmp_path, file_ext, writer.size, sha256, md5, filename))
+    db.flush()
+    batch = create_batch(db, current_user, [user_file.id for user_file in user_files], max_concurrency)
+    await run_in_threadpool(dispatch_batch, batch.id)
+    db.refresh(batch)
+    return JSONResponse(status_code=202, content=batch_to_dict(batch))
+
+
+@router.get("/batch/{batch_id}")
+def get_batch(batch_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    return batch_to_dict(get_user_batch(batch_id, current_user, db))
+
+
+@router.post("/batch/{batch_id}/cancel")
+def cancel_analysis_batch(batch_id: int, current_user: User = Depends(get_current_user),
+                                db: Session = Depends(get_db)):
+    batch = cancel_batch(db, get_user_batch(batch_id, current_user, db))
+    return batch_to_dict(batch)
+
+
+@router.get("/batch/{batch_id}/report")
+def download_batch_report(batch_id: int, request: Request, current_user: User = Depends(get_current_user),
+                                db: Session = Depends(get_db)):
+    batch = get_user_batch(batch_id, current_user, db)
+    if not batch.report_path or not os.path.exists(batch.report_path):
+        raise HTTPException(status_code=404, detail="Report not ready")
+    return evidence_file_response(request, batch.report_path, file_sha256(batch.report_path),
+                                  f"case_report_{batch_id}.pdf", "application/pdf")
+
+
+@router.get("/cache/stats")
+def cache_stats(current_user: User = Depends(get_current_user)):
+    return get_cache().stats()
+
+
+def rescan_to_dict(rescan: KeywordRescan) -> dict:
+    return {
+        "rescan_id": rescan.id,
+        "keyword_version": rescan.keyword_version,
+        "status": rescan.status,
+        "total": rescan.total,
+        "processed": rescan.processed,
+        "updated": rescan.updated,
+        "skipped": rescan.skipped,
+        "new_hits": rescan.new_hits,
+        "error": rescan.error,
+        "created_at": rescan.created_at.isoformat() if rescan.created_at else None,
+        "finished_at": rescan.finished_at.isoformat() if rescan.finished_at else None
+    }
+
+
+@router.get("/keywords")
+def keyword_status(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    matcher = get_keyword_matcher()
+    categories = {}
+    for category in get_keyword_categories().values():
+        categories[category] = categories.get(category, 0) + 1
+    return {
+        "version": matcher.version,
+        "keywords": len(matcher),
+        "categories": categories,
+        "outdated_analyses": outdated_requests(db, current_user.id, matcher.version).count()
+    }
+
+
+@router.post("/rescan", status_code=202)
+def start_rescan(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    # One re-scan per user at a time; asking again returns the running one.
+    rescan = db.query(KeywordRescan).filter(KeywordRescan.user_id == current_user.id,
+                                            KeywordRescan.status.in_(ACTIVE_STATUSES)).first()
+    if rescan is None:
+        rescan = KeywordRescan(user_id=current_user.id, keyword_version=get_keyword_matcher().version)
+        db.add(rescan)
+        db.commit()
+        db.refresh(rescan)
+        if submit_rescan(rescan.id) is None:
+            db.refresh(rescan)
+    return JSONResponse(status_code=202, content=rescan_to_dict(rescan))
+
 
-    return JSONResponse(content=json_response)
\ No newline at end of file
+@router.get("/rescan/{rescan_id}")
+def get_rescan(rescan_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    rescan = db.query(KeywordRescan).filter(KeywordRescan.id == rescan_id,
+                                            KeywordRescan.user_id == current_user.id).first()
+    if not rescan:
+        raise HTTPException(status_code=404, detail="Rescan not found")
+    return rescan_to_dict(rescan)
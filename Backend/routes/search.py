@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import List, Optional
+from models import User
+from auth import get_current_user
+from utils.search_index import MAX_SEARCH_RESULTS, get_search_index
+import sqlite3
+import time
+
+router = APIRouter()
+
+
+@router.get("")
+def search_transcripts(q: str = "", keyword: List[str] = Query([]), category: List[str] = Query([]),
+                       file_id: Optional[int] = None, limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS),
+                       offset: int = Query(0, ge=0), current_user: User = Depends(get_current_user)):
+    if not q.strip() and not keyword and not category:
+        raise HTTPException(status_code=400, detail="Empty search query")
+    started = time.perf_counter()
+    try:
+        results = get_search_index().search(current_user.id, q, keyword, category, file_id, limit, offset)
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid search query: {e}")
+    return {
+        "query": q,
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+
+
+@router.get("/stats")
+def search_stats(current_user: User = Depends(get_current_user)):
+    return get_search_index().stats()
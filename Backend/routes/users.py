@@ -1,19 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from sqlalchemy import func
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from database import get_db
-from models import User, UserFile, AnalysisRequest
-from auth import create_access_token, get_current_user
-from passlib.context import CryptContext
+from models import User, UserFile, AnalysisRequest, Keyframe
+from auth import create_access_token, get_current_user, hash_password, verify_password
+from utils.jobs import REPORT_DIR
+from utils.pdf_generator import generate_pdf_report
+from utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, keyset_page
+from utils.media_delivery import evidence_file_response, file_sha256, proxy_failure, proxy_path, submit_review_proxy
+from utils.metrics import Timings, observe_timings
+from utils.keyframes import MAX_HASH_DISTANCE, keyframe_to_dict, similar_keyframes, user_keyframes
+from utils.segment_store import SegmentStore, load_report, result_page, result_summary, stored_result_exists
 from datetime import datetime
+import threading
+import json
 import os
 
 router = APIRouter()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# A fixed set of locks shared by all report files: one per file would grow
+# with every analysis ever downloaded. Two files on the same lock only wait
+# for each other's render.
+REPORT_LOCK_STRIPES = 64
+_report_locks = [threading.Lock() for _ in range(REPORT_LOCK_STRIPES)]
 
 class UserCreate(BaseModel):
     username: str
@@ -24,33 +38,53 @@ class UserFileResponse(BaseModel):
     id: int
     file_path: str
     file_type: str
+    filename: Optional[str] = None
+    file_size: Optional[int] = None
     upload_date: datetime
 
 class AnalysisRequestResponse(BaseModel):
     id: int
     file_id: int
-    report_path: str
+    report_path: Optional[str] = None
+    hit_count: Optional[int] = None
     request_date: datetime
 
+class ListingFilters(BaseModel):
+    file_type: Optional[str] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+
+    def is_empty(self) -> bool:
+        return self.file_type is None and self.date_from is None and self.date_to is None
+
+# Listings select only the columns they return instead of hydrating ORM objects.
+FILE_LIST_COLUMNS = (UserFile.id, UserFile.file_path, UserFile.file_type, UserFile.filename, UserFile.file_size,
+                     UserFile.upload_date)
+REQUEST_LIST_COLUMNS = (AnalysisRequest.id, AnalysisRequest.file_id, AnalysisRequest.report_path,
+                        AnalysisRequest.hit_count, AnalysisRequest.request_date)
+SORT_PATTERN = r"^-?(id|date)$"
+
+def get_user_by(db: Session, column, value):
+    return db.query(User).filter(column == value).first()
+
 @router.post("/register")
 async def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.username == user.username).first()
+    db_user = await run_in_threadpool(get_user_by, db, User.username, user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    db_email = db.query(User).filter(User.email == user.email).first()
+    db_email = await run_in_threadpool(get_user_by, db, User.email, user.email)
     if db_email:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = await hash_password(user.password)
     db_user = User(username=user.username, hashed_password=hashed_password, email=user.email)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await run_in_threadpool(db.commit)
     return {"message": "User registered successfully"}
 
 @router.post("/login")
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not pwd_context.verify(form_data.password, user.hashed_password):
+    user = await run_in_threadpool(get_user_by, db, User.username, form_data.username)
+    if not user or not await verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -59,61 +93,267 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     access_token = create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
+def filter_files(query, current_user: User, filters: ListingFilters):
+    query = query.filter(UserFile.user_id == current_user.id)
+    if filters.file_type:
+        query = query.filter(UserFile.file_type == filters.file_type.upper())
+    if filters.date_from:
+        query = query.filter(UserFile.upload_date >= filters.date_from)
+    if filters.date_to:
+        query = query.filter(UserFile.upload_date < filters.date_to)
+    return query
+
+def filter_requests(query, current_user: User, filters: ListingFilters, has_hits: Optional[bool]):
+    query = query.filter(AnalysisRequest.user_id == current_user.id)
+    if filters.file_type:
+        query = query.join(UserFile, UserFile.id == AnalysisRequest.file_id).filter(
+            UserFile.file_type == filters.file_type.upper())
+    if filters.date_from:
+        query = query.filter(AnalysisRequest.request_date >= filters.date_from)
+    if filters.date_to:
+        query = query.filter(AnalysisRequest.request_date < filters.date_to)
+    if has_hits is not None:
+        query = query.filter(AnalysisRequest.hit_count > 0 if has_hits else AnalysisRequest.hit_count == 0)
+    return query
+
+def list_page(query, model, date_column, sort: str, limit: int, cursor: Optional[str], response: Response):
+    sort_column = date_column if sort.lstrip("-") == "date" else model.id
+    rows, next_cursor = keyset_page(query, sort_column, model.id, sort.startswith("-"), limit, cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return [row._asdict() for row in rows]
+
 @router.get("/files", response_model=List[UserFileResponse])
-async def get_user_files(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(UserFile).filter(UserFile.user_id == current_user.id).all()
+def get_user_files(response: Response, filters: ListingFilters = Depends(),
+                   sort: str = Query("id", pattern=SORT_PATTERN),
+                   limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None,
+                   current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    query = filter_files(db.query(*FILE_LIST_COLUMNS), current_user, filters)
+    return list_page(query, UserFile, UserFile.upload_date, sort, limit, cursor, response)
+
+@router.get("/files/count")
+def count_user_files(filters: ListingFilters = Depends(), current_user: User = Depends(get_current_user),
+                     db: Session = Depends(get_db)):
+    if filters.is_empty():
+        return {"total": db.query(User.file_count).filter(User.id == current_user.id).scalar() or 0}
+    return {"total": filter_files(db.query(func.count(UserFile.id)), current_user, filters).scalar()}
 
 @router.get("/history", response_model=List[AnalysisRequestResponse])
-async def get_user_history(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(AnalysisRequest).filter(AnalysisRequest.user_id == current_user.id).all()
+def get_user_history(response: Response, filters: ListingFilters = Depends(), has_hits: Optional[bool] = None,
+                     sort: str = Query("id", pattern=SORT_PATTERN),
+                     limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None,
+                     current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    query = filter_requests(db.query(*REQUEST_LIST_COLUMNS), current_user, filters, has_hits)
+    return list_page(query, AnalysisRequest, AnalysisRequest.request_date, sort, limit, cursor, response)
+
+@router.get("/history/count")
+def count_user_history(filters: ListingFilters = Depends(), has_hits: Optional[bool] = None,
+                       current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    if filters.is_empty() and has_hits is None:
+        return {"total": db.query(User.request_count).filter(User.id == current_user.id).scalar() or 0}
+    query = filter_requests(db.query(func.count(AnalysisRequest.id)), current_user, filters, has_hits)
+    return {"total": query.scalar()}
 
 @router.get("/files/download/{file_id}")
-async def download_file(file_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def download_file(file_id: int, request: Request, current_user: User = Depends(get_current_user),
+                  db: Session = Depends(get_db)):
     user_file = db.query(UserFile).filter(UserFile.id == file_id, UserFile.user_id == current_user.id).first()
     if not user_file:
         raise HTTPException(status_code=404, detail="File not found")
     file_path = user_file.file_path
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found on server")
-    return FileResponse(path=file_path, filename=os.path.basename(file_path), media_type="application/octet-stream")
+    return evidence_file_response(request, file_path, user_file.sha256, os.path.basename(file_path))
+
+@router.get("/files/{file_id}/proxy")
+def download_review_proxy(file_id: int, request: Request, current_user: User = Depends(get_current_user),
+                          db: Session = Depends(get_db)):
+    user_file = db.query(UserFile).filter(UserFile.id == file_id, UserFile.user_id == current_user.id).first()
+    if not user_file:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not os.path.exists(user_file.file_path):
+        raise HTTPException(status_code=404, detail="File not found on server")
+    key = user_file.sha256 or f"file_{user_file.id}"
+    path = proxy_path(key)
+    if not os.path.exists(path):
+        submit_review_proxy(user_file.file_path, key)
+        error = proxy_failure(key)
+        if error is not None:
+            return JSONResponse(status_code=422, content={"status": "failed", "error": error})
+        return JSONResponse(status_code=202, content={"status": "pending"})
+    return evidence_file_response(request, path, file_sha256(path), f"{key}.m4a", "audio/mp4")
+
+@router.get("/files/{file_id}/keyframes")
+def list_keyframes(file_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    user_file = db.query(UserFile).filter(UserFile.id == file_id, UserFile.user_id == current_user.id).first()
+    if not user_file:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not user_file.sha256:
+        return []
+    keyframes = db.query(Keyframe).filter(Keyframe.sha256 == user_file.sha256).order_by(Keyframe.timestamp)
+    return [keyframe_to_dict(keyframe) for keyframe in keyframes]
+
+def get_user_keyframe(keyframe_id: int, current_user: User, db: Session) -> Keyframe:
+    keyframe = user_keyframes(db, current_user.id).filter(Keyframe.id == keyframe_id).first()
+    if not keyframe:
+        raise HTTPException(status_code=404, detail="Keyframe not found")
+    return keyframe
+
+@router.get("/keyframes/{keyframe_id}")
+def download_keyframe(keyframe_id: int, request: Request, current_user: User = Depends(get_current_user),
+                      db: Session = Depends(get_db)):
+    keyframe = get_user_keyframe(keyframe_id, current_user, db)
+    if not os.path.exists(keyframe.path):
+        raise HTTPException(status_code=404, detail="Keyframe not found on server")
+    return evidence_file_response(request, keyframe.path, file_sha256(keyframe.path),
+                                  f"keyframe_{keyframe_id}.jpg", "image/jpeg")
+
+@router.get("/keyframes/{keyframe_id}/similar")
+def find_similar_keyframes(keyframe_id: int, max_distance: int = Query(5, ge=0, le=MAX_HASH_DISTANCE),
+                           limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                           current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    keyframe = get_user_keyframe(keyframe_id, current_user, db)
+    return similar_keyframes(db, keyframe, current_user.id, max_distance, limit)
+
+def _report_lock(path: str) -> threading.Lock:
+    # One render per file even if the first downloads arrive together; files
+    # are written under a temporary name and moved into place when complete.
+    return _report_locks[hash(path) % REPORT_LOCK_STRIPES]
+
+
+def render_report(analysis_request: AnalysisRequest, timings: Timings = None) -> str:
+    timings = timings or Timings()
+    report_path = os.path.join(REPORT_DIR, f"report_{analysis_request.id}.pdf")
+    with _report_lock(report_path):
+        if not os.path.exists(report_path):
+            with timings.span("pdf_render"):
+                tmp_path = f"{report_path}.tmp"
+                if analysis_request.segments_path:
+                    # Segments and hits are read from the store as the pages are laid out.
+                    with SegmentStore(analysis_request.segments_path) as store:
+                        generate_pdf_report(store.lazy_result(), tmp_path, timings)
+                else:
+                    generate_pdf_report(load_report(analysis_request)["analysis_result"], tmp_path, timings)
+                os.replace(tmp_path, report_path)
+        return report_path
+
+
+def render_json_export(analysis_request: AnalysisRequest) -> str:
+    # Analyses made before segment stores keep their JSON report as written.
+    if not analysis_request.segments_path:
+        return analysis_request.json_path
+    export_path = os.path.join(REPORT_DIR, f"report_{analysis_request.id}.json")
+    with _report_lock(export_path):
+        # A rescan rewrites the store, which makes an earlier export stale.
+        if (not os.path.exists(export_path)
+                or os.path.getmtime(export_path) < os.path.getmtime(analysis_request.segments_path)):
+            with SegmentStore(analysis_request.segments_path) as store:
+                report = store.report()
+            tmp_path = f"{export_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, export_path)
+        return export_path
+
+
+def record_report_timings(analysis_request: AnalysisRequest, timings: Timings):
+    # The PDF is rendered later than the analysis, so its spans are kept
+    # under "report" next to the analysis spans.
+    if not timings.spans:
+        return
+    observe_timings(timings.to_dict())
+    stored = json.loads(analysis_request.timings) if analysis_request.timings else {}
+    stored["report"] = timings.to_dict()
+    analysis_request.timings = json.dumps(stored)
 
 @router.get("/history/report/{request_id}")
-async def download_report(request_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def download_report(request_id: int, request: Request, current_user: User = Depends(get_current_user),
+                    db: Session = Depends(get_db)):
     analysis_request = db.query(AnalysisRequest).filter(AnalysisRequest.id == request_id, AnalysisRequest.user_id == current_user.id).first()
     if not analysis_request:
         raise HTTPException(status_code=404, detail="Report not found")
     report_path = analysis_request.report_path
-    if not os.path.exists(report_path):
-        raise HTTPException(status_code=404, detail="Report not found on server")
-    return FileResponse(path=report_path, filename=os.path.basename(report_path), media_type="application/pdf")
+    if not report_path or not os.path.exists(report_path):
+        if not stored_result_exists(analysis_request):
+            raise HTTPException(status_code=404, detail="Report not found on server")
+        timings = Timings()
+        report_path = render_report(analysis_request, timings)
+        analysis_request.report_path = report_path
+        record_report_timings(analysis_request, timings)
+        db.commit()
+    return evidence_file_response(request, report_path, file_sha256(report_path), os.path.basename(report_path),
+                                  "application/pdf")
+
+
+@router.get("/history/timings/{request_id}")
+def get_request_timings(request_id: int, current_user: User = Depends(get_current_user),
+                        db: Session = Depends(get_db)):
+    timings = db.query(AnalysisRequest.timings).filter(AnalysisRequest.id == request_id,
+                                                       AnalysisRequest.user_id == current_user.id).first()
+    if timings is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return json.loads(timings[0]) if timings[0] else {"spans": [], "totals": {}}
 
 
 @router.get("/history/json/{request_id}")
-async def download_json_report(
+def download_json_report(
         request_id: int,
+        request: Request,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
 
-    request = db.query(AnalysisRequest).filter(
+    analysis_request = db.query(AnalysisRequest).filter(
         AnalysisRequest.id == request_id,
         AnalysisRequest.user_id == current_user.id
     ).first()
 
-    if not request:
+    if not analysis_request:
         raise HTTPException(status_code=404, detail="Запрос анализа не найден")
 
 
-    if not request.json_path:
+    if not analysis_request.json_path and not analysis_request.segments_path:
         raise HTTPException(status_code=404, detail="JSON отчёт недоступен для этого запроса")
 
 
-    if not os.path.exists(request.json_path):
+    if not stored_result_exists(analysis_request):
         raise HTTPException(status_code=404, detail="JSON файл не найден на сервере")
 
-   
-    return FileResponse(
-        request.json_path,
-        media_type='application/json',
-        filename=f"report_{request_id}.json"
-    )
\ No newline at end of file
+    json_path = render_json_export(analysis_request)
+    return evidence_file_response(
+        request,
+        json_path,
+        file_sha256(json_path),
+        f"report_{request_id}.json",
+        'application/json'
+    )
+
+
+def get_stored_request(request_id: int, current_user: User, db: Session) -> AnalysisRequest:
+    analysis_request = db.query(AnalysisRequest).filter(AnalysisRequest.id == request_id,
+                                                        AnalysisRequest.user_id == current_user.id).first()
+    if not analysis_request:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if not stored_result_exists(analysis_request):
+        raise HTTPException(status_code=404, detail="Report not found on server")
+    return analysis_request
+
+
+@router.get("/history/{request_id}/summary")
+def get_result_summary(request_id: int, current_user: User = Depends(get_current_user),
+                       db: Session = Depends(get_db)):
+    return result_summary(get_stored_request(request_id, current_user, db))
+
+
+@router.get("/history/{request_id}/segments")
+def get_result_segments(request_id: int, offset: int = Query(0, ge=0),
+                        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                        current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    return result_page(get_stored_request(request_id, current_user, db), "segments", offset, limit)
+
+
+@router.get("/history/{request_id}/hits")
+def get_result_hits(request_id: int, offset: int = Query(0, ge=0),
+                    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    return result_page(get_stored_request(request_id, current_user, db), "hits", offset, limit)
\ No newline at end of file
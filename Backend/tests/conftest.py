@@ -0,0 +1,5 @@
+import sys
+import os
+
+# The backend is run from Backend/ and imports its modules top-level.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,16 @@
+from utils.pdf_generator import generate_pdf_report
+
+
+def page_count(path) -> int:
+    with open(path, "rb") as f:
+        return f.read().count(b"/Type /Page\n")
+
+
+def test_segment_longer_than_a_page(tmp_path):
+    # The segment is split across pages; the head has to leave room for the
+    # paragraph spacing or no frame is ever large enough for it.
+    output = tmp_path / "report.pdf"
+    segments = [{"start": 0.0, "end": 600.0, "text": "word " * 3000},
+                {"start": 600.0, "end": 601.0, "text": "tail"}]
+    generate_pdf_report({"transcription": "", "segments": segments, "drug_timestamps": []}, str(output))
+    assert page_count(output) >= 3
@@ -0,0 +1,75 @@
+import pytest
+
+from utils.segment_store import TEXT_BLOCK_SEGMENTS, SegmentStore, write_store
+
+REPORT = {"request_date": "2024-01-01T00:00:00", "file_id": 7, "user_id": 3}
+
+
+def make_result(count: int, hit_every: int = 5) -> dict:
+    segments = [{"start": i * 2.5, "end": i * 2.5 + 2.0, "text": f" segment {i} dealer ünïcode"} for i in range(count)]
+    hits = [{"timestamp": segment["start"], "text": segment["text"], "keywords": ["dealer"],
+             "matches": [{"keyword": "dealer", "start": 12, "end": 18}]}
+            for segment in segments[::hit_every]]
+    return {
+        "transcription": " ".join(segment["text"].strip() for segment in segments),
+        "segments": segments,
+        "drug_timestamps": hits,
+        "duration": count * 2.5,
+        "keyword_version": "abc",
+        "insights": {"word_frequencies": {"dealer": count}},
+    }
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "result.seg")
+    result = make_result(40)
+    write_store(path, result, **REPORT)
+    with SegmentStore(path) as store:
+        assert store.segments() == result["segments"]
+        assert store.hits() == result["drug_timestamps"]
+        assert store.report() == {"analysis_result": result, **REPORT}
+
+
+def test_empty_result(tmp_path):
+    path = str(tmp_path / "result.seg")
+    result = {"transcription": "", "segments": [], "drug_timestamps": [], "duration": 0.0}
+    write_store(path, result, **REPORT)
+    with SegmentStore(path) as store:
+        assert len(store) == 0
+        assert store.hit_count == 0
+        assert store.segments(0, 20) == []
+        assert store.report() == {"analysis_result": result, **REPORT}
+
+
+def test_pages_across_text_blocks(tmp_path):
+    path = str(tmp_path / "result.seg")
+    result = make_result(TEXT_BLOCK_SEGMENTS * 2 + 10, hit_every=7)
+    write_store(path, result, **REPORT)
+    offset = TEXT_BLOCK_SEGMENTS - 5
+    with SegmentStore(path) as store:
+        assert store.segments(offset, 10) == result["segments"][offset:offset + 10]
+        # Out of order, so the cached block has to be switched back.
+        assert store.segment(3) == result["segments"][3]
+        assert store.segments(len(store) - 3, 20) == result["segments"][-3:]
+        hits = result["drug_timestamps"]
+        assert store.hits(30, 10) == hits[30:40]
+
+
+def test_hit_without_segment(tmp_path):
+    result = make_result(3)
+    result["drug_timestamps"].append({"timestamp": 99.0, "text": "elsewhere", "keywords": [], "matches": []})
+    with pytest.raises(ValueError):
+        write_store(str(tmp_path / "result.seg"), result, **REPORT)
+
+
+def test_lazy_result(tmp_path):
+    path = str(tmp_path / "result.seg")
+    result = make_result(TEXT_BLOCK_SEGMENTS + 10)
+    write_store(path, result, **REPORT)
+    with SegmentStore(path) as store:
+        lazy = store.lazy_result()
+        assert len(lazy["segments"]) == len(result["segments"])
+        assert len(lazy["drug_timestamps"]) == len(result["drug_timestamps"])
+        assert list(lazy["segments"]) == result["segments"]
+        assert list(lazy["drug_timestamps"]) == result["drug_timestamps"]
+        assert lazy["insights"] == result["insights"]
@@ -1,82 +1,229 @@
 from utils.whisper_utils import transcribe_audio
+from utils.keyword_matcher import KeywordMatcher
+from utils.transcribers import Segment, Transcription
+from utils.text_analytics import analyze_text, hit_entry
+from utils.cache import get_cache, PIPELINE_VERSION, ANALYSIS_VERSION
+from utils.metrics import Timings
+from utils.audio_io import SAMPLE_RATE, VIDEO_EXTENSIONS, AudioExtractionError, is_video, run_ffmpeg
+from utils.keyframes import (VIDEO_KEYFRAMES, collect_keyframes, discard_keyframes, extract_keyframes, keyframe_dir,
+                             keyframe_outputs, prepare_keyframes)
 import os
-import subprocess
 import uuid
-import re
+import time
 import logging
+import threading
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+LOG_PREVIEW_CHARS = 200
+
 
 def extract_audio_from_video(video_path: str, output_dir: str = "temp") -> str:
+    # File-based extraction; the analysis pipeline itself streams PCM from
+    # ffmpeg (see utils.audio_io.stream_pcm) and never writes a WAV.
     os.makedirs(output_dir, exist_ok=True)
     audio_path = os.path.join(output_dir, f"{uuid.uuid4().hex}.wav")
-
-    command = [
-        "ffmpeg",
-        "-i", video_path,
-        "-vn",
-        "-acodec", "pcm_s16le",
-        "-ar", "16000",
-        "-ac", "1",
-        audio_path
-    ]
-
     try:
-        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        run_ffmpeg(["-i", video_path, "-vn", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", audio_path])
         return audio_path
-    except subprocess.CalledProcessError:
-        logger.error(f"Ошибка извлечения аудио из {video_path}")
+    except (OSError, AudioExtractionError) as e:
+        logger.error(f"Ошибка извлечения аудио из {video_path}: {e}")
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
         return None
 
 
-def load_keywords_from_file(filepath: str = os.path.join(os.path.dirname(__file__), "keywords.txt")) -> list[str]:
-    logger.info(f"Попытка загрузки ключевых слов из: {filepath}")
+KEYWORDS_FILE = os.path.join(os.path.dirname(__file__), "keywords.txt")
+DEFAULT_CATEGORY = "general"
+KEYWORDS_RELOAD_INTERVAL = float(os.getenv("KEYWORDS_RELOAD_INTERVAL", "5"))
+
+_keyword_matcher = None
+_keyword_categories = {}
+_keywords_stamp = None
+_keywords_checked = 0.0
+_keywords_lock = threading.Lock()
+
+
+def load_keyword_categories(filepath: str = KEYWORDS_FILE) -> dict[str, str]:
+    # "[name]" lines start a category; keywords before the first one are "general".
+    categories = {}
     if not os.path.exists(filepath):
         logger.error(f"Файл ключевых слов не найден: {filepath}")
-        return []
+        return categories
+    category = DEFAULT_CATEGORY
     with open(filepath, "r", encoding="utf-8") as f:
-        return [line.strip().lower() for line in f if line.strip()]
+        for line in f:
+            line = line.strip()
+            if line.startswith("[") and line.endswith("]"):
+                category = line[1:-1].strip().lower() or DEFAULT_CATEGORY
+            elif line:
+                categories.setdefault(line.lower(), category)
+    return categories
+
+
+def load_keywords_from_file(filepath: str = KEYWORDS_FILE) -> list[str]:
+    logger.info(f"Попытка загрузки ключевых слов из: {filepath}")
+    return list(load_keyword_categories(filepath))
 
 
-def clean_text(text: str) -> str:
-    text = re.sub(r"['’]s\b", "", text, flags=re.IGNORECASE)
-    text = re.sub(r"[^\w\s]", " ", text)
-    return text.lower()
+def _file_stamp(filepath: str):
+    try:
+        stat = os.stat(filepath)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
 
 
-def analyze_media(file_path: str):
+def get_keyword_matcher() -> KeywordMatcher:
+    """The matcher for the current keywords.txt, reloaded when the file changes.
+
+    The file is stat()ed at most every KEYWORDS_RELOAD_INTERVAL seconds and
+    only re-parsed when its mtime or size differ; matcher.version (a hash of
+    the keyword list) tells whether the keywords themselves changed.
+    """
+    global _keyword_matcher, _keyword_categories, _keywords_stamp, _keywords_checked
+    now = time.monotonic()
+    if _keyword_matcher is not None and now - _keywords_checked < KEYWORDS_RELOAD_INTERVAL:
+        return _keyword_matcher
+    with _keywords_lock:
+        _keywords_checked = now
+        stamp = _file_stamp(KEYWORDS_FILE)
+        if _keyword_matcher is None or stamp != _keywords_stamp:
+            categories = load_keyword_categories(KEYWORDS_FILE)
+            matcher = KeywordMatcher(list(categories))
+            if _keyword_matcher is None or matcher.version != _keyword_matcher.version:
+                logger.info(f"Загружено ключевых слов: {len(matcher)}, версия {matcher.version}")
+                _keyword_matcher = matcher
+            _keyword_categories = categories
+            _keywords_stamp = stamp
+    return _keyword_matcher
+
+
+def get_keyword_categories() -> dict[str, str]:
+    get_keyword_matcher()
+    return _keyword_categories
+
+
+def match_keywords(segments: list[Segment], matcher: KeywordMatcher) -> list[dict]:
+    timestamps = []
+    for segment in segments:
+        matches = matcher.find(segment.text or "")
+        if matches:
+            timestamps.append(hit_entry(segment, matches))
+    return timestamps
+
+
+def transcription_summary(result: dict) -> str:
+    # Bounded, whatever the length of the recording.
+    text = result.get("text") or ""
+    segments = result.get("segments") or []
+    preview = text[:LOG_PREVIEW_CHARS] + ("…" if len(text) > LOG_PREVIEW_CHARS else "")
+    end = max((segment.end for segment in segments), default=0.0)
+    return f"сегментов: {len(segments)}, символов: {len(text)}, длительность: {end:.1f} с, начало: {preview!r}"
+
+
+def transcribe_media(file_path: str, progress, on_segments=None, timings: Timings = None,
+                     keyframes_dir: str = None) -> dict:
     file_ext = os.path.splitext(file_path)[1].lower()
 
-    if file_ext in ['.mp4', '.avi', '.mov', '.mkv']:
-        audio_path = extract_audio_from_video(file_path)
-        if not audio_path or not os.path.exists(audio_path):
-            return {"error": "Failed to extract audio from video"}
-        file_path = audio_path
-
-    if file_ext in ['.mp3', '.wav'] or file_path.endswith(".wav"):
-        transcription = transcribe_audio(file_path)
-        logger.info(f"Результат транскрипции: {transcription}")
-        if "error" in transcription:
-            return {"error": transcription["error"]}
-
-        keywords = load_keywords_from_file()
-        timestamps = []
-        for segment in transcription.get("segments", []):
-            text = segment.text if segment.text else ""
-            cleaned_text = clean_text(text)
-            matches = [keyword for keyword in keywords if keyword in cleaned_text]
-            if matches:
-                timestamps.append({
-                    "timestamp": segment.start,
-                    "text": text,
-                    "keywords": matches
-                })
-
-        return {
-            "transcription": transcription.get("text"),
-            "drug_timestamps": timestamps
-        }
-
-    return {"error": "Unsupported file format"}
\ No newline at end of file
+    if file_ext in VIDEO_EXTENSIONS or file_ext in ['.mp3', '.wav']:
+        # Video audio is decoded by ffmpeg straight into the chunker.
+        progress("extracting" if file_ext in VIDEO_EXTENSIONS else "transcribing", 5)
+        transcription = transcribe_audio(
+            file_path, on_segments=on_segments, timings=timings,
+            extra_outputs=keyframe_outputs(keyframes_dir) if keyframes_dir else None,
+            progress=lambda done, total: progress("transcribing", 20 + 60 * done // total, chunk=done, chunks=total))
+        if "error" not in transcription:
+            logger.info(f"Результат транскрипции: {transcription_summary(transcription)}")
+        return transcription
+
+    return {"error": "Unsupported file format"}
+
+
+def analyze_media(file_path: str, progress=None, media_hash: str = None, on_hits=None, timings: Timings = None):
+    """Transcribe and analyse one media file.
+
+    on_hits, if given, receives the keyword hits of every transcribed chunk
+    as soon as it is done, before the whole recording is transcribed.
+    Stage durations are added to `timings`. With VIDEO_KEYFRAMES=1, videos
+    also get scene keyframes (see utils.keyframes).
+    """
+    if progress is None:
+        progress = lambda stage, percent, **details: None
+    timings = timings or Timings()
+    # Keyframes are kept per content hash; without one they could never be found again.
+    keyframes_dir = keyframe_dir(media_hash) if VIDEO_KEYFRAMES and media_hash and is_video(file_path) else None
+
+    matcher = get_keyword_matcher()
+    cache = get_cache() if media_hash else None
+    transcript_key = f"{media_hash}:{PIPELINE_VERSION}"
+    analysis_key = f"{transcript_key}:{ANALYSIS_VERSION}:{matcher.version}"
+
+    if cache is not None:
+        with timings.span("cache_lookup", namespace="analysis"):
+            cached = cache.get("analysis", analysis_key)
+        if cached is not None:
+            logger.info(f"Результат анализа взят из кэша: {analysis_key}")
+            if keyframes_dir is not None and "keyframes" not in cached:
+                with timings.span("keyframes"):
+                    cached["keyframes"] = extract_keyframes(file_path, keyframes_dir)
+            return cached
+
+    cached = None
+    if cache is not None:
+        with timings.span("cache_lookup", namespace="transcript"):
+            cached = cache.get("transcript", transcript_key)
+    keyframes = None
+    if cached is None:
+        on_segments = (lambda segments: on_hits(match_keywords(segments, matcher))) if on_hits else None
+        # Keyframes are written by the same ffmpeg process that decodes the audio.
+        work_dir = prepare_keyframes(file_path, keyframes_dir) if keyframes_dir else None
+        with timings.span("transcribe"):
+            result = transcribe_media(file_path, progress, on_segments, timings, work_dir)
+        if result.get("extraction_error") and work_dir is not None:
+            # The video outputs must never cost the audio analysis: when ffmpeg
+            # failed, the audio is decoded again on its own and the keyframes
+            # are extracted separately below. Transcription errors are not
+            # retried, that would only send every chunk to the API again.
+            logger.error(f"Ошибка совместного извлечения звука и ключевых кадров, повтор без кадров: {result['error']}")
+            discard_keyframes(work_dir)
+            work_dir = None
+            with timings.span("transcribe"):
+                result = transcribe_media(file_path, progress, on_segments, timings)
+        if "error" in result:
+            if work_dir is not None:
+                discard_keyframes(work_dir)
+            return {"error": result["error"]}
+        if work_dir is not None:
+            try:
+                keyframes = collect_keyframes(work_dir, keyframes_dir)
+            except OSError as e:
+                logger.error(f"Ошибка чтения ключевых кадров {work_dir}: {e}")
+                discard_keyframes(work_dir)
+        transcription = Transcription(text=result["text"], segments=result["segments"])
+        if cache is not None:
+            cache.put("transcript", transcript_key, transcription.to_dict())
+    else:
+        logger.info(f"Транскрипция взята из кэша: {transcript_key}")
+        transcription = Transcription.from_dict(cached)
+
+    progress("matching", 80)
+    with timings.span("keyword_match"):
+        analytics = analyze_text(transcription.segments, matcher)
+    result = {
+        "transcription": transcription.text,
+        "duration": max((s.end for s in transcription.segments), default=0.0),
+        "segments": [segment.to_dict() for segment in transcription.segments],
+        "drug_timestamps": analytics.pop("drug_timestamps"),
+        "keyword_version": matcher.version,
+        "insights": analytics
+    }
+    if keyframes_dir is not None:
+        if keyframes is None:
+            with timings.span("keyframes"):
+                keyframes = extract_keyframes(file_path, keyframes_dir)
+        result["keyframes"] = keyframes
+    if cache is not None:
+        cache.put("analysis", analysis_key, result)
+    return result
@@ -0,0 +1,89 @@
+from collections import deque
+import subprocess
+import threading
+import wave
+import os
+
+SAMPLE_RATE = 16000
+BLOCK_BYTES = 64 * 1024
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv'}
+STDERR_TAIL_LINES = 20
+
+
+class AudioExtractionError(Exception):
+    pass
+
+
+def is_video(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def is_pcm16_mono(file_path: str, rate: int = SAMPLE_RATE) -> bool:
+    # A mono 16-bit PCM WAV at `rate` is already what ffmpeg would produce and
+    # needs no decoding at all. Other rates are resampled: chunks are cut by
+    # duration, and at 44.1 kHz a chunk would far exceed the request limit.
+    try:
+        with wave.open(file_path, "rb") as wav:
+            return (wav.getnchannels() == 1 and wav.getsampwidth() == 2 and wav.getcomptype() == "NONE"
+                    and wav.getframerate() == rate)
+    except (wave.Error, EOFError, OSError):
+        return False
+
+
+def probe_duration(file_path: str):
+    try:
+        out = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0",
+                              file_path], capture_output=True, text=True, check=True).stdout
+        return float(out.strip())
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+
+def _drain(stream, lines: deque):
+    for line in iter(stream.readline, b""):
+        lines.append(line.decode("utf-8", errors="replace").rstrip())
+    stream.close()
+
+
+def run_ffmpeg(args: list[str]):
+    # stderr is kept so that failures are diagnosable.
+    command = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y"] + args
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        tail = result.stderr.decode("utf-8", errors="replace").strip().splitlines()[-STDERR_TAIL_LINES:]
+        raise AudioExtractionError(f"ffmpeg exited with code {result.returncode}: {' | '.join(tail)}")
+
+
+def stream_pcm(file_path: str, rate: int = SAMPLE_RATE, extra_outputs: list[str] = None):
+    """Yield raw s16le mono PCM blocks decoded by ffmpeg, without temp files.
+
+    extra_outputs are more ffmpeg outputs (e.g. video keyframes) written by
+    the same process, so the input is read and demuxed only once.
+    """
+    command = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-i", file_path, "-vn",
+               "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(rate), "-ac", "1", "pipe:1"]
+    command += extra_outputs or []
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_lines = deque(maxlen=STDERR_TAIL_LINES)
+    drainer = threading.Thread(target=_drain, args=(process.stderr, stderr_lines), daemon=True)
+    drainer.start()
+    try:
+        while block := process.stdout.read(BLOCK_BYTES):
+            yield block
+        returncode = process.wait()
+        drainer.join()
+        if returncode != 0:
+            raise AudioExtractionError(f"ffmpeg exited with code {returncode}: {' | '.join(stderr_lines)}")
+    finally:
+        # Runs on errors and when the consumer stops early as well.
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+
+def read_wav_blocks(file_path: str):
+    frames_per_block = BLOCK_BYTES // 2
+    with wave.open(file_path, "rb") as wav:
+        while block := wav.readframes(frames_per_block):
+            yield block
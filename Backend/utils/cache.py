@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+import json
+import time
+import zlib
+import os
+
+from utils.metrics import Counter, Gauge, registry, safe_collect
+
+CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "cache")
+CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(1024 ** 3)))
+
+# Bump whenever transcription or analysis output changes shape or meaning,
+# so results produced by an older pipeline are not served from the cache.
+PIPELINE_VERSION = "1"
+# Same for the analysis stage alone; bumping it keeps cached transcripts valid.
+ANALYSIS_VERSION = "4"
+
+
+class ResultCache:
+    """Size-bounded LRU cache of JSON results kept in a local SQLite file.
+
+    SQLite gives us atomic puts and shared hit/miss counters across the
+    analysis worker processes without any extra service.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (namespace TEXT, key TEXT, value BLOB, size INTEGER, "
+                         "last_access REAL, PRIMARY KEY (namespace, key))")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_last_access ON entries (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, conn, name: str):
+        conn.execute("INSERT INTO counters (name, value) VALUES (?, 1) "
+                     "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, namespace: str, key: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM entries WHERE namespace = ? AND key = ?",
+                               (namespace, key)).fetchone()
+            if row is None:
+                self._count(conn, f"{namespace}.misses")
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                         (time.time(), namespace, key))
+            self._count(conn, f"{namespace}.hits")
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, namespace: str, key: str, value):
+        blob = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries (namespace, key, value, size, last_access) "
+                         "VALUES (?, ?, ?, ?, ?)", (namespace, key, blob, len(blob), time.time()))
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT namespace, key, size FROM entries ORDER BY last_access").fetchall()
+        for namespace, key, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            self._count(conn, f"{namespace}.evictions")
+            total -= size
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "counters": counters}
+
+
+_cache = None
+
+
+def get_cache() -> ResultCache:
+    global _cache
+    if _cache is None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _cache = ResultCache(os.path.join(CACHE_DIR, "results.db"), CACHE_MAX_BYTES)
+    return _cache
+
+
+def _cache_counters() -> dict:
+    # "transcript.hits" -> ("transcript", "hits")
+    return {tuple(name.rsplit(".", 1)): value for name, value in get_cache().stats()["counters"].items()}
+
+
+def _cache_hit_ratio() -> dict:
+    counters = _cache_counters()
+    namespaces = {namespace for namespace, _ in counters}
+    ratios = {}
+    for namespace in namespaces:
+        hits, misses = counters.get((namespace, "hits"), 0), counters.get((namespace, "misses"), 0)
+        if hits + misses:
+            ratios[(namespace,)] = round(hits / (hits + misses), 4)
+    return ratios
+
+
+registry.register(Counter("result_cache_events_total", "Result cache hits, misses and evictions.",
+                          ("namespace", "event"), collect=safe_collect(_cache_counters)))
+registry.register(Gauge("result_cache_hit_ratio", "Result cache hits / lookups since the cache was created.",
+                        ("namespace",), collect=safe_collect(_cache_hit_ratio)))
+registry.register(Gauge("result_cache_bytes", "Compressed size of the result cache.",
+                        collect=safe_collect(lambda: {(): get_cache().stats()["bytes"]})))
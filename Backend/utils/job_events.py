@@ -0,0 +1,119 @@
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from fastapi import Request
+from typing import Optional
+import threading
+import logging
+import asyncio
+import json
+import time
+import os
+
+from database import SessionLocal
+from models import AnalysisJob, JobEvent
+
+logger = logging.getLogger(__name__)
+
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", "0.5"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_RETRY_MS = 3000
+EVENTS_PER_POLL = 500
+# Events of a finished job are only read by clients still following it; the
+# job row keeps its final state. Pruned at most every PRUNE_INTERVAL seconds.
+JOB_EVENTS_RETENTION_HOURS = float(os.getenv("JOB_EVENTS_RETENTION_HOURS", "24"))
+PRUNE_INTERVAL = 600
+
+_last_prune = None
+_prune_lock = threading.Lock()
+
+TERMINAL_EVENTS = ("completed", "failed", "cancelled")
+
+
+def add_event(db, job_id: int, event_type: str, **data):
+    # Added to the caller's session, so the event commits together with the
+    # job state it describes.
+    db.add(JobEvent(job_id=job_id, type=event_type, data=json.dumps(data, ensure_ascii=False)))
+
+
+def record_event(job_id: int, event_type: str, **data):
+    db = SessionLocal()
+    try:
+        add_event(db, job_id, event_type, **data)
+        db.commit()
+    finally:
+        db.close()
+
+
+def prune_events(force: bool = False) -> int:
+    """Deletes the events of jobs finished more than JOB_EVENTS_RETENTION_HOURS ago."""
+    global _last_prune
+    with _prune_lock:
+        now = time.monotonic()
+        if not force and _last_prune is not None and now - _last_prune < PRUNE_INTERVAL:
+            return 0
+        _last_prune = now
+    cutoff = datetime.utcnow() - timedelta(hours=JOB_EVENTS_RETENTION_HOURS)
+    finished = select(AnalysisJob.id).where(AnalysisJob.status.in_(TERMINAL_EVENTS), AnalysisJob.finished_at < cutoff)
+    db = SessionLocal()
+    try:
+        deleted = db.query(JobEvent).filter(JobEvent.job_id.in_(finished)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    if deleted:
+        logger.info(f"Удалено событий завершённых задач: {deleted}")
+    return deleted
+
+
+def events_after(job_id: int, last_id: int) -> tuple[list[dict], Optional[str]]:
+    """Events of a job newer than last_id, and the job's current status."""
+    db = SessionLocal()
+    try:
+        status = db.query(AnalysisJob.status).filter(AnalysisJob.id == job_id).scalar()
+        rows = db.query(JobEvent).filter(JobEvent.job_id == job_id, JobEvent.id > last_id) \
+            .order_by(JobEvent.id).limit(EVENTS_PER_POLL).all()
+        return [{"id": row.id, "type": row.type, "data": json.loads(row.data or "{}")} for row in rows], status
+    finally:
+        db.close()
+
+
+def format_sse(event_type: str, data: dict, event_id: Optional[int] = None) -> str:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream_job_events(request: Request, job_id: int, last_id: int = 0, job_state=None):
+    """Server-sent events of one analysis job, ending after its final event.
+
+    Workers may run in other processes, so events are read back from the
+    database. Last-Event-ID lets a reconnecting client continue where it
+    stopped; comment lines keep idle connections open through proxies.
+    job_state() describes a job that finished without recorded events.
+    """
+    yield f"retry: {SSE_RETRY_MS}\n\n"
+    last_sent = time.monotonic()
+    while True:
+        events, status = await run_in_threadpool(events_after, job_id, last_id)
+        for event in events:
+            last_id = event["id"]
+            yield format_sse(event["type"], event["data"], event["id"])
+            last_sent = time.monotonic()
+            if event["type"] in TERMINAL_EVENTS:
+                return
+        if status is None:
+            return
+        if not events and status in TERMINAL_EVENTS:
+            data = await run_in_threadpool(job_state) if job_state else {}
+            yield format_sse(status, data)
+            return
+        if len(events) == EVENTS_PER_POLL:
+            continue
+        if await request.is_disconnected():
+            return
+        if time.monotonic() - last_sent >= SSE_HEARTBEAT_SECONDS:
+            yield ": keepalive\n\n"
+            last_sent = time.monotonic()
+        await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
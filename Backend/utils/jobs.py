@@ -0,0 +1,493 @@
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor, Future
+from datetime import datetime
+from sqlalchemy import func
+from typing import Optional
+import threading
+import logging
+import json
+import time
+import os
+
+from database import SessionLocal, engine
+from models import AnalysisJob, AnalysisRequest, AnalysisBatch, KeywordRescan, UserFile
+from utils.analysis import analyze_media
+from utils.pdf_generator import generate_case_report
+from utils.search_index import index_analysis
+from utils.segment_store import load_report, write_json_report, write_store
+from utils.keyframes import store_keyframes
+from utils.rescan import update_rescan, run_rescan_job
+from utils.job_events import add_event, prune_events, record_event
+from utils.metrics import Gauge, Timings, analysis_jobs_total, observe_timings, registry, safe_collect
+
+logger = logging.getLogger(__name__)
+
+REPORT_DIR = "documents"
+WORKER_BACKEND = os.getenv("ANALYSIS_WORKER_BACKEND", "process")
+MAX_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", str(MAX_WORKERS)))
+
+ACTIVE_STATUSES = ("queued", "running")
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+os.makedirs(REPORT_DIR, exist_ok=True)
+
+_executor = None
+_futures: dict[int, Future] = {}
+_lock = threading.Lock()
+_batch_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _queue_depth() -> dict:
+    db = SessionLocal()
+    try:
+        counts = dict(db.query(AnalysisJob.status, func.count(AnalysisJob.id))
+                      .filter(AnalysisJob.status.in_(ACTIVE_STATUSES)).group_by(AnalysisJob.status).all())
+    finally:
+        db.close()
+    return {(status,): counts.get(status, 0) for status in ACTIVE_STATUSES}
+
+
+registry.register(Gauge("analysis_queue_depth", "Analysis jobs waiting or running, across all workers.",
+                        ("status",), collect=safe_collect(_queue_depth)))
+
+
+def _init_worker():
+    # Forked workers must not reuse the parent's pooled connections.
+    engine.dispose(close=False)
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            if WORKER_BACKEND == "thread":
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="analysis")
+            else:
+                _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=_init_worker)
+            logger.info(f"Пул анализа запущен: {WORKER_BACKEND}, воркеров: {MAX_WORKERS}")
+        return _executor
+
+
+def _submit(fn, *args) -> Future:
+    # A process pool is broken for good once one of its workers dies (e.g.
+    # killed for memory on a long video); it is replaced and the task
+    # submitted to the new one.
+    global _executor
+    executor = get_executor()
+    try:
+        return executor.submit(fn, *args)
+    except BrokenExecutor:
+        with _lock:
+            if _executor is executor:
+                _executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.error("Пул анализа сломан, запускается новый")
+        return get_executor().submit(fn, *args)
+
+
+def submit_job(job_id: int) -> Optional[Future]:
+    """Submits a job; None when even a fresh pool refused it and the job was marked failed."""
+    try:
+        future = _submit(run_analysis_job, job_id)
+    except (BrokenExecutor, RuntimeError) as e:
+        logger.error(f"Не удалось поставить задачу анализа {job_id} в очередь: {e}")
+        _update_job(job_id, event=("failed", {"error": str(e)}), status="failed", error=str(e),
+                    finished_at=datetime.utcnow())
+        return None
+    with _lock:
+        _futures[job_id] = future
+    future.add_done_callback(lambda f: _job_done(job_id, f))
+    return future
+
+
+def submit_rescan(rescan_id: int) -> Optional[Future]:
+    # Re-scans are idempotent (only outdated records are touched), so a
+    # recovered one simply starts over.
+    try:
+        future = _submit(run_rescan_job, rescan_id)
+    except (BrokenExecutor, RuntimeError) as e:
+        logger.error(f"Не удалось запустить повторный поиск {rescan_id}: {e}")
+        update_rescan(rescan_id, status="failed", error=str(e), finished_at=datetime.utcnow())
+        return None
+    future.add_done_callback(lambda f: _rescan_done(rescan_id, f))
+    return future
+
+
+def _rescan_done(rescan_id: int, future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        # The worker died before it could record the failure itself; a
+        # rescan left "running" would block the user's next one.
+        logger.error(f"Повторный поиск {rescan_id} завершился с ошибкой: {future.exception()}")
+        update_rescan(rescan_id, status="failed", error=str(future.exception()), finished_at=datetime.utcnow())
+
+
+def _job_done(job_id: int, future: Future):
+    with _lock:
+        _futures.pop(job_id, None)
+    if not future.cancelled() and future.exception() is not None:
+        # The worker died before it could record the failure itself.
+        logger.error(f"Задача анализа {job_id} завершилась с ошибкой: {future.exception()}")
+        _update_job(job_id, event=("failed", {"error": str(future.exception())}), status="failed",
+                    error=str(future.exception()), finished_at=datetime.utcnow())
+    db = SessionLocal()
+    try:
+        row = db.query(AnalysisJob.batch_id, AnalysisJob.status, AnalysisRequest.timings) \
+            .outerjoin(AnalysisRequest, AnalysisRequest.id == AnalysisJob.request_id) \
+            .filter(AnalysisJob.id == job_id).first()
+    finally:
+        db.close()
+    if row is None:
+        return
+    batch_id, status, timings = row
+    analysis_jobs_total.inc(status=status)
+    if timings:
+        observe_timings(json.loads(timings))
+    prune_events()
+    if batch_id is not None:
+        # Done callbacks may run while dispatch_batch holds its lock, so hand off.
+        threading.Thread(target=dispatch_batch, args=(batch_id,), daemon=True).start()
+
+
+def cancel_job(db, job: AnalysisJob) -> AnalysisJob:
+    if job.status in FINAL_STATUSES:
+        return job
+    with _lock:
+        future = _futures.get(job.id)
+    if (future is not None and future.cancel()) or (future is None and job.status == "queued"):
+        # Either cancelled before a worker picked it up, or still waiting for
+        # a batch slot and never submitted.
+        job.status = "cancelled"
+        job.stage = "cancelled"
+        job.finished_at = datetime.utcnow()
+        add_event(db, job.id, "cancelled")
+    else:
+        # Already picked up by a worker: it stops at the next stage boundary.
+        job.cancel_requested = True
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def recover_jobs():
+    db = SessionLocal()
+    try:
+        jobs = db.query(AnalysisJob).filter(AnalysisJob.status.in_(ACTIVE_STATUSES)).all()
+        for job in jobs:
+            job.status = "queued"
+            job.stage = "queued"
+            job.progress = 0
+        batches = db.query(AnalysisBatch).filter(AnalysisBatch.status.in_(ACTIVE_STATUSES + ("finalizing",))).all()
+        for batch in batches:
+            if batch.status == "finalizing":
+                batch.status = "running"
+        rescans = db.query(KeywordRescan).filter(KeywordRescan.status.in_(ACTIVE_STATUSES)).all()
+        for rescan in rescans:
+            rescan.status = "queued"
+        db.commit()
+        job_ids = [job.id for job in jobs if job.batch_id is None]
+        batch_ids = [batch.id for batch in batches]
+        rescan_ids = [rescan.id for rescan in rescans]
+    finally:
+        db.close()
+    for job_id in job_ids:
+        submit_job(job_id)
+    for batch_id in batch_ids:
+        dispatch_batch(batch_id)
+    for rescan_id in rescan_ids:
+        submit_rescan(rescan_id)
+    prune_events(force=True)
+    if job_ids or batch_ids or rescan_ids:
+        logger.info(f"Повторно поставлено в очередь задач: {len(job_ids)}, пакетов: {len(batch_ids)}, "
+                    f"повторных поисков: {len(rescan_ids)}")
+
+
+def shutdown(wait: bool = False):
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def dispatch_batch(batch_id: int):
+    # Keeps at most batch.max_concurrency jobs of the batch in the pool and
+    # schedules the case-level summary once every job has finished.
+    with _batch_lock:
+        db = SessionLocal()
+        try:
+            batch = db.query(AnalysisBatch).filter(AnalysisBatch.id == batch_id).first()
+            if batch is None or batch.status not in ACTIVE_STATUSES:
+                return
+            active = db.query(AnalysisJob.id).filter(AnalysisJob.batch_id == batch_id,
+                                                     AnalysisJob.status.in_(ACTIVE_STATUSES)) \
+                .order_by(AnalysisJob.id).all()
+            with _lock:
+                in_flight = sum(1 for (job_id,) in active if job_id in _futures)
+                waiting = [job_id for (job_id,) in active if job_id not in _futures]
+            to_submit = waiting[:max(0, batch.max_concurrency - in_flight)]
+            if batch.status == "queued" and to_submit:
+                batch.status = "running"
+                batch.started_at = datetime.utcnow()
+            finalize = not active
+            if finalize:
+                batch.status = "finalizing"
+            db.commit()
+        finally:
+            db.close()
+        refused = [job_id for job_id in to_submit if submit_job(job_id) is None]
+    if refused:
+        # Those jobs are failed now and free their slots; no done callback
+        # will come for them, so dispatch again.
+        threading.Thread(target=dispatch_batch, args=(batch_id,), daemon=True).start()
+    if finalize:
+        try:
+            future = _submit(finalize_batch, batch_id)
+        except (BrokenExecutor, RuntimeError) as e:
+            _batch_failed(batch_id, e)
+            return
+        future.add_done_callback(lambda f: _batch_done(batch_id, f))
+
+
+def _batch_done(batch_id: int, future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        _batch_failed(batch_id, future.exception())
+
+
+def _batch_failed(batch_id: int, error: BaseException):
+    logger.error(f"Ошибка формирования сводки пакета {batch_id}: {error}")
+    db = SessionLocal()
+    try:
+        batch = db.query(AnalysisBatch).filter(AnalysisBatch.id == batch_id).first()
+        batch.status = "failed"
+        batch.error = str(error)
+        batch.finished_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+
+def cancel_batch(db, batch: AnalysisBatch) -> AnalysisBatch:
+    if batch.status not in ACTIVE_STATUSES:
+        return batch
+    batch.cancel_requested = True
+    db.commit()
+    for job in batch.jobs:
+        cancel_job(db, job)
+    dispatch_batch(batch.id)
+    db.refresh(batch)
+    return batch
+
+
+def batch_throughput(jobs: list, audio_seconds: float, started_at, finished_at) -> dict:
+    done = sum(1 for job in jobs if job.status == "completed")
+    elapsed = (finished_at - started_at).total_seconds() if started_at and finished_at else 0.0
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "files_per_minute": round(done / elapsed * 60, 3) if elapsed > 0 else None,
+        "audio_seconds_per_second": round(audio_seconds / elapsed, 3) if elapsed > 0 else None
+    }
+
+
+def _load_result(request: AnalysisRequest) -> dict:
+    report = load_report(request)
+    return report.get("analysis_result", {}) if report else {}
+
+
+def finalize_batch(batch_id: int):
+    db = SessionLocal()
+    try:
+        batch = db.query(AnalysisBatch).filter(AnalysisBatch.id == batch_id).first()
+        if batch is None or batch.status != "finalizing":
+            return
+        jobs = batch.jobs
+        files = []
+        keyword_hits = {}
+        audio_seconds = 0.0
+        for job in jobs:
+            result = _load_result(job.request) if job.status == "completed" else {}
+            hits = result.get("drug_timestamps", [])
+            keywords = {}
+            for hit in hits:
+                for keyword in hit["keywords"]:
+                    keywords[keyword] = keywords.get(keyword, 0) + 1
+            for keyword, count in keywords.items():
+                entry = keyword_hits.setdefault(keyword, {"keyword": keyword, "count": 0, "files": []})
+                entry["count"] += count
+                entry["files"].append(job.file_id)
+            audio_seconds += result.get("duration") or 0.0
+            files.append({
+                "file_id": job.file_id,
+                "filename": job.file.filename if job.file else None,
+                "job_id": job.id,
+                "request_id": job.request_id,
+                "status": job.status,
+                "error": job.error,
+                "hit_count": len(hits),
+                "keywords": sorted(keywords, key=keywords.get, reverse=True),
+                "duration": result.get("duration")
+            })
+
+        finished = [job.finished_at for job in jobs if job.finished_at]
+        last_finished = max(finished) if finished else datetime.utcnow()
+        throughput = batch_throughput(jobs, audio_seconds, batch.started_at, last_finished)
+        completed = sum(1 for job in jobs if job.status == "completed")
+        if batch.cancel_requested:
+            status = "cancelled"
+        else:
+            status = "completed" if completed else "failed"
+        summary = {
+            "batch_id": batch.id,
+            "user_id": batch.user_id,
+            "status": status,
+            "created_at": batch.created_at.isoformat(),
+            "started_at": batch.started_at.isoformat() if batch.started_at else None,
+            "finished_at": last_finished.isoformat(),
+            "totals": {
+                "files": len(jobs),
+                "completed": completed,
+                "failed": sum(1 for job in jobs if job.status == "failed"),
+                "cancelled": sum(1 for job in jobs if job.status == "cancelled"),
+                "hits": sum(f["hit_count"] for f in files),
+                "audio_seconds": round(audio_seconds, 3)
+            },
+            "throughput": throughput,
+            "keyword_hits": sorted(keyword_hits.values(), key=lambda k: k["count"], reverse=True),
+            "files": files
+        }
+
+        timestamp = datetime.utcnow().timestamp()
+        summary_path = os.path.join(REPORT_DIR, f"batch_{batch_id}_{timestamp}.json")
+        with open(summary_path, 'w', encoding='utf-8') as json_file:
+            json.dump(summary, json_file, ensure_ascii=False, indent=4)
+        report_path = os.path.join(REPORT_DIR, f"batch_{batch_id}_{timestamp}.pdf")
+        generate_case_report(summary, report_path)
+
+        batch.summary_path = summary_path
+        batch.report_path = report_path
+        batch.audio_seconds = audio_seconds
+        batch.files_per_minute = throughput["files_per_minute"]
+        batch.audio_seconds_per_second = throughput["audio_seconds_per_second"]
+        batch.status = status
+        batch.finished_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+
+def _update_job(job_id: int, event: tuple = None, **fields) -> bool:
+    db = SessionLocal()
+    try:
+        job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+        if job is None:
+            return False
+        for key, value in fields.items():
+            setattr(job, key, value)
+        if event is not None:
+            add_event(db, job_id, event[0], **event[1])
+        db.commit()
+        return bool(job.cancel_requested)
+    finally:
+        db.close()
+
+
+def run_analysis_job(job_id: int):
+    db = SessionLocal()
+    try:
+        job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+        if job is None or job.status in FINAL_STATUSES:
+            return
+        if job.cancel_requested:
+            job.status = "cancelled"
+            job.stage = "cancelled"
+            job.finished_at = datetime.utcnow()
+            add_event(db, job_id, "cancelled")
+            db.commit()
+            return
+        user_file = db.query(UserFile).filter(UserFile.id == job.file_id).first()
+        file_path = user_file.file_path if user_file else None
+        media_hash = user_file.sha256 if user_file else None
+        file_id, user_id = job.file_id, job.user_id
+        timings = Timings()
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        add_event(db, job_id, "stage", stage="running", progress=0)
+        db.commit()
+        current_stage = "running"
+
+        def progress(stage: str, percent: int, **details):
+            # A stage change or a finished transcription chunk is an event;
+            # the job row always holds the latest state for pollers.
+            nonlocal current_stage
+            event = None
+            if stage != current_stage:
+                event = ("stage", {"stage": stage, "progress": percent, **details})
+                current_stage = stage
+            elif details:
+                event = ("chunk", {"stage": stage, "progress": percent, **details})
+            if _update_job(job_id, event=event, stage=stage, progress=percent):
+                raise JobCancelled()
+
+        def partial_hits(hits: list[dict]):
+            # Provisional: the report written at the end is authoritative.
+            if hits:
+                record_event(job_id, "hits", hits=hits)
+
+        try:
+            if file_path is None:
+                raise FileNotFoundError("File not found")
+            analysis_result = analyze_media(file_path, progress=progress, media_hash=media_hash, on_hits=partial_hits,
+                                            timings=timings)
+            if "error" in analysis_result:
+                raise RuntimeError(analysis_result["error"])
+
+            # The PDF and the JSON export are rendered from the segment store
+            # on first download (see routes.users).
+            progress("saving", 90)
+            report_base = os.path.join(REPORT_DIR, f"report_{file_id}_{datetime.utcnow().timestamp()}")
+            report_fields = {"request_date": datetime.utcnow().isoformat(), "file_id": file_id, "user_id": user_id}
+            segments_path, json_path = f"{report_base}.seg", None
+            with timings.span("store_write"):
+                try:
+                    write_store(segments_path, analysis_result, **report_fields)
+                except ValueError as e:
+                    # The result is kept as it is rather than failing the job.
+                    logger.warning(f"Результат задачи {job_id} сохранён в JSON: {e}")
+                    segments_path, json_path = None, f"{report_base}.json"
+                    write_json_report(json_path, analysis_result, **report_fields)
+            timings.add("total", time.perf_counter() - timings.origin, timings.origin)
+
+            analysis_request = AnalysisRequest(user_id=user_id, file_id=file_id, segments_path=segments_path,
+                                               json_path=json_path,
+                                               hit_count=len(analysis_result["drug_timestamps"]),
+                                               keyword_version=analysis_result.get("keyword_version"),
+                                               timings=json.dumps(timings.to_dict()))
+            db.add(analysis_request)
+            store_keyframes(db, media_hash, analysis_result.get("keyframes"))
+            db.flush()
+            job.request_id = analysis_request.id
+            job.status = "completed"
+            job.stage = "completed"
+            job.progress = 100
+            add_event(db, job_id, "completed", request_id=analysis_request.id, hit_count=analysis_request.hit_count)
+        except JobCancelled:
+            db.rollback()
+            job.status = "cancelled"
+            job.stage = "cancelled"
+            add_event(db, job_id, "cancelled")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Ошибка анализа в задаче {job_id}: {e}")
+            job.status = "failed"
+            job.error = str(e)
+            add_event(db, job_id, "failed", error=str(e))
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        if job.status == "completed":
+            # After the commit, so the index never refers to a rolled back request.
+            index_analysis(job.request_id, file_id, user_id, analysis_result)
+    finally:
+        db.close()
@@ -0,0 +1,229 @@
+from bisect import bisect_right
+from typing import Optional
+from sqlalchemy import and_, or_
+import subprocess
+import logging
+import shutil
+import uuid
+import json
+import re
+import os
+
+from models import Keyframe, KeyframeBand, UserFile
+from utils.audio_io import AudioExtractionError, is_video, run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+VIDEO_KEYFRAMES = os.getenv("VIDEO_KEYFRAMES", "0") == "1"
+KEYFRAME_DIR = os.path.join("uploads", "keyframes")
+KEYFRAME_WIDTH = int(os.getenv("KEYFRAME_WIDTH", "320"))
+# Share of changed content that counts as a new scene (ffmpeg's scene score).
+SCENE_THRESHOLD = float(os.getenv("KEYFRAME_SCENE_THRESHOLD", "0.3"))
+# A static camera never changes scene; it still gets a frame this often.
+KEYFRAME_MAX_INTERVAL = float(os.getenv("KEYFRAME_MAX_INTERVAL", "30"))
+# The 64-bit hash is indexed as HASH_BANDS bands: two hashes within
+# HASH_BANDS - 1 bits of each other share at least one band exactly.
+HASH_BANDS = 8
+MAX_HASH_DISTANCE = HASH_BANDS - 1
+
+MANIFEST = "keyframes.json"
+_FRAMES_FILE = "frames.txt"
+_HASHES_FILE = "hashes.gray"
+_HASH_SIZE = (9, 8)
+_PTS_RE = re.compile(r"pts_time:(\S+)")
+_SCORE_RE = re.compile(r"lavfi\.scene_score=(\S+)")
+
+
+def keyframe_dir(key: str) -> str:
+    return os.path.join(KEYFRAME_DIR, key)
+
+
+def has_video_stream(file_path: str) -> bool:
+    # ffmpeg, not ffprobe, so nothing beyond the transcoding dependency is
+    # needed; without an output it only prints the stream list and exits.
+    result = subprocess.run(["ffmpeg", "-nostdin", "-hide_banner", "-i", file_path],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return any("Stream #" in line and "Video:" in line and "attached pic" not in line
+               for line in result.stderr.decode("utf-8", errors="replace").splitlines())
+
+
+def keyframe_outputs(directory: str) -> list[str]:
+    """ffmpeg arguments that add the keyframe outputs to a command decoding the input.
+
+    Frames are downscaled first, so scene detection works on small images.
+    A selected frame is written as a JPEG and, scaled to 9x8 grey, into a
+    raw file the perceptual hashes are computed from; its time and scene
+    score go to a metadata file.
+    """
+    select = (f"select='eq(n\\,0)+gt(scene\\,{SCENE_THRESHOLD})"
+              f"+gte(t-prev_selected_t\\,{KEYFRAME_MAX_INTERVAL})'")
+    graph = (f"[0:v:0]scale={KEYFRAME_WIDTH}:-2,{select},"
+             f"metadata=mode=print:file={os.path.join(directory, _FRAMES_FILE)},split=2[kf][hash];"
+             f"[hash]scale={_HASH_SIZE[0]}:{_HASH_SIZE[1]}:flags=area,format=gray[hashout]")
+    return ["-filter_complex", graph,
+            "-map", "[kf]", "-fps_mode", "vfr", "-q:v", "4", os.path.join(directory, "kf_%05d.jpg"),
+            "-map", "[hashout]", "-fps_mode", "vfr", "-f", "rawvideo", os.path.join(directory, _HASHES_FILE)]
+
+
+def dhash(gray: bytes) -> int:
+    # Difference hash: one bit per horizontally adjacent pixel pair of a 9x8
+    # image, set where brightness increases. Robust to scaling and re-encoding.
+    width, height = _HASH_SIZE
+    value = 0
+    for row in range(height):
+        for col in range(width - 1):
+            value = (value << 1) | (gray[row * width + col + 1] > gray[row * width + col])
+    return value
+
+
+def hash_bands(phash: str) -> list[int]:
+    bits = 64 // HASH_BANDS
+    value = int(phash, 16)
+    return [(value >> (bits * band)) & ((1 << bits) - 1) for band in range(HASH_BANDS)]
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def collect_keyframes(work_dir: str, directory: str) -> list[dict]:
+    """Reads the outputs of keyframe_outputs and moves the keyframes into place.
+
+    They are written to a work directory of their own (see
+    prepare_keyframes) and renamed to `directory` in one step, so two
+    analyses of the same content never write into the same directory. If
+    another one got there first, its keyframes are used and ours dropped.
+    """
+    times, scores = [], []
+    with open(os.path.join(work_dir, _FRAMES_FILE), "r", encoding="utf-8") as f:
+        for line in f:
+            if match := _PTS_RE.search(line):
+                times.append(float(match.group(1)))
+            elif match := _SCORE_RE.search(line):
+                scores.append(float(match.group(1)))
+    with open(os.path.join(work_dir, _HASHES_FILE), "rb") as f:
+        gray = f.read()
+    frame_bytes = _HASH_SIZE[0] * _HASH_SIZE[1]
+    keyframes = []
+    for index, timestamp in enumerate(times):
+        name = f"kf_{index + 1:05d}.jpg"
+        pixels = gray[index * frame_bytes:(index + 1) * frame_bytes]
+        if len(pixels) < frame_bytes or not os.path.exists(os.path.join(work_dir, name)):
+            break
+        keyframes.append({"timestamp": round(timestamp, 3), "path": os.path.join(directory, name),
+                          "phash": f"{dhash(pixels):016x}",
+                          "scene_score": round(scores[index], 4) if index < len(scores) else None})
+    for name in (_FRAMES_FILE, _HASHES_FILE):
+        os.remove(os.path.join(work_dir, name))
+    with open(os.path.join(work_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(keyframes, f)
+    try:
+        os.rename(work_dir, directory)
+    except OSError:
+        existing = load_keyframes(directory)
+        if existing is not None:
+            discard_keyframes(work_dir)
+            return existing
+        # Nothing writes into `directory` itself, so without a manifest it is
+        # left over from an interrupted older version.
+        shutil.rmtree(directory, ignore_errors=True)
+        os.rename(work_dir, directory)
+    return keyframes
+
+
+def discard_keyframes(work_dir: str):
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def load_keyframes(directory: str) -> Optional[list[dict]]:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def prepare_keyframes(file_path: str, directory: str) -> Optional[str]:
+    # A new work directory when the keyframes of this video still have to be
+    # extracted, next to `directory` so it can be renamed into place.
+    if not is_video(file_path) or load_keyframes(directory) is not None or not has_video_stream(file_path):
+        return None
+    work_dir = f"{directory}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(work_dir)
+    return work_dir
+
+
+def extract_keyframes(file_path: str, directory: str) -> list[dict]:
+    """Keyframes of a video, in a pass of their own.
+
+    Used when the audio needs no decoding, e.g. the transcript was cached,
+    or when decoding both in one ffmpeg process failed; otherwise the
+    outputs are added to the audio extraction (see utils.audio_io.stream_pcm)
+    so the file is decoded once.
+    """
+    keyframes = load_keyframes(directory)
+    if keyframes is not None:
+        return keyframes
+    work_dir = prepare_keyframes(file_path, directory)
+    if work_dir is None:
+        return load_keyframes(directory) or []
+    try:
+        run_ffmpeg(["-i", file_path] + keyframe_outputs(work_dir))
+        return collect_keyframes(work_dir, directory)
+    except (OSError, AudioExtractionError) as e:
+        logger.error(f"Ошибка извлечения ключевых кадров из {file_path}: {e}")
+        discard_keyframes(work_dir)
+        return []
+
+
+def keyframe_at(keyframes: list[dict], timestamps: list[float], seconds: float) -> Optional[dict]:
+    # The keyframe on screen at `seconds`: the last one selected before it.
+    index = bisect_right(timestamps, seconds) - 1
+    return keyframes[index] if index >= 0 else None
+
+
+def store_keyframes(db, sha256: Optional[str], keyframes: list[dict]):
+    # Stored once per content, however many times it is uploaded or analysed.
+    if not sha256 or not keyframes or db.query(Keyframe.id).filter(Keyframe.sha256 == sha256).first():
+        return
+    for keyframe in keyframes:
+        row = Keyframe(sha256=sha256, timestamp=keyframe["timestamp"], path=keyframe["path"],
+                       phash=keyframe["phash"], scene_score=keyframe.get("scene_score"))
+        db.add(row)
+        db.flush()
+        db.add_all(KeyframeBand(keyframe_id=row.id, band=band, value=value)
+                   for band, value in enumerate(hash_bands(keyframe["phash"])))
+
+
+def user_keyframes(db, user_id: int):
+    # Keyframes of the user's own uploads.
+    return (db.query(Keyframe).join(UserFile, UserFile.sha256 == Keyframe.sha256)
+            .filter(UserFile.user_id == user_id).distinct())
+
+
+def similar_keyframes(db, keyframe: Keyframe, user_id: int, max_distance: int, limit: int) -> list[dict]:
+    """Near-duplicates of `keyframe` in the user's other videos.
+
+    Candidates share at least one hash band exactly (an index lookup);
+    their full Hamming distance is then checked here.
+    """
+    bands = or_(*(and_(KeyframeBand.band == band, KeyframeBand.value == value)
+                  for band, value in enumerate(hash_bands(keyframe.phash))))
+    candidates = (db.query(Keyframe, UserFile.id)
+                  .join(KeyframeBand, KeyframeBand.keyframe_id == Keyframe.id)
+                  .join(UserFile, UserFile.sha256 == Keyframe.sha256)
+                  .filter(bands, UserFile.user_id == user_id, Keyframe.sha256 != keyframe.sha256)
+                  .distinct())
+    matches = []
+    for candidate, file_id in candidates:
+        distance = hamming(keyframe.phash, candidate.phash)
+        if distance <= max_distance:
+            matches.append({"keyframe_id": candidate.id, "file_id": file_id, "timestamp": candidate.timestamp,
+                            "phash": candidate.phash, "distance": distance})
+    matches.sort(key=lambda match: (match["distance"], match["file_id"], match["timestamp"]))
+    return matches[:limit]
+
+
+def keyframe_to_dict(keyframe: Keyframe) -> dict:
+    return {"keyframe_id": keyframe.id, "timestamp": keyframe.timestamp, "phash": keyframe.phash,
+            "scene_score": keyframe.scene_score}
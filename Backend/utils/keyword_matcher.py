@@ -0,0 +1,110 @@
+import hashlib
+import re
+from collections import deque
+from typing import Iterable, NamedTuple
+
+TOKEN_RE = re.compile(r"\w+")
+APOSTROPHES = "'’"
+
+
+class Token(NamedTuple):
+    text: str
+    start: int
+    end: int
+
+
+class KeywordMatch(NamedTuple):
+    keyword: str
+    start: int
+    end: int
+
+
+def tokenize(text: str) -> list[Token]:
+    # Same normalisation the old clean_text() did: lowercase word characters,
+    # punctuation as separators and possessive 's dropped ("dealer's" -> "dealer").
+    tokens = []
+    for m in TOKEN_RE.finditer(text):
+        start, end = m.span()
+        word = m.group().lower()
+        if word == "s" and start > 0 and text[start - 1] in APOSTROPHES and tokens:
+            continue
+        tokens.append(Token(word, start, end))
+    return tokens
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over word tokens.
+
+    Patterns are token sequences, so every match starts and ends on a word
+    boundary ("acid" does not fire inside "placid") and multi-word phrases
+    are matched in the same pass as single words.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: list[str] = []
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[tuple[int, int]]] = [[]]
+
+        seen = set()
+        for keyword in keywords:
+            words = tuple(token.text for token in tokenize(keyword))
+            if not words or words in seen:
+                continue
+            seen.add(words)
+            self._add(words, len(self.keywords))
+            self.keywords.append(keyword.strip().lower())
+        self._build()
+        # Identifies the effective keyword list, independent of order and duplicates.
+        normalized = "\n".join(sorted(" ".join(words) for words in seen))
+        self.version = hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def from_file(cls, filepath: str) -> "KeywordMatcher":
+        # Skips blank lines and "[category]" headers.
+        with open(filepath, "r", encoding="utf-8") as f:
+            return cls(line for line in f if line.strip() and not line.strip().startswith("["))
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def _add(self, words: tuple[str, ...], index: int):
+        state = 0
+        for word in words:
+            nxt = self._goto[state].get(word)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][word] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((index, len(words)))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(word, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_tokens(self, tokens: list[Token]) -> list[KeywordMatch]:
+        goto, fail, out = self._goto, self._fail, self._out
+        matches = []
+        state = 0
+        for i, token in enumerate(tokens):
+            word = token.text
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            for index, length in out[state]:
+                matches.append(KeywordMatch(self.keywords[index], tokens[i - length + 1].start, token.end))
+        return matches
+
+    def find(self, text: str) -> list[KeywordMatch]:
+        return self.find_tokens(tokenize(text))
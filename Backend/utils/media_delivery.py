@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from typing import Optional
+import mimetypes
+import threading
+import hashlib
+import logging
+import base64
+import os
+
+from utils.audio_io import AudioExtractionError, run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+PROXY_DIR = os.path.join("uploads", "proxies")
+PROXY_BITRATE = os.getenv("REVIEW_PROXY_BITRATE", "48k")
+PROXY_SAMPLE_RATE = int(os.getenv("REVIEW_PROXY_SAMPLE_RATE", "22050"))
+PROXY_WORKERS = int(os.getenv("REVIEW_PROXY_WORKERS", "1"))
+# Off by default: the copy is then made on the first /proxy request, so
+# uploads that are never played back cost no transcode.
+PROXY_ON_UPLOAD = os.getenv("REVIEW_PROXY_ON_UPLOAD", "0") == "1"
+
+# Evidence may be kept by the reviewer's browser but never by shared caches,
+# and every reuse is revalidated against the ETag (a 304 costs no body).
+CACHE_CONTROL = "private, no-cache"
+
+_proxy_executor = None
+_proxy_pending: set[str] = set()
+# Keys whose transcode failed, with the ffmpeg error. Not retried until a
+# restart: the same input would only fail again on every poll.
+_proxy_failures: dict[str, str] = {}
+_proxy_lock = threading.Lock()
+
+
+def strong_etag(sha256_hex: str) -> str:
+    return f'"{sha256_hex}"'
+
+
+@lru_cache(maxsize=4096)
+def _file_sha256(path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    # For generated files (reports); keyed by mtime and size so a rewritten
+    # report gets a new hash while repeated requests are not re-hashed.
+    stat = os.stat(path)
+    return _file_sha256(path, stat.st_mtime_ns, stat.st_size)
+
+
+def _if_none_match(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _resolve_if_range(request: Request, etag: str):
+    # FileResponse checks If-Range against an mtime-based ETag it computes
+    # itself, never the one it is given. If-Range matching our content hash
+    # is removed from the request (the response is sent with the same
+    # scope), so FileResponse serves the range as if none had been sent.
+    if request.headers.get("if-range") == etag:
+        request.scope["headers"] = [(key, value) for key, value in request.scope["headers"] if key != b"if-range"]
+
+
+def evidence_file_response(request: Request, path: str, sha256_hex: Optional[str], filename: str,
+                           media_type: Optional[str] = None):
+    """FileResponse with Range support, a content-hash ETag and 304 handling.
+
+    Range and multi-range requests are answered with 206 by FileResponse.
+    Repr-Digest (RFC 9530) carries the SHA-256 of the whole file so clients
+    can verify evidence integrity even when it arrives in ranges.
+    """
+    media_type = media_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    headers = {"Cache-Control": CACHE_CONTROL, "X-Content-Type-Options": "nosniff"}
+    if sha256_hex:
+        etag = strong_etag(sha256_hex)
+        headers["ETag"] = etag
+        headers["Repr-Digest"] = f"sha-256=:{base64.b64encode(bytes.fromhex(sha256_hex)).decode()}:"
+        if _if_none_match(request, etag):
+            return Response(status_code=304, headers=headers)
+        _resolve_if_range(request, etag)
+    return FileResponse(path=path, filename=filename, media_type=media_type, headers=headers)
+
+
+def proxy_path(key: str) -> str:
+    return os.path.join(PROXY_DIR, f"{key}.m4a")
+
+
+def build_review_proxy(source_path: str, key: str) -> Optional[str]:
+    """Transcode a low-bitrate mono AAC copy for review playback.
+
+    The moov atom is moved to the front (faststart) so playback can begin
+    before the whole proxy has been downloaded.
+    """
+    target = proxy_path(key)
+    if os.path.exists(target):
+        return target
+    os.makedirs(PROXY_DIR, exist_ok=True)
+    tmp_path = f"{target}.{threading.get_ident()}.tmp"
+    try:
+        run_ffmpeg(["-i", source_path, "-vn", "-ac", "1", "-ar", str(PROXY_SAMPLE_RATE), "-c:a", "aac",
+                    "-b:a", PROXY_BITRATE, "-movflags", "+faststart", "-f", "mp4", tmp_path])
+        os.replace(tmp_path, target)
+        return target
+    except (OSError, AudioExtractionError) as e:
+        logger.error(f"Ошибка создания прокси для {source_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with _proxy_lock:
+            _proxy_failures[key] = str(e)
+        return None
+    finally:
+        with _proxy_lock:
+            _proxy_pending.discard(key)
+
+
+def proxy_failure(key: str) -> Optional[str]:
+    with _proxy_lock:
+        return _proxy_failures.get(key)
+
+
+def submit_review_proxy(source_path: str, key: str) -> bool:
+    """Queue a proxy build; False if it already exists, is being built or failed."""
+    global _proxy_executor
+    if os.path.exists(proxy_path(key)):
+        return False
+    with _proxy_lock:
+        if key in _proxy_pending or key in _proxy_failures:
+            return False
+        _proxy_pending.add(key)
+        if _proxy_executor is None:
+            _proxy_executor = ThreadPoolExecutor(max_workers=PROXY_WORKERS, thread_name_prefix="proxy")
+    _proxy_executor.submit(build_review_proxy, source_path, key)
+    return True
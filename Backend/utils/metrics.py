@@ -0,0 +1,190 @@
+from contextlib import contextmanager
+from typing import Callable, Optional
+import threading
+import bisect
+import time
+import os
+
+# Off by default: /metrics needs no authentication, so it is meant to be
+# enabled only where the API is not reachable from outside.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+
+# Seconds; wide enough for a 5 ms request and a two hour recording.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(names: tuple, values: tuple, extra: tuple = ()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names + extra[:1], values + extra[1:])]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """Base of the metric types.
+
+    A metric given `collect` is computed at scrape time: collect() returns
+    {label values tuple: value}, e.g. queue depths that live in the database
+    and are shared by every worker process.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), collect: Callable = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> list[str]:
+        if self.collect is not None:
+            values = self.collect()
+            with self._lock:
+                self._values = {tuple(str(v) for v in key): value for key, value in values.items()}
+        with self._lock:
+            return [f"{self.name}{_labels_text(self.labelnames, key)} {_number(value)}"
+                    for key, value in sorted(self._values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> list[str]:
+        lines = []
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        # Prometheus text exposition format 0.0.4.
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+def safe_collect(collect: Callable) -> Callable:
+    # A failing collector (e.g. the database is down) must not break the scrape.
+    def wrapper():
+        try:
+            return collect()
+        except Exception:
+            return {}
+    return wrapper
+
+
+registry = Registry()
+
+http_request_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status")))
+stage_seconds = registry.register(Histogram(
+    "analysis_stage_seconds", "Duration of analysis pipeline stages.", ("stage",)))
+analysis_jobs_total = registry.register(Counter(
+    "analysis_jobs_total", "Finished analysis jobs by final status.", ("status",)))
+upload_write_seconds = registry.register(Histogram(
+    "upload_write_seconds", "Time spent writing and hashing uploaded bytes, per request."))
+upload_bytes_total = registry.register(Counter("upload_bytes_total", "Uploaded bytes written to disk."))
+
+
+class Timings:
+    """Per-analysis timing spans, stored with the AnalysisRequest.
+
+    Spans are {"stage", "start", "seconds"} plus optional details (chunk
+    index, audio seconds); start is relative to the first span. Thread safe,
+    since transcription chunks finish on pool threads.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: list[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float, started: Optional[float] = None, **details):
+        started = started if started is not None else time.perf_counter() - seconds
+        span = {"stage": stage, "start": round(started - self.origin, 4), "seconds": round(seconds, 4), **details}
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, stage: str, **details):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started, started, **details)
+
+    def totals(self) -> dict[str, float]:
+        # Chunk spans overlap when transcribed concurrently; totals are summed work.
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                totals[span["stage"]] = round(totals.get(span["stage"], 0.0) + span["seconds"], 4)
+        return totals
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+        return {"spans": spans, "totals": self.totals()}
+
+
+def observe_timings(timings: dict):
+    # Called in the API process with spans recorded by a worker, which may
+    # be another process whose in-memory metrics are never scraped.
+    for span in (timings or {}).get("spans", []):
+        stage_seconds.observe(span["seconds"], stage=span["stage"])
@@ -0,0 +1,52 @@
+from fastapi import HTTPException
+from sqlalchemy import DateTime, tuple_
+from datetime import datetime
+import binascii
+import base64
+import json
+import os
+
+DEFAULT_PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(value, row_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, column):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        return value, int(row_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(query, sort_column, id_column, descending: bool, limit: int, cursor=None):
+    """One page of `query` ordered by (sort_column, id_column).
+
+    The cursor holds the sort key of the last row returned, so the next page
+    is an index range scan from that key instead of an OFFSET over every
+    earlier row; the cost of a page does not grow with the history.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    same = sort_column is id_column
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort_column)
+        key = id_column if same else tuple_(sort_column, id_column)
+        bound = row_id if same else tuple_(value, row_id)
+        query = query.filter(key < bound if descending else key > bound)
+    columns = [id_column] if same else [sort_column, id_column]
+    query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
@@ -1,143 +1,294 @@
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image, Flowable
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from matplotlib.figure import Figure
 from datetime import datetime
 import os
-from collections import Counter
+from collections import deque
 from textwrap import wrap
-import re
-import matplotlib
-import uuid
-import platform
+from xml.sax.saxutils import escape
+from utils.text_analytics import analyze_text
+from utils.transcribers import Segment
+from utils.metrics import Timings
+from utils.keyframes import keyframe_at
+import io
 import logging
 
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-TEMP_DIR = "temp"
-if not os.path.exists(TEMP_DIR):
-    os.makedirs(TEMP_DIR)
+# 0 renders everything; otherwise the PDF stops after this many transcript
+# segments / hit rows and points to the JSON report, which is never capped.
+REPORT_MAX_SEGMENTS = int(os.getenv("REPORT_MAX_SEGMENTS", "0"))
+REPORT_MAX_HITS = int(os.getenv("REPORT_MAX_HITS", "0"))
 
-pdfmetrics.registerFont(TTFont('DejaVuSerif', 'DejaVuSerif.ttf'))
+pdfmetrics.registerFont(TTFont('DejaVuSerif', os.path.join(os.path.dirname(__file__), 'DejaVuSerif.ttf')))
 DEFAULT_FONT = 'DejaVuSerif'
 
-def load_stop_words_from_file(filepath: str = os.path.join(os.path.dirname(__file__), "stopwords.txt")) -> set[str]:
-    logger.info(f"Попытка загрузки стоп-слов из: {filepath}")
-    if not os.path.exists(filepath):
-        logger.error(f"Файл стоп-слов не найден: {filepath}")
-        return set()
-    with open(filepath, "r", encoding="utf-8") as f:
-        return set(line.strip().lower() for line in f if line.strip())
+# Styles are immutable once built, so they are shared by every report.
+STYLES = getSampleStyleSheet()
+TITLE_STYLE = ParagraphStyle(name='TitleStyle', parent=STYLES['Heading1'], fontName=DEFAULT_FONT, fontSize=18, spaceAfter=12, textColor=colors.white, backColor=colors.HexColor('#004aad'), padding=6, borderPadding=6, alignment=1)
+BODY_STYLE = ParagraphStyle(name='BodyStyle', parent=STYLES['Normal'], fontName=DEFAULT_FONT, fontSize=10, spaceAfter=6, leading=12)
+TABLE_HEADER_STYLE = ParagraphStyle(name='TableHeaderStyle', parent=STYLES['Normal'], fontName=DEFAULT_FONT, fontSize=10, textColor=colors.white)
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#004aad')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, -1), DEFAULT_FONT),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#f5f5f5')),
+])
+ROW_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (-1, -1), DEFAULT_FONT),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f5f5f5')),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+])
+HIT_COLUMN_WIDTHS = [1.5 * inch, 5 * inch]
+# With video keyframes: timestamp, the frame on screen at the hit, text.
+FRAME_COLUMN_WIDTHS = [1.1 * inch, 1.5 * inch, 3.9 * inch]
+THUMBNAIL_SIZE = (1.35 * inch, 0.9 * inch)
 
-STOP_WORDS = load_stop_words_from_file()
 
-def generate_word_frequency_chart(transcription, output_path):
-    words = [word.lower() for word in re.findall(r'\b\w+\b', transcription)
-             if word.isalpha() and word.lower() not in STOP_WORDS]
-    word_freq = Counter(words).most_common(10)
-    if not word_freq:
+class PageSlice(Flowable):
+    """Flowables already wrapped for one frame, drawn top to bottom."""
+
+    def __init__(self, items, width, height):
+        super().__init__()
+        self.items = items
+        self.width = width
+        self.height = height
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        y = self.height
+        for item, width, height in self.items:
+            y -= item.getSpaceBefore() + height
+            item.drawOn(self.canv, 0, y, _sW=self.width - width)
+            y -= item.getSpaceAfter()
+
+
+class StreamedFlowables(Flowable):
+    """Lays out flowables from an iterator one frame at a time.
+
+    Platypus asks a flowable that does not fit to split itself; this one
+    always claims to be too tall, and on split pulls just enough flowables
+    from the iterator to fill the remaining space, returning them wrapped
+    as a PageSlice so each is laid out once. Only the current page's
+    flowables exist at any time, so memory does not grow with the length
+    of the transcript. `header` (a callable) is repeated at the top of
+    every slice, e.g. a table header row.
+    """
+
+    def __init__(self, flowables, header=None):
+        super().__init__()
+        self._source = iter(flowables)
+        self._pending = deque()
+        self._header = header
+
+    def _next(self):
+        if self._pending:
+            return self._pending.popleft()
+        return next(self._source, None)
+
+    def _exhausted(self) -> bool:
+        if self._pending:
+            return False
+        item = next(self._source, None)
+        if item is None:
+            return True
+        self._pending.append(item)
         return False
+
+    def wrap(self, availWidth, availHeight):
+        if self._exhausted():
+            return 0, 0
+        return availWidth, availHeight + 1
+
+    def split(self, availWidth, availHeight):
+        items = []
+        remaining = availHeight
+
+        def place(item) -> bool:
+            nonlocal remaining
+            width, height = item.wrap(availWidth, remaining)
+            needed = height + item.getSpaceBefore() + item.getSpaceAfter()
+            if needed > remaining:
+                return False
+            items.append((item, width, height))
+            remaining -= needed
+            return True
+
+        if self._header and not place(self._header()):
+            return []
+        placed = 0
+        while remaining > 0:
+            item = self._next()
+            if item is None:
+                break
+            if place(item):
+                placed += 1
+                continue
+            # place() adds the item's spacing on top of the height it splits to.
+            parts = item.split(availWidth, remaining - item.getSpaceBefore() - item.getSpaceAfter())
+            if parts and place(parts[0]):
+                self._pending.extendleft(reversed(parts[1:]))
+                placed += 1
+            else:
+                self._pending.appendleft(item)
+            break
+        if not placed:
+            # Nothing fits in what is left of this frame: move on to the next one.
+            return []
+        # Platypus marks a flowable it had to move to the next frame and fails
+        # if it is moved twice; this one is reused on every page.
+        self.__dict__.pop("_postponed", None)
+        page = PageSlice(items, availWidth, availHeight - remaining)
+        return [page] if self._exhausted() else [page, self]
+
+    def draw(self):
+        pass
+
+
+def format_timestamp(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _capped(items, limit: int):
+    for index, item in enumerate(items):
+        if limit and index >= limit:
+            return
+        yield item
+
+
+def _transcript_paragraphs(analysis_result, transcription):
+    segments = analysis_result.get("segments")
+    if not segments:
+        # Analyses stored before segments were kept only have the plain text.
+        for part in wrap(transcription, 1000):
+            yield Paragraph(escape(part), BODY_STYLE)
+        return
+    for segment in _capped(segments, REPORT_MAX_SEGMENTS):
+        yield Paragraph(f"[{format_timestamp(segment['start'])}] {escape(segment['text'].strip())}", BODY_STYLE)
+
+
+def _thumbnail(keyframe):
+    if keyframe is None or not os.path.exists(keyframe["path"]):
+        return "-"
+    return Image(keyframe["path"], width=THUMBNAIL_SIZE[0], height=THUMBNAIL_SIZE[1], kind='proportional')
+
+
+def _hit_rows(timestamps, keyframes):
+    # One single-row table per hit; with equal column widths they read as one table.
+    frame_times = [keyframe["timestamp"] for keyframe in keyframes]
+    for timestamp in _capped(timestamps, REPORT_MAX_HITS):
+        cells = [f"{timestamp['timestamp']:.2f}", Paragraph(escape(timestamp['text'][:200]), BODY_STYLE)]
+        if keyframes:
+            cells.insert(1, _thumbnail(keyframe_at(keyframes, frame_times, timestamp['timestamp'])))
+        row = Table([cells], colWidths=FRAME_COLUMN_WIDTHS if keyframes else HIT_COLUMN_WIDTHS)
+        row.setStyle(ROW_STYLE)
+        yield row
+
+
+def _hit_header(keyframes):
+    titles = ["Timestamp (s)", "Frame", "Text"] if keyframes else ["Timestamp (s)", "Text"]
+    header = Table([[Paragraph(title, TABLE_HEADER_STYLE) for title in titles]],
+                   colWidths=FRAME_COLUMN_WIDTHS if keyframes else HIT_COLUMN_WIDTHS)
+    header.setStyle(TABLE_STYLE)
+    return header
+
+
+def _truncation_note(shown: int, total: int, what: str):
+    return Paragraph(f"Showing the first {shown} of {total} {what}; the full list is in the JSON report.", BODY_STYLE)
+
+def generate_word_frequency_chart(word_freq):
+    # Figure objects are independent of pyplot's global state, so charts can be
+    # rendered from several threads at once; the PNG never touches the disk.
+    if not word_freq:
+        return None
     words, counts = zip(*word_freq)
-    plt.figure(figsize=(8, 4))
-    plt.bar(words, counts, color='skyblue')
-    plt.title('Top 10 Frequent Words (Excluding Common Words)')
-    plt.xlabel('Words')
-    plt.ylabel('Frequency')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.savefig(output_path)
-    plt.close()
-    return True
+    fig = Figure(figsize=(8, 4))
+    ax = fig.subplots()
+    ax.bar(words, counts, color='skyblue')
+    ax.set_title('Top 10 Frequent Words (Excluding Common Words)')
+    ax.set_xlabel('Words')
+    ax.set_ylabel('Frequency')
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    buffer.seek(0)
+    return buffer
 
 def extract_text_insights(transcription):
-    words = [word.lower() for word in re.findall(r'\b\w+\b', transcription)
-             if word.isalpha() and word.lower() not in STOP_WORDS]
-    frequent_words = Counter(words).most_common(5)
-    bigrams = [(words[i], words[i + 1]) for i in range(len(words) - 1)] if len(words) > 1 else []
-    key_phrases = [' '.join(bigram) for bigram, _ in Counter(bigrams).most_common(5)] if bigrams else []
-    names = []
-    sentences = re.split(r'[.!?]\s+', transcription)
-    for sentence in sentences:
-        ws = sentence.split()
-        for i, word in enumerate(ws[1:], 1):
-            if word and word[0].isupper() and word.isalpha():
-                names.append(word)
-    names = list(dict.fromkeys(names))[:5]
-    return {"frequent_words": frequent_words, "key_phrases": key_phrases, "names": names}
-
-def generate_pdf_report(analysis_result, output_path):
+    insights = analyze_text([Segment(start=0.0, end=0.0, text=transcription)])
+    return {"frequent_words": insights["frequent_words"][:5], "key_phrases": insights["key_phrases"], "names": insights["names"]}
+
+def generate_pdf_report(analysis_result, output_path, timings: Timings = None):
+    # "segments" and "drug_timestamps" may be any sized iterable, e.g. the
+    # LazyRows of SegmentStore.lazy_result(); each is iterated once.
+    timings = timings or Timings()
     doc = SimpleDocTemplate(output_path, pagesize=letter, rightMargin=0.5 * inch, leftMargin=0.5 * inch, topMargin=0.5 * inch, bottomMargin=0.5 * inch)
     elements = []
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(name='TitleStyle', parent=styles['Heading1'], fontName=DEFAULT_FONT, fontSize=18, spaceAfter=12, textColor=colors.white, backColor=colors.HexColor('#004aad'), padding=6, borderPadding=6, alignment=1)
-    body_style = ParagraphStyle(name='BodyStyle', parent=styles['Normal'], fontName=DEFAULT_FONT, fontSize=10, spaceAfter=6, leading=12)
-    table_header_style = ParagraphStyle(name='TableHeaderStyle', parent=styles['Normal'], fontName=DEFAULT_FONT, fontSize=10, textColor=colors.white)
-    elements.append(Paragraph("Media Analysis Report", title_style))
-    elements.append(Paragraph(f"Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}", styles['Normal']))
+    elements.append(Paragraph("Media Analysis Report", TITLE_STYLE))
+    elements.append(Paragraph(f"Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}", STYLES['Normal']))
     elements.append(Spacer(1, 0.25 * inch))
 
     if "error" in analysis_result:
-        elements.append(Paragraph(f"Error: {analysis_result['error']}", body_style))
+        elements.append(Paragraph(f"Error: {analysis_result['error']}", BODY_STYLE))
         doc.build(elements)
         return
 
-    elements.append(Paragraph("Transcription", styles['Heading2']))
+    elements.append(Paragraph("Transcription", STYLES['Heading2']))
     transcription = analysis_result.get("transcription") or "Transcription not available"
-    wrapped_paragraphs = wrap(transcription, 100)
-    for part in wrapped_paragraphs:
-        elements.append(Paragraph(part, body_style))
-        elements.append(Spacer(1, 0.1 * inch))
-
-    chart_filename = f"word_freq_chart_{uuid.uuid4().hex}.png"
-    chart_path = os.path.join(TEMP_DIR, chart_filename)
-    chart_created = generate_word_frequency_chart(transcription, chart_path)
-    if chart_created and os.path.exists(chart_path):
-        elements.append(Paragraph("Word Frequency Analysis", styles['Heading2']))
-        elements.append(Image(chart_path, width=6 * inch, height=3 * inch))
-        elements.append(Spacer(1, 0.25 * inch))
+    # The transcript and the hit table are streamed page by page, so an
+    # eight hour recording does not hold every paragraph in memory.
+    elements.append(StreamedFlowables(_transcript_paragraphs(analysis_result, transcription)))
+    segment_count = len(analysis_result.get("segments") or [])
+    if REPORT_MAX_SEGMENTS and segment_count > REPORT_MAX_SEGMENTS:
+        elements.append(_truncation_note(REPORT_MAX_SEGMENTS, segment_count, "transcript segments"))
+    elements.append(Spacer(1, 0.25 * inch))
 
-    text_insights = extract_text_insights(transcription)
+    # Analyses produced before the shared analytics pass have no insights stored.
+    text_insights = analysis_result.get("insights") or analyze_text([Segment(start=0.0, end=0.0, text=transcription)])
+    with timings.span("pdf_chart"):
+        chart = generate_word_frequency_chart(text_insights["frequent_words"])
+    if chart is not None:
+        elements.append(Paragraph("Word Frequency Analysis", STYLES['Heading2']))
+        elements.append(Image(chart, width=6 * inch, height=3 * inch))
+        elements.append(Spacer(1, 0.25 * inch))
 
-    elements.append(Paragraph("Key Phrases", styles['Heading2']))
+    elements.append(Paragraph("Key Phrases", STYLES['Heading2']))
     if text_insights["key_phrases"]:
         for phrase in text_insights["key_phrases"]:
-            elements.append(Paragraph(phrase, body_style))
+            elements.append(Paragraph(phrase, BODY_STYLE))
     else:
-        elements.append(Paragraph("No key phrases found.", body_style))
+        elements.append(Paragraph("No key phrases found.", BODY_STYLE))
     elements.append(Spacer(1, 0.25 * inch))
 
-    elements.append(Paragraph("Detected Names", styles['Heading2']))
+    elements.append(Paragraph("Detected Names", STYLES['Heading2']))
     if text_insights["names"]:
         for name in text_insights["names"]:
-            elements.append(Paragraph(name, body_style))
+            elements.append(Paragraph(name, BODY_STYLE))
     else:
-        elements.append(Paragraph("No names detected.", body_style))
+        elements.append(Paragraph("No names detected.", BODY_STYLE))
     elements.append(Spacer(1, 0.25 * inch))
 
-    elements.append(Paragraph("Drug-Related Timestamps", styles['Heading2']))
+    elements.append(Paragraph("Drug-Related Timestamps", STYLES['Heading2']))
     timestamps = analysis_result.get("drug_timestamps", [])
     if not timestamps:
-        elements.append(Paragraph("No timestamps found.", body_style))
+        elements.append(Paragraph("No timestamps found.", BODY_STYLE))
     else:
-        table_data = [[Paragraph("Timestamp (s)", table_header_style), Paragraph("Text", table_header_style)]]
-        for timestamp in timestamps:
-            table_data.append([f"{timestamp['timestamp']:.2f}", Paragraph(timestamp['text'][:200], body_style)])
-        table = Table(table_data, colWidths=[1.5 * inch, 5 * inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#004aad')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-            ('FONTNAME', (0, 0), (-1, 0), DEFAULT_FONT),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#f5f5f5')),
-        ]))
-        elements.append(table)
+        keyframes = analysis_result.get("keyframes") or []
+        elements.append(StreamedFlowables(_hit_rows(timestamps, keyframes), header=lambda: _hit_header(keyframes)))
+        if REPORT_MAX_HITS and len(timestamps) > REPORT_MAX_HITS:
+            elements.append(_truncation_note(REPORT_MAX_HITS, len(timestamps), "timestamps"))
 
     def add_page_number(canvas, doc):
         page_num = canvas.getPageNumber()
@@ -146,6 +297,50 @@ def generate_pdf_report(analysis_result, output_path):
         canvas.setFillColor(colors.grey)
         canvas.drawRightString(doc.rightMargin + doc.width, 0.25 * inch, text)
 
+    with timings.span("pdf_build"):
+        doc.build(elements, onFirstPage=add_page_number, onLaterPages=add_page_number)
+
+def generate_case_report(summary, output_path):
+    doc = SimpleDocTemplate(output_path, pagesize=letter, rightMargin=0.5 * inch, leftMargin=0.5 * inch, topMargin=0.5 * inch, bottomMargin=0.5 * inch)
+    elements = []
+
+    elements.append(Paragraph("Case Analysis Report", TITLE_STYLE))
+    elements.append(Paragraph(f"Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}", STYLES['Normal']))
+    elements.append(Spacer(1, 0.25 * inch))
+
+    totals = summary["totals"]
+    throughput = summary["throughput"]
+    elements.append(Paragraph("Summary", STYLES['Heading2']))
+    elements.append(Paragraph(f"Files: {totals['files']} (completed {totals['completed']}, failed {totals['failed']}, cancelled {totals['cancelled']})", BODY_STYLE))
+    elements.append(Paragraph(f"Keyword hits: {totals['hits']}", BODY_STYLE))
+    elements.append(Paragraph(f"Audio analyzed: {totals['audio_seconds']:.0f} s in {throughput['elapsed_seconds']:.0f} s", BODY_STYLE))
+    if throughput["files_per_minute"] is not None:
+        elements.append(Paragraph(f"Throughput: {throughput['files_per_minute']:.2f} files/min, {throughput['audio_seconds_per_second']:.2f} audio-seconds/s", BODY_STYLE))
+    elements.append(Spacer(1, 0.25 * inch))
+
+    elements.append(Paragraph("Keywords Across Files", STYLES['Heading2']))
+    if not summary["keyword_hits"]:
+        elements.append(Paragraph("No keywords found.", BODY_STYLE))
+    else:
+        table_data = [[Paragraph("Keyword", TABLE_HEADER_STYLE), Paragraph("Hits", TABLE_HEADER_STYLE), Paragraph("Files", TABLE_HEADER_STYLE)]]
+        for entry in summary["keyword_hits"]:
+            table_data.append([Paragraph(escape(entry["keyword"]), BODY_STYLE), str(entry["count"]), Paragraph(", ".join(str(f) for f in entry["files"]), BODY_STYLE)])
+        table = Table(table_data, colWidths=[2.5 * inch, 1 * inch, 3 * inch], repeatRows=1)
+        table.setStyle(TABLE_STYLE)
+        elements.append(table)
+    elements.append(Spacer(1, 0.25 * inch))
+
+    elements.append(Paragraph("Files", STYLES['Heading2']))
+    table_data = [[Paragraph(h, TABLE_HEADER_STYLE) for h in ("File", "Name", "Status", "Hits", "Top keywords")]]
+    for entry in summary["files"]:
+        table_data.append([str(entry["file_id"]), Paragraph(escape(entry["filename"] or "-"), BODY_STYLE), entry["status"], str(entry["hit_count"]), Paragraph(escape(", ".join(entry["keywords"][:5]) or "-"), BODY_STYLE)])
+    table = Table(table_data, colWidths=[0.6 * inch, 2 * inch, 1 * inch, 0.6 * inch, 2.3 * inch], repeatRows=1)
+    table.setStyle(TABLE_STYLE)
+    elements.append(table)
+
+    def add_page_number(canvas, doc):
+        canvas.setFont(DEFAULT_FONT, 9)
+        canvas.setFillColor(colors.grey)
+        canvas.drawRightString(doc.rightMargin + doc.width, 0.25 * inch, f"Page {canvas.getPageNumber()}")
+
     doc.build(elements, onFirstPage=add_page_number, onLaterPages=add_page_number)
-    if chart_created and os.path.exists(chart_path):
-        os.remove(chart_path)
\ No newline at end of file
@@ -0,0 +1,71 @@
+from collections import Counter
+from datetime import datetime
+import threading
+import sys
+import re
+import os
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_MAX_DEPTH = 64
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread at a fixed interval.
+
+    Pure stdlib, so it can be switched on in production without extra
+    packages. Sync handlers run on the threadpool and workers on their own
+    threads, so all threads are sampled; each stack is rooted at its thread
+    name. The result is in collapsed ("folded") format, readable by
+    flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)).replace(";", "_"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def save(self, label: str) -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")[:80]
+        path = os.path.join(PROFILE_DIR, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}_{name}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.folded())
+        return path
@@ -0,0 +1,129 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import or_
+import logging
+import os
+
+from database import SessionLocal
+from models import AnalysisRequest, KeywordRescan, UserFile
+from utils.analysis import get_keyword_matcher, match_keywords
+from utils.cache import get_cache, PIPELINE_VERSION
+from utils.keyword_matcher import KeywordMatcher
+from utils.search_index import index_analysis
+from utils.segment_store import load_report, write_json_report, write_store
+from utils.transcribers import Segment, Transcription
+
+logger = logging.getLogger(__name__)
+
+
+def outdated_requests(db, user_id: Optional[int], version: str):
+    query = db.query(AnalysisRequest).filter(or_(AnalysisRequest.keyword_version.is_(None),
+                                                 AnalysisRequest.keyword_version != version))
+    if user_id is not None:
+        query = query.filter(AnalysisRequest.user_id == user_id)
+    return query
+
+
+def stored_segments(db, analysis_request: AnalysisRequest, result: dict) -> Optional[list[Segment]]:
+    # Reports written before segments were stored fall back to the cached
+    # transcript of the same media, if it has not been evicted.
+    if result.get("segments") is not None:
+        return [Segment.from_dict(segment) for segment in result["segments"]]
+    sha256 = db.query(UserFile.sha256).filter(UserFile.id == analysis_request.file_id).scalar()
+    cached = get_cache().get("transcript", f"{sha256}:{PIPELINE_VERSION}") if sha256 else None
+    if cached is None:
+        return None
+    return Transcription.from_dict(cached).segments
+
+
+def rescan_request(db, analysis_request: AnalysisRequest, matcher: KeywordMatcher) -> Optional[tuple[int, dict]]:
+    """Re-run only the keyword matcher over a stored transcript.
+
+    Rewrites the report's hits and drops the rendered PDF so it is rebuilt on
+    the next download. Returns the number of hits that were not found before
+    and the updated analysis result; None when no transcript is stored.
+    """
+    report = load_report(analysis_request)
+    if report is None:
+        return None
+    result = report["analysis_result"]
+    segments = stored_segments(db, analysis_request, result)
+    if segments is None:
+        return None
+
+    previous = {(hit["timestamp"], keyword)
+                for hit in result.get("drug_timestamps", []) for keyword in hit["keywords"]}
+    hits = match_keywords(segments, matcher)
+    new_hits = sum(1 for hit in hits for keyword in hit["keywords"] if (hit["timestamp"], keyword) not in previous)
+
+    result["segments"] = [segment.to_dict() for segment in segments]
+    result["drug_timestamps"] = hits
+    result["keyword_version"] = matcher.version
+    report_fields = {key: value for key, value in report.items() if key != "analysis_result"}
+    if analysis_request.segments_path:
+        write_store(analysis_request.segments_path, result, **report_fields)
+    else:
+        write_json_report(analysis_request.json_path, result, **report_fields)
+
+    if analysis_request.report_path and os.path.exists(analysis_request.report_path):
+        os.remove(analysis_request.report_path)
+    analysis_request.report_path = None
+    analysis_request.hit_count = len(hits)
+    analysis_request.keyword_version = matcher.version
+    return new_hits, result
+
+
+def update_rescan(rescan_id: int, **fields):
+    db = SessionLocal()
+    try:
+        db.query(KeywordRescan).filter(KeywordRescan.id == rescan_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+
+def run_rescan_job(rescan_id: int):
+    db = SessionLocal()
+    try:
+        rescan = db.query(KeywordRescan).filter(KeywordRescan.id == rescan_id).first()
+        if rescan is None or rescan.status not in ("queued", "running"):
+            return
+        matcher = get_keyword_matcher()
+        user_id = rescan.user_id
+        request_ids = [request_id for (request_id,) in
+                       outdated_requests(db, user_id, matcher.version).with_entities(AnalysisRequest.id)]
+        rescan.status = "running"
+        rescan.keyword_version = matcher.version
+        rescan.total = len(request_ids)
+        rescan.processed = rescan.updated = rescan.skipped = rescan.new_hits = 0
+        rescan.started_at = datetime.utcnow()
+        db.commit()
+        counts = {"processed": 0, "updated": 0, "skipped": 0, "new_hits": 0}
+
+        for request_id in request_ids:
+            analysis_request = db.query(AnalysisRequest).filter(AnalysisRequest.id == request_id).first()
+            try:
+                rescanned = rescan_request(db, analysis_request, matcher)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Ошибка повторного поиска в запросе {request_id}: {e}")
+                rescanned = None
+            counts["processed"] += 1
+            if rescanned is None:
+                db.rollback()
+                counts["skipped"] += 1
+            else:
+                db.commit()
+                new_hits, result = rescanned
+                counts["updated"] += 1
+                counts["new_hits"] += new_hits
+                index_analysis(request_id, analysis_request.file_id, analysis_request.user_id, result)
+            update_rescan(rescan_id, **counts)
+
+        update_rescan(rescan_id, status="completed", finished_at=datetime.utcnow())
+        logger.info(f"Повторный поиск {rescan_id}: обновлено {counts['updated']}, новых совпадений {counts['new_hits']}")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Ошибка повторного поиска {rescan_id}: {e}")
+        update_rescan(rescan_id, status="failed", error=str(e), finished_at=datetime.utcnow())
+    finally:
+        db.close()
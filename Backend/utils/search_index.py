@@ -0,0 +1,217 @@
+from utils.analysis import get_keyword_categories
+from html import escape
+import sqlite3
+import threading
+import logging
+import json
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_DIR = os.getenv("SEARCH_INDEX_DIR", "search")
+SNIPPET_TOKENS = 16
+MAX_SEARCH_RESULTS = 100
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+# snippet() marks matches with these private-use characters; the transcript
+# text is HTML-escaped before they are replaced by the <mark> tags, so a
+# snippet is always safe to render as HTML.
+_MATCH_START = "\ue000"
+_MATCH_END = "\ue001"
+
+QUERY_TERM_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def index_token(value: str) -> str:
+    # Keywords and categories are stored as single tokens ("crack cocaine" ->
+    # "crack_cocaine") so that a filter never matches part of a longer keyword.
+    return re.sub(r"\W+", "_", value.strip().lower()).strip("_")
+
+
+def _quoted(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def build_match_query(user_id: int, query: str = "", keywords=(), categories=()) -> str:
+    """FTS5 MATCH expression for a user query.
+
+    Words are ANDed, "double quoted" text is a phrase and a trailing * makes a
+    prefix query. Everything is quoted, so user input can never be parsed as
+    FTS5 syntax. The scope token restricts the match to the user's own rows
+    inside the index itself.
+    """
+    terms = []
+    for phrase, word in QUERY_TERM_RE.findall(query or ""):
+        if phrase.strip():
+            terms.append(_quoted(phrase))
+        elif word:
+            prefix = word.endswith("*")
+            word = word.rstrip("*")
+            if word:
+                terms.append(_quoted(word) + ("*" if prefix else ""))
+    parts = []
+    if terms:
+        parts.append(f"text : ({' AND '.join(terms)})")
+    for column, values in (("keywords", keywords), ("categories", categories)):
+        tokens = [index_token(value) for value in values if index_token(value)]
+        if tokens:
+            parts.append(f"{column} : ({' OR '.join(_quoted(token) for token in tokens)})")
+    parts.append(f"scope : {_quoted(f'u{int(user_id)}')}")
+    return " AND ".join(parts)
+
+
+def highlight(snippet: str) -> str:
+    return escape(snippet).replace(_MATCH_START, HIGHLIGHT_START).replace(_MATCH_END, HIGHLIGHT_END)
+
+
+class SearchIndex:
+    """Full-text index of transcript segments in a local SQLite FTS5 file.
+
+    `segments` holds one row per transcript segment; the FTS5 table is an
+    external-content index over it, kept in sync by triggers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS segments (
+                    id INTEGER PRIMARY KEY, request_id INTEGER, file_id INTEGER, user_id INTEGER,
+                    start REAL, "end" REAL, text TEXT, keywords TEXT, categories TEXT, scope TEXT,
+                    keyword_list TEXT);
+                CREATE INDEX IF NOT EXISTS ix_segments_request_id ON segments (request_id);
+                CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5(
+                    text, keywords, categories, scope, content='segments', content_rowid='id',
+                    tokenize="unicode61 remove_diacritics 2 tokenchars '_'", prefix='2 3');
+                CREATE TRIGGER IF NOT EXISTS segments_ai AFTER INSERT ON segments BEGIN
+                    INSERT INTO segments_fts (rowid, text, keywords, categories, scope)
+                    VALUES (new.id, new.text, new.keywords, new.categories, new.scope);
+                END;
+                CREATE TRIGGER IF NOT EXISTS segments_ad AFTER DELETE ON segments BEGIN
+                    INSERT INTO segments_fts (segments_fts, rowid, text, keywords, categories, scope)
+                    VALUES ('delete', old.id, old.text, old.keywords, old.categories, old.scope);
+                END;
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def index_request(self, request_id: int, file_id: int, user_id: int, segments: list[dict], hits: list[dict],
+                      categories: dict[str, str]):
+        """(Re)index one analysis; hits are its drug_timestamps entries."""
+        hits_by_start = {}
+        for hit in hits:
+            hits_by_start.setdefault(hit["timestamp"], []).extend(hit["keywords"])
+        rows = []
+        for segment in segments:
+            keywords = list(dict.fromkeys(hits_by_start.get(segment["start"], [])))
+            hit_categories = list(dict.fromkeys(categories.get(keyword, "") for keyword in keywords))
+            rows.append((request_id, file_id, user_id, segment["start"], segment["end"], segment["text"],
+                         " ".join(index_token(k) for k in keywords),
+                         " ".join(index_token(c) for c in hit_categories if c),
+                         f"u{user_id}", json.dumps(keywords, ensure_ascii=False)))
+        with self._connect() as conn:
+            conn.execute("DELETE FROM segments WHERE request_id = ?", (request_id,))
+            conn.executemany("INSERT INTO segments (request_id, file_id, user_id, start, \"end\", text, keywords, "
+                             "categories, scope, keyword_list) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def delete_request(self, request_id: int):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM segments WHERE request_id = ?", (request_id,))
+
+    def indexed_requests(self) -> set[int]:
+        return {row[0] for row in self._connect().execute("SELECT DISTINCT request_id FROM segments")}
+
+    def search(self, user_id: int, query: str = "", keywords=(), categories=(), file_id: int = None,
+               limit: int = 20, offset: int = 0) -> list[dict]:
+        # Best matches first; bm25 only weighs the transcript text and keywords.
+        sql = ("SELECT s.request_id, s.file_id, s.start, s.\"end\", s.keyword_list, "
+               "snippet(segments_fts, 0, ?, ?, '…', ?), bm25(segments_fts, 1.0, 0.5, 0.0, 0.0) AS score "
+               "FROM segments_fts JOIN segments s ON s.id = segments_fts.rowid WHERE segments_fts MATCH ? "
+               "AND s.user_id = ?")
+        # The scope token already limits the match to the user's rows; the
+        # user_id check does not depend on the index being consistent.
+        params = [_MATCH_START, _MATCH_END, SNIPPET_TOKENS,
+                  build_match_query(user_id, query, keywords, categories), user_id]
+        if file_id is not None:
+            sql += " AND s.file_id = ?"
+            params.append(file_id)
+        sql += " ORDER BY score LIMIT ? OFFSET ?"
+        params += [min(limit, MAX_SEARCH_RESULTS), offset]
+        return [{
+            "request_id": request_id,
+            "file_id": file_id,
+            "start": start,
+            "end": end,
+            "keywords": json.loads(keyword_list),
+            "snippet": highlight(snippet),
+            "score": round(-score, 4)
+        } for request_id, file_id, start, end, keyword_list, snippet, score in self._connect().execute(sql, params)]
+
+    def stats(self) -> dict:
+        segments, requests = self._connect().execute(
+            "SELECT COUNT(*), COUNT(DISTINCT request_id) FROM segments").fetchone()
+        return {"segments": segments, "requests": requests}
+
+
+_index = None
+
+
+def get_search_index() -> SearchIndex:
+    global _index
+    if _index is None:
+        os.makedirs(SEARCH_INDEX_DIR, exist_ok=True)
+        _index = SearchIndex(os.path.join(SEARCH_INDEX_DIR, "index.db"))
+    return _index
+
+
+def index_analysis(request_id: int, file_id: int, user_id: int, analysis_result: dict) -> int:
+    # Reports written before segments were stored only have their keyword hits.
+    segments = analysis_result.get("segments")
+    if segments is None:
+        segments = [{"start": hit["timestamp"], "end": hit["timestamp"], "text": hit["text"]}
+                    for hit in analysis_result.get("drug_timestamps", [])]
+    try:
+        return get_search_index().index_request(request_id, file_id, user_id, segments,
+                                                analysis_result.get("drug_timestamps", []),
+                                                get_keyword_categories())
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка индексации запроса {request_id}: {e}")
+        return 0
+
+
+def reindex_reports(db, only_missing: bool = True) -> int:
+    """Index analyses from their stored reports, e.g. ones made before the index existed."""
+    from models import AnalysisRequest
+    from utils.segment_store import load_report
+
+    done = get_search_index().indexed_requests() if only_missing else set()
+    indexed = 0
+    for analysis_request in db.query(AnalysisRequest).yield_per(100):
+        if analysis_request.id in done:
+            continue
+        report = load_report(analysis_request)
+        if report is None:
+            continue
+        index_analysis(analysis_request.id, analysis_request.file_id, analysis_request.user_id,
+                       report["analysis_result"])
+        indexed += 1
+    return indexed
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as session:
+        print(f"Indexed {reindex_reports(session)} analysis report(s).")
@@ -0,0 +1,315 @@
+from array import array
+from typing import Optional
+import struct
+import mmap
+import json
+import zlib
+import sys
+import os
+
+MAGIC = b"SEGS"
+FORMAT_VERSION = 1
+# Segment texts are zlib-compressed in blocks of this many segments, so a
+# page of segments decompresses one or two blocks, not the whole transcript.
+TEXT_BLOCK_SEGMENTS = int(os.getenv("SEGMENT_TEXT_BLOCK", "256"))
+
+# magic, format version, offset and length of the JSON metadata
+_HEADER = struct.Struct("<4sHQI")
+_ALIGN = 8
+# Column name -> array typecode; None for raw bytes. Times are milliseconds.
+COLUMNS = {
+    "start_ms": "I",
+    "end_ms": "I",
+    "text_offsets": "Q",     # segments + 1 offsets into the uncompressed text
+    "block_offsets": "Q",    # blocks + 1 offsets into text_blocks
+    "text_blocks": None,
+    "hit_segment": "I",      # segment index of each hit
+    "hit_matches": "I",      # hits + 1 offsets into the match columns
+    "match_keyword": "I",    # index into meta["keywords"]
+    "match_start": "I",
+    "match_end": "I",
+}
+# Lists left out of summaries; keyframes are listed per file (routes.users).
+LIST_KEYS = ("transcription", "segments", "drug_timestamps", "keyframes")
+
+
+def _milliseconds(seconds: float) -> int:
+    return max(0, round(seconds * 1000))
+
+
+def write_store(path: str, analysis_result: dict, **report):
+    """Writes an analysis result as a segment store.
+
+    Segments and hits go into fixed-width columns; everything else in the
+    result (insights, duration, keyword version) and the report fields
+    (request_date, file_id, user_id) into the JSON metadata. The plain
+    transcription is not stored: it is the segment texts joined. Written
+    under a temporary name and moved into place.
+    """
+    segments = analysis_result.get("segments") or []
+    hits = analysis_result.get("drug_timestamps") or []
+    columns = {name: array(typecode) for name, typecode in COLUMNS.items() if typecode}
+
+    text_blocks = bytearray()
+    columns["block_offsets"].append(0)
+    columns["text_offsets"].append(0)
+    segment_index = {}
+    for start in range(0, len(segments), TEXT_BLOCK_SEGMENTS):
+        block = bytearray()
+        for index in range(start, min(start + TEXT_BLOCK_SEGMENTS, len(segments))):
+            segment = segments[index]
+            text = (segment.get("text") or "").encode("utf-8")
+            block += text
+            columns["start_ms"].append(_milliseconds(segment["start"]))
+            columns["end_ms"].append(_milliseconds(segment["end"]))
+            columns["text_offsets"].append(columns["text_offsets"][-1] + len(text))
+            segment_index.setdefault((columns["start_ms"][-1], segment.get("text") or ""), index)
+        text_blocks += zlib.compress(bytes(block))
+        columns["block_offsets"].append(len(text_blocks))
+
+    keywords = {}
+    columns["hit_matches"].append(0)
+    for hit in hits:
+        # Hits are stored as the segment they were found in; their text and
+        # timestamp are that segment's.
+        index = segment_index.get((_milliseconds(hit["timestamp"]), hit["text"]))
+        if index is None:
+            raise ValueError(f"Hit at {hit['timestamp']} s has no matching segment")
+        columns["hit_segment"].append(index)
+        for match in hit.get("matches", []):
+            columns["match_keyword"].append(keywords.setdefault(match["keyword"], len(keywords)))
+            columns["match_start"].append(match["start"])
+            columns["match_end"].append(match["end"])
+        columns["hit_matches"].append(len(columns["match_keyword"]))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+        layout = {}
+        for name, typecode in COLUMNS.items():
+            f.write(b"\0" * (-f.tell() % _ALIGN))
+            data = bytes(text_blocks) if typecode is None else _little_endian(columns[name])
+            layout[name] = [f.tell(), len(data)]
+            f.write(data)
+        meta = {
+            "segments": len(segments),
+            "hits": len(hits),
+            "text_block": TEXT_BLOCK_SEGMENTS,
+            "keywords": list(keywords),
+            "columns": layout,
+            "result": {key: value for key, value in analysis_result.items()
+                       if key not in ("transcription", "segments", "drug_timestamps")},
+            "report": report,
+        }
+        meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        meta_offset = f.tell()
+        f.write(meta_bytes)
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, meta_offset, len(meta_bytes)))
+    os.replace(tmp_path, path)
+
+
+def write_json_report(path: str, analysis_result: dict, **report):
+    """Writes an analysis result as a JSON report, the format before segment stores.
+
+    Kept for results a segment store cannot hold (write_store raises
+    ValueError), e.g. a hit that is not one of the segments.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"analysis_result": analysis_result, **report}, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class LazyRows:
+    """Rows of a store read one at a time as they are iterated.
+
+    len() is known without reading any of them; the store must stay open
+    while they are used.
+    """
+
+    def __init__(self, count: int, row):
+        self._count = count
+        self._row = row
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        return map(self._row, range(self._count))
+
+
+class SegmentStore:
+    """Memory-mapped reader of a file written by write_store.
+
+    Columns are read in place through memoryviews; only the pages asked for
+    are turned into Python objects, so reading twenty segments of an eight
+    hour recording costs about the same as of a short one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, meta_offset, meta_length = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._map.close()
+            raise ValueError(f"Not a segment store: {path}")
+        self.meta = json.loads(self._map[meta_offset:meta_offset + meta_length])
+        self._views = []
+        self._columns = {name: self._column(name, typecode) for name, typecode in COLUMNS.items()}
+        self._block = (None, b"")
+
+    def _column(self, name: str, typecode: Optional[str]):
+        offset, length = self.meta["columns"][name]
+        view = memoryview(self._map)[offset:offset + length]
+        self._views.append(view)
+        if typecode is None:
+            return view
+        if sys.byteorder == "big":
+            values = array(typecode, view)
+            values.byteswap()
+            return values
+        view = view.cast(typecode)
+        self._views.append(view)
+        return view
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.meta["segments"]
+
+    @property
+    def hit_count(self) -> int:
+        return self.meta["hits"]
+
+    def _text_block(self, block: int) -> bytes:
+        if self._block[0] != block:
+            offsets = self._columns["block_offsets"]
+            self._block = (block, zlib.decompress(self._columns["text_blocks"][offsets[block]:offsets[block + 1]]))
+        return self._block[1]
+
+    def text(self, index: int) -> str:
+        offsets = self._columns["text_offsets"]
+        block_size = self.meta["text_block"]
+        data = self._text_block(index // block_size)
+        base = offsets[index // block_size * block_size]
+        return data[offsets[index] - base:offsets[index + 1] - base].decode("utf-8")
+
+    def segment(self, index: int) -> dict:
+        return {"start": self._columns["start_ms"][index] / 1000, "end": self._columns["end_ms"][index] / 1000,
+                "text": self.text(index)}
+
+    def segments(self, offset: int = 0, limit: Optional[int] = None) -> list[dict]:
+        stop = len(self) if limit is None else min(len(self), offset + limit)
+        return [self.segment(index) for index in range(offset, stop)]
+
+    def hit(self, index: int) -> dict:
+        segment = self._columns["hit_segment"][index]
+        bounds = self._columns["hit_matches"]
+        keywords = self.meta["keywords"]
+        matches = [{"keyword": keywords[self._columns["match_keyword"][i]], "start": self._columns["match_start"][i],
+                    "end": self._columns["match_end"][i]} for i in range(bounds[index], bounds[index + 1])]
+        return {
+            "timestamp": self._columns["start_ms"][segment] / 1000,
+            "text": self.text(segment),
+            "keywords": list(dict.fromkeys(match["keyword"] for match in matches)),
+            "matches": matches,
+        }
+
+    def hits(self, offset: int = 0, limit: Optional[int] = None) -> list[dict]:
+        stop = self.hit_count if limit is None else min(self.hit_count, offset + limit)
+        return [self.hit(index) for index in range(offset, stop)]
+
+    def summary(self) -> dict:
+        result = self.meta["result"]
+        return {**{key: value for key, value in result.items() if key not in LIST_KEYS}, **self.meta["report"],
+                "segment_count": len(self), "hit_count": self.hit_count,
+                "keyframe_count": len(result.get("keyframes") or [])}
+
+    def analysis_result(self) -> dict:
+        # The shape of the JSON reports written before segment stores existed.
+        segments = self.segments()
+        return {
+            "transcription": " ".join(segment["text"].strip() for segment in segments),
+            "segments": segments,
+            "drug_timestamps": self.hits(),
+            **self.meta["result"],
+        }
+
+    def report(self) -> dict:
+        return {"analysis_result": self.analysis_result(), **self.meta["report"]}
+
+    def lazy_result(self) -> dict:
+        # analysis_result() without the transcription, and with segments and
+        # hits read from the map while they are iterated (see LazyRows).
+        return {
+            "segments": LazyRows(len(self), self.segment),
+            "drug_timestamps": LazyRows(self.hit_count, self.hit),
+            **self.meta["result"],
+        }
+
+
+def stored_result_exists(analysis_request) -> bool:
+    path = analysis_request.segments_path or analysis_request.json_path
+    return bool(path) and os.path.exists(path)
+
+
+def load_report(analysis_request) -> Optional[dict]:
+    """The full report of an analysis, from its segment store or legacy JSON file."""
+    if analysis_request is None or not stored_result_exists(analysis_request):
+        return None
+    if analysis_request.segments_path:
+        with SegmentStore(analysis_request.segments_path) as store:
+            return store.report()
+    with open(analysis_request.json_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def result_summary(analysis_request) -> dict:
+    # Everything but the transcript, segments and hits, plus their counts.
+    if analysis_request.segments_path:
+        with SegmentStore(analysis_request.segments_path) as store:
+            return store.summary()
+    report = load_report(analysis_request)
+    result = report["analysis_result"]
+    summary = {key: value for key, value in report.items() if key != "analysis_result"}
+    summary.update({key: value for key, value in result.items() if key not in LIST_KEYS})
+    summary.update(segment_count=len(result.get("segments") or []),
+                   hit_count=len(result.get("drug_timestamps") or []),
+                   keyframe_count=len(result.get("keyframes") or []))
+    return summary
+
+
+def result_page(analysis_request, column: str, offset: int, limit: int) -> dict:
+    """One page of "segments" or "hits"; segments carry their index."""
+    if analysis_request.segments_path:
+        with SegmentStore(analysis_request.segments_path) as store:
+            if column == "segments":
+                total, items = len(store), store.segments(offset, limit)
+            else:
+                total, items = store.hit_count, store.hits(offset, limit)
+    else:
+        result = load_report(analysis_request)["analysis_result"]
+        values = result.get("segments" if column == "segments" else "drug_timestamps") or []
+        total, items = len(values), values[offset:offset + limit]
+    if column == "segments":
+        items = [{"index": offset + i, **item} for i, item in enumerate(items)]
+    return {"total": total, "offset": offset, "items": items}
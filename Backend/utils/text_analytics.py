@@ -0,0 +1,90 @@
+from collections import Counter
+from typing import Iterable, Optional
+import logging
+import re
+import os
+
+from utils.keyword_matcher import KeywordMatcher, tokenize
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_END_RE = re.compile(r"[.!?]")
+TOP_WORDS = 10
+TOP_PHRASES = 5
+TOP_NAMES = 5
+
+
+def load_stop_words_from_file(filepath: str = os.path.join(os.path.dirname(__file__), "stopWords.txt")) -> set[str]:
+    logger.info(f"Попытка загрузки стоп-слов из: {filepath}")
+    if not os.path.exists(filepath):
+        logger.error(f"Файл стоп-слов не найден: {filepath}")
+        return set()
+    with open(filepath, "r", encoding="utf-8") as f:
+        return set(line.strip().lower() for line in f if line.strip())
+
+
+STOP_WORDS = load_stop_words_from_file()
+
+
+def hit_entry(segment, matches) -> dict:
+    return {
+        "timestamp": segment.start,
+        "text": segment.text,
+        "keywords": list(dict.fromkeys(m.keyword for m in matches)),
+        "matches": [{"keyword": m.keyword, "start": m.start, "end": m.end} for m in matches]
+    }
+
+
+def analyze_text(segments: Iterable, matcher: Optional[KeywordMatcher] = None, stop_words: set[str] = STOP_WORDS,
+                 ngram: int = 2) -> dict:
+    """Computes every transcript statistic in one tokenization pass.
+
+    Each segment (anything with .start and .text) is tokenized once; the same
+    token stream feeds word frequencies, n-gram key phrases, capitalized name
+    candidates and keyword hits, which the JSON result and the PDF both reuse.
+    """
+    word_counts = Counter()
+    ngram_counts = Counter()
+    window = []
+    names = {}
+    hits = []
+    word_count = 0
+    sentence_start = True
+
+    for segment in segments:
+        text = segment.text or ""
+        tokens = tokenize(text)
+        previous_end = 0
+        for token in tokens:
+            if SENTENCE_END_RE.search(text, previous_end, token.start):
+                sentence_start = True
+            word = token.text
+            word_count += 1
+            if word.isalpha():
+                original = text[token.start:token.end]
+                if not sentence_start and original[0].isupper() and len(names) < TOP_NAMES:
+                    names.setdefault(original, None)
+                if word not in stop_words:
+                    word_counts[word] += 1
+                    window.append(word)
+                    if len(window) > ngram:
+                        del window[0]
+                    if len(window) == ngram:
+                        ngram_counts[tuple(window)] += 1
+            sentence_start = False
+            previous_end = token.end
+        if SENTENCE_END_RE.search(text, previous_end):
+            sentence_start = True
+
+        if matcher is not None:
+            matches = matcher.find_tokens(tokens)
+            if matches:
+                hits.append(hit_entry(segment, matches))
+
+    return {
+        "word_count": word_count,
+        "frequent_words": word_counts.most_common(TOP_WORDS),
+        "key_phrases": [" ".join(words) for words, _ in ngram_counts.most_common(TOP_PHRASES)],
+        "names": list(names),
+        "drug_timestamps": hits
+    }
@@ -0,0 +1,181 @@
+from dataclasses import dataclass, field, asdict
+from typing import Optional
+import threading
+import openai
+import wave
+import json
+import io
+import os
+
+TRANSCRIBER_BACKEND = os.getenv("TRANSCRIBER_BACKEND", "openai")
+TRANSCRIBER_FIXTURE = os.getenv("TRANSCRIBER_FIXTURE")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "600"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "base")
+
+
+@dataclass
+class Segment:
+    start: float
+    end: float
+    text: str
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Segment":
+        return cls(start=float(data["start"]), end=float(data["end"]), text=data.get("text") or "")
+
+
+@dataclass
+class Transcription:
+    text: str
+    segments: list[Segment] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {"text": self.text, "segments": [s.to_dict() for s in self.segments]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Transcription":
+        return cls(text=data.get("text") or "", segments=[Segment.from_dict(s) for s in data.get("segments", [])])
+
+
+def audio_duration(audio) -> Optional[float]:
+    # audio is either an open binary file or a (filename, bytes) tuple.
+    try:
+        source = io.BytesIO(audio[1]) if isinstance(audio, tuple) else audio
+        with wave.open(source, "rb") as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
+        return None
+    finally:
+        if not isinstance(audio, tuple):
+            audio.seek(0)
+
+
+class Transcriber:
+    """offset is where the audio starts in the whole recording, in seconds.
+
+    Models only need the audio itself; backends that replay a recorded
+    transcript use it to return the part that belongs to a chunk.
+    """
+    name = "base"
+
+    def transcribe(self, audio, offset: float = 0.0) -> Transcription:
+        raise NotImplementedError
+
+    def __call__(self, audio, offset: float = 0.0) -> Transcription:
+        return self.transcribe(audio, offset)
+
+
+_openai_client = None
+_openai_client_pid = None
+_openai_client_lock = threading.Lock()
+
+
+def get_openai_client() -> openai.Client:
+    # One long-lived client per process, so HTTP connections are pooled and reused
+    # across chunks and jobs instead of being rebuilt for every request.
+    global _openai_client, _openai_client_pid
+    with _openai_client_lock:
+        if _openai_client is None or _openai_client_pid != os.getpid():
+            _openai_client = openai.Client(api_key=os.getenv("OPENAI_API_KEY"), timeout=OPENAI_TIMEOUT,
+                                           max_retries=OPENAI_MAX_RETRIES)
+            _openai_client_pid = os.getpid()
+        return _openai_client
+
+
+class OpenAITranscriber(Transcriber):
+    name = "openai"
+
+    def transcribe(self, audio, offset: float = 0.0) -> Transcription:
+        response = get_openai_client().audio.transcriptions.create(
+            model="whisper-1",
+            file=audio,
+            response_format="verbose_json",
+            timestamp_granularities=["segment"]
+        )
+        return Transcription(
+            text=response.text,
+            segments=[Segment(start=s.start, end=s.end, text=s.text) for s in response.segments or []]
+        )
+
+
+class FixtureTranscriber(Transcriber):
+    """Offline stand-in that replays a recorded transcript.
+
+    The fixture is a JSON file shaped like Transcription.to_dict() and
+    covers the whole recording. A chunk gets the segments that start within
+    it (from its offset, for its duration when the audio is WAV), in chunk
+    time, so chunked transcription of a long recording replays the fixture
+    once from start to end.
+    """
+    name = "fixture"
+
+    def __init__(self, fixture=None):
+        fixture = fixture if fixture is not None else TRANSCRIBER_FIXTURE
+        if fixture is None:
+            raise RuntimeError("TRANSCRIBER_FIXTURE is not set")
+        if isinstance(fixture, str):
+            with open(fixture, "r", encoding="utf-8") as f:
+                fixture = json.load(f)
+        self.transcription = fixture if isinstance(fixture, Transcription) else Transcription.from_dict(fixture)
+
+    def transcribe(self, audio, offset: float = 0.0) -> Transcription:
+        duration = audio_duration(audio)
+        if duration is None and not offset:
+            return self.transcription
+        end = offset + duration if duration is not None else float("inf")
+        segments = [Segment(start=s.start - offset, end=s.end - offset, text=s.text)
+                    for s in self.transcription.segments if offset <= s.start < end]
+        return Transcription(text=" ".join(s.text.strip() for s in segments), segments=segments)
+
+
+class LocalModelTranscriber(Transcriber):
+    """Extension point for an on-box Whisper model (faster-whisper, optional)."""
+    name = "local"
+    _models = {}
+
+    def __init__(self, model_name: str = LOCAL_WHISPER_MODEL):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise RuntimeError("The local transcriber requires the faster-whisper package")
+        if model_name not in self._models:
+            self._models[model_name] = WhisperModel(model_name)
+        self.model = self._models[model_name]
+
+    def transcribe(self, audio, offset: float = 0.0) -> Transcription:
+        source = io.BytesIO(audio[1]) if isinstance(audio, tuple) else audio
+        result, _ = self.model.transcribe(source)
+        segments = [Segment(start=s.start, end=s.end, text=s.text) for s in result]
+        return Transcription(text=" ".join(s.text.strip() for s in segments), segments=segments)
+
+
+TRANSCRIBERS = {
+    OpenAITranscriber.name: OpenAITranscriber,
+    FixtureTranscriber.name: FixtureTranscriber,
+    LocalModelTranscriber.name: LocalModelTranscriber,
+}
+
+_transcriber = None
+
+
+def register_transcriber(cls):
+    TRANSCRIBERS[cls.name] = cls
+    return cls
+
+
+def get_transcriber() -> Transcriber:
+    global _transcriber
+    if _transcriber is None:
+        if TRANSCRIBER_BACKEND not in TRANSCRIBERS:
+            raise RuntimeError(f"Unknown transcriber backend: {TRANSCRIBER_BACKEND}")
+        _transcriber = TRANSCRIBERS[TRANSCRIBER_BACKEND]()
+    return _transcriber
+
+
+def set_transcriber(transcriber: Optional[Transcriber]):
+    global _transcriber
+    _transcriber = transcriber
@@ -0,0 +1,193 @@
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+import tarfile
+import zipfile
+import hashlib
+import uuid
+import time
+import os
+
+from utils.metrics import upload_bytes_total, upload_write_seconds
+
+CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(4 * 1024 ** 3)))
+COMPUTE_MD5 = os.getenv("UPLOAD_MD5", "1") == "1"
+# Total of all media unpacked from one batch archive.
+MAX_ARCHIVE_EXTRACTED_SIZE = int(os.getenv("MAX_ARCHIVE_EXTRACTED_SIZE", str(4 * MAX_UPLOAD_SIZE)))
+
+
+# Running hash state of resumable uploads, keyed by upload id. Lost on restart,
+# in which case the part file is re-hashed once when the next part arrives.
+_part_hashes: dict[str, tuple] = {}
+# Uploads a request is currently writing to or finalizing. Two requests for
+# the same offset would otherwise both see it free and both append.
+_busy_parts: set[str] = set()
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class HashingWriter:
+    """Appends chunks to a file and hashes them in the same pass."""
+
+    def __init__(self, path: str, mode: str = "wb", offset: int = 0, sha256=None, md5=None):
+        self.path = path
+        self.mode = mode
+        self.size = offset
+        self.sha256 = sha256 or hashlib.sha256()
+        self.md5 = md5 if md5 is not None else (hashlib.md5() if COMPUTE_MD5 else None)
+        self.write_seconds = 0.0
+        self._opened_size = offset
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, self.mode)
+        self._opened_size = self.size
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+        upload_write_seconds.observe(self.write_seconds)
+        upload_bytes_total.inc(self.size - self._opened_size)
+
+    def _write(self, chunk: bytes):
+        started = time.perf_counter()
+        self._file.write(chunk)
+        self.sha256.update(chunk)
+        if self.md5 is not None:
+            self.md5.update(chunk)
+        self.write_seconds += time.perf_counter() - started
+
+    def write_sync(self, chunk: bytes):
+        if self.size + len(chunk) > MAX_UPLOAD_SIZE:
+            raise UploadTooLarge()
+        self._write(chunk)
+        self.size += len(chunk)
+
+    async def write(self, chunk: bytes):
+        if self.size + len(chunk) > MAX_UPLOAD_SIZE:
+            raise UploadTooLarge()
+        await run_in_threadpool(self._write, chunk)
+        self.size += len(chunk)
+
+    def digests(self) -> tuple[str, Optional[str]]:
+        return self.sha256.hexdigest(), self.md5.hexdigest() if self.md5 is not None else None
+
+
+async def save_upload(upload, path: str) -> HashingWriter:
+    try:
+        with HashingWriter(path) as writer:
+            while chunk := await upload.read(CHUNK_SIZE):
+                await writer.write(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return writer
+
+
+def _archive_members(path: str):
+    # Yields (name, file object) for every regular file of a zip or tar archive.
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as member:
+                        yield info.filename, member
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            for info in archive:
+                if info.isfile():
+                    yield info.name, archive.extractfile(info)
+    else:
+        raise ValueError("Unsupported archive format")
+
+
+def extract_archive(path: str, tmp_dir: str, allowed_extensions: set, max_files: int) -> list[tuple]:
+    """Unpacks supported media from an archive, hashing each file as it is written.
+
+    Member names are only used for display; files are written under random
+    names, so archive paths can never escape tmp_dir. Unpacking stops with
+    ValueError at the first media member beyond max_files and with
+    UploadTooLarge once MAX_ARCHIVE_EXTRACTED_SIZE bytes are written, so a
+    small archive cannot fill the disk.
+    """
+    extracted = []
+    total = 0
+    try:
+        for name, member in _archive_members(path):
+            file_ext = os.path.splitext(name)[1].lower()
+            if file_ext not in allowed_extensions:
+                continue
+            if len(extracted) >= max_files:
+                raise ValueError(f"At most {max_files} files per batch")
+            tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.upload")
+            with HashingWriter(tmp_path) as writer:
+                extracted.append((os.path.basename(name), tmp_path, file_ext, writer))
+                while chunk := member.read(CHUNK_SIZE):
+                    total += len(chunk)
+                    if total > MAX_ARCHIVE_EXTRACTED_SIZE:
+                        raise UploadTooLarge()
+                    writer.write_sync(chunk)
+    except BaseException:
+        for _, tmp_path, _, _ in extracted:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+    return extracted
+
+
+def store_content_addressed(src_path: str, root: str, sha256: str, file_ext: str) -> str:
+    # uploads/objects/ab/abcdef....mp4 -- identical evidence is kept once no matter
+    # how many investigators upload it.
+    directory = os.path.join(root, sha256[:2])
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{sha256}{file_ext}")
+    if os.path.exists(path):
+        os.remove(src_path)
+    else:
+        os.replace(src_path, path)
+    return path
+
+
+def hash_file(path: str):
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5() if COMPUTE_MD5 else None
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            sha256.update(chunk)
+            if md5 is not None:
+                md5.update(chunk)
+    return sha256, md5
+
+
+def open_part_writer(upload_id: str, path: str) -> HashingWriter:
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    state = _part_hashes.get(upload_id)
+    if state is not None and state[0] == offset:
+        sha256, md5 = state[1].copy(), state[2].copy() if state[2] is not None else None
+    else:
+        sha256, md5 = hash_file(path) if offset else (None, None)
+    return HashingWriter(path, mode="ab", offset=offset, sha256=sha256, md5=md5)
+
+
+def save_part_state(upload_id: str, writer: HashingWriter):
+    _part_hashes[upload_id] = (writer.size, writer.sha256, writer.md5)
+
+
+def drop_part_state(upload_id: str):
+    _part_hashes.pop(upload_id, None)
+
+
+def claim_part(upload_id: str) -> bool:
+    # Called from the event loop; checking and adding without an await in
+    # between cannot interleave with another request.
+    if upload_id in _busy_parts:
+        return False
+    _busy_parts.add(upload_id)
+    return True
+
+
+def release_part(upload_id: str):
+    _busy_parts.discard(upload_id)
@@ -1,32 +1,193 @@
-import openai
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.transcribers import Segment, Transcription, get_transcriber
+from utils.metrics import Timings
+from utils.audio_io import (SAMPLE_RATE, AudioExtractionError, is_video, is_pcm16_mono, probe_duration,
+                            read_wav_blocks, stream_pcm)
+from contextlib import closing
+import numpy as np
 import ffmpeg
+import math
+import time
+import wave
+import io
 import os
 
+# 10 minutes of 16 kHz mono PCM is ~19 MB, safely below the 25 MB API limit.
+CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", "600"))
+CHUNK_OVERLAP_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_OVERLAP", "1.0"))
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+SILENCE_SEARCH_SECONDS = 20.0
+SILENCE_FRAME_SECONDS = 0.1
+MAX_REQUEST_BYTES = 24 * 1024 * 1024
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
-def transcribe_audio(file_path: str):
+def _quietest_cut(buffer: bytearray, buffer_start: int, lo: int, hi: int, frame: int) -> int:
+    # Cut at the quietest 100 ms frame of [lo, hi) so words are not split across chunks.
+    samples = np.frombuffer(bytes(buffer[(lo - buffer_start) * 2:(hi - buffer_start) * 2]), dtype="<i2")
+    n = len(samples) // frame
+    if not n:
+        return hi
+    energy = np.square(samples[:n * frame].astype(np.float32)).reshape(n, frame).mean(axis=1)
+    return lo + int(np.argmin(energy)) * frame + frame // 2
+
+
+def iter_chunks(blocks, rate: int = SAMPLE_RATE):
+    """Cut a stream of s16le mono PCM blocks into silence-aligned chunks.
+
+    Yields (audio_start, keep_start, pcm) with positions in frames. Each
+    chunk starts CHUNK_OVERLAP_SECONDS before keep_start; only about one
+    chunk of audio is buffered at a time.
+    """
+    chunk = int(CHUNK_SECONDS * rate)
+    overlap = int(CHUNK_OVERLAP_SECONDS * rate)
+    search = int(SILENCE_SEARCH_SECONDS * rate)
+    frame = max(1, int(SILENCE_FRAME_SECONDS * rate))
+    buffer = bytearray()
+    buffer_start = 0
+    pos = 0
+    for block in blocks:
+        buffer += block
+        while buffer_start + len(buffer) // 2 - pos > chunk:
+            target = pos + chunk
+            cut = _quietest_cut(buffer, buffer_start, max(pos + chunk // 2, target - search), target, frame)
+            audio_start = max(buffer_start, pos - overlap)
+            yield audio_start, pos, bytes(buffer[(audio_start - buffer_start) * 2:(cut - buffer_start) * 2])
+            pos = cut
+            drop = max(0, pos - overlap) - buffer_start
+            del buffer[:drop * 2]
+            buffer_start += drop
+    end = buffer_start + len(buffer) // 2
+    if end > pos or pos == 0:
+        audio_start = max(buffer_start, pos - overlap)
+        yield audio_start, pos, bytes(buffer[(audio_start - buffer_start) * 2:(end - buffer_start) * 2])
+
+
+def _wav_bytes(pcm: bytes, rate: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        out.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def stitch_segments(chunks: list[tuple[float, float, Transcription]]) -> list[Segment]:
+    # chunks: (audio_start, keep_start, result). Segments are shifted to global
+    # time; a segment centred before keep_start lies in the overlap and was
+    # already taken from the previous chunk.
+    segments = []
+    for audio_start, keep_start, result in chunks:
+        for segment in result.segments:
+            start = segment.start + audio_start
+            end = segment.end + audio_start
+            if (start + end) / 2 < keep_start:
+                continue
+            if segments and start < segments[-1].end and segment.text.strip() == segments[-1].text.strip():
+                continue
+            segments.append(Segment(start=round(start, 3), end=round(end, 3), text=segment.text))
+    return segments
+
+
+def _timed(transcriber, timings: Timings, index: int, audio_seconds: float, offset: float):
+    def transcribe(audio):
+        with timings.span("transcribe_chunk", chunk=index, audio_seconds=round(audio_seconds, 3)):
+            return transcriber(audio, offset)
+    return transcribe
+
+
+def _transcribe_stream(blocks, rate: int, duration, transcriber, progress, on_segments, timings: Timings) -> dict:
+    expected = max(1, math.ceil(duration / CHUNK_SECONDS)) if duration else None
+    print(f"Transcribing ~{expected or '?'} chunk(s) with concurrency {TRANSCRIBE_CONCURRENCY}")
+    results = []
+    pending = {}
+    done = 0
+    # Time spent waiting for decoded PCM, i.e. the ffmpeg extraction that
+    # runs interleaved with transcription.
+    extract_seconds = 0.0
+    extract_started = time.perf_counter()
+    with closing(blocks), ThreadPoolExecutor(max_workers=TRANSCRIBE_CONCURRENCY) as pool:
+        chunks = iter_chunks(blocks, rate)
+        exhausted = False
+        try:
+            while not exhausted or pending:
+                # Pulling the next chunk reads the ffmpeg pipe, so decoding is
+                # throttled to the transcription pool and memory stays bounded.
+                while not exhausted and len(pending) < TRANSCRIBE_CONCURRENCY:
+                    started = time.perf_counter()
+                    item = next(chunks, None)
+                    extract_seconds += time.perf_counter() - started
+                    if item is None:
+                        exhausted = True
+                        break
+                    audio_start, keep_start, pcm = item
+                    audio = (f"chunk_{len(results):04d}.wav", _wav_bytes(pcm, rate))
+                    timed = _timed(transcriber, timings, len(results), len(pcm) / 2 / rate, audio_start / rate)
+                    pending[pool.submit(timed, audio)] = len(results)
+                    results.append((audio_start / rate, keep_start / rate, None))
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = pending.pop(future)
+                    if future.exception() is not None:
+                        return {"error": str(future.exception())}
+                    results[index] = results[index][:2] + (future.result(),)
+                    # Chunks finish out of order; each is reported in global time.
+                    on_segments(stitch_segments([results[index]]))
+                    done += 1
+                    total = len(results) if exhausted else max(expected or 0, len(results) + 1)
+                    progress(done, total)
+        finally:
+            for future in pending:
+                future.cancel()
+            timings.add("extract", extract_seconds, extract_started)
+
+    segments = stitch_segments(results)
+    if len(results) == 1:
+        return {"text": results[0][2].text, "segments": segments}
+    return {"text": " ".join(s.text.strip() for s in segments), "segments": segments}
+
+
+def transcribe_audio(file_path: str, transcriber=None, progress=None, on_segments=None, timings: Timings = None,
+                     extra_outputs: list[str] = None):
+    transcriber = transcriber or get_transcriber()
+    progress = progress or (lambda done, total: None)
+    on_segments = on_segments or (lambda segments: None)
+    timings = timings or Timings()
+    if not os.path.exists(file_path):
+        print(f"Error: File not found at {file_path}")
+        return {"error": "File not found"}
+
+    size = os.path.getsize(file_path)
+    print(f"Transcribing file: {file_path} ({size} bytes)")
+
     try:
-        if not os.path.exists(file_path):
-            print(f"Error: File not found at {file_path}")
-            return {"error": "File not found"}
-
-        size = os.path.getsize(file_path)
-        print(f"Transcribing file: {file_path} ({size} bytes)")
-
-        client = openai.Client(api_key=openai.api_key)
-        with open(file_path, "rb") as audio_file:
-            response = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="verbose_json",
-                timestamp_granularities=["segment"]
-            )
-        print("Whisper API response:", response)
-        return {
-            "text": response.text,
-            "segments": response.segments
-        }
-    except Exception as e:
+        rate = SAMPLE_RATE
+        if is_pcm16_mono(file_path, rate):
+            # Already plain PCM: read it directly, ffmpeg is not needed.
+            with wave.open(file_path, "rb") as wav:
+                duration = wav.getnframes() / rate
+            blocks = read_wav_blocks(file_path)
+        elif not is_video(file_path) and size <= MAX_REQUEST_BYTES:
+            with open(file_path, "rb") as audio_file:
+                try:
+                    with timings.span("transcribe_chunk", chunk=0):
+                        result = transcriber(audio_file)
+                except Exception as e:
+                    print(f"Error in transcribe_audio: {str(e)}")
+                    return {"error": str(e)}
+            on_segments(result.segments)
+            progress(1, 1)
+            return {"text": result.text, "segments": result.segments}
+        else:
+            duration = probe_duration(file_path)
+            blocks = stream_pcm(file_path, rate, extra_outputs)
+        return _transcribe_stream(blocks, rate, duration, transcriber, progress, on_segments, timings)
+    except AudioExtractionError as e:
+        # Flagged so callers can tell a failed decode from a failed transcription.
+        print(f"Error in transcribe_audio: {str(e)}")
+        return {"error": str(e), "extraction_error": True}
+    except (OSError, wave.Error, EOFError) as e:
         print(f"Error in transcribe_audio: {str(e)}")
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
@@ -40,13 +40,60 @@ export const analyzeFile = async (fileId, token) => {
   return response;
 };
 
-export const getUserHistory = async (token) => {
-  const response = await fetch(`${API_URL}/user/history`, {
+export const getJobStatus = async (jobId, token) => {
+  const response = await fetch(`${API_URL}/audio/jobs/${jobId}`, {
     headers: { Authorization: `Bearer ${token}` }
   });
   return response;
 };
 
+// Follows a job's server-sent events (stage, chunk, hits, completed, failed,
+// cancelled) and resolves with the final one. fetch is used rather than
+// EventSource because the stream needs the Authorization header.
+export const streamJobEvents = async (jobId, token, onEvent) => {
+  const response = await fetch(`${API_URL}/audio/jobs/${jobId}/events`, {
+    headers: { Authorization: `Bearer ${token}` }
+  });
+  if (!response.ok) throw new Error('Failed to follow job progress');
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  let last = null;
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) return last;
+    buffer += value;
+    const messages = buffer.split('\n\n');
+    buffer = messages.pop();
+    for (const message of messages) {
+      let type = 'message';
+      let data = null;
+      for (const line of message.split('\n')) {
+        if (line.startsWith('event: ')) type = line.slice(7);
+        else if (line.startsWith('data: ')) data = JSON.parse(line.slice(6));
+      }
+      if (data === null) continue;
+      last = { type, data };
+      onEvent(last);
+    }
+  }
+};
+
+// Listings are paginated: pass the returned nextCursor to get the next page
+// (null on the last one).
+const listPage = async (path, token, cursor, params = {}) => {
+  const query = new URLSearchParams(params);
+  if (cursor) query.set('cursor', cursor);
+  const response = await fetch(`${API_URL}${path}?${query}`, {
+    headers: { Authorization: `Bearer ${token}` }
+  });
+  const items = await response.json();
+  return { items, nextCursor: response.headers.get('X-Next-Cursor') };
+};
+
+export const getUserHistory = async (token, cursor = null, params = {}) => {
+  return listPage('/user/history', token, cursor, { sort: '-id', ...params });
+};
+
 export const isAuthenticated = () => {
   const token = localStorage.getItem('token');
   const loginTime = localStorage.getItem('loginTime');
@@ -57,15 +104,8 @@ export const isAuthenticated = () => {
   return timeElapsed < sessionInTime;
 };
 
-export const getUserFiles = async (token) => {
-  const response = await fetch(`${API_URL}/user/files`, {
-    method: 'GET',
-    headers: {
-      'Authorization': `Bearer ${token}`,
-      'Content-Type': 'application/json'
-    }
-  });
-  return response.json();
+export const getUserFiles = async (token, cursor = null, params = {}) => {
+  return listPage('/user/files', token, cursor, { sort: '-id', ...params });
 };
 
 export const downloadUserFile = async (fileId, token) => {
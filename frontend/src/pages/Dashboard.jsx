@@ -4,6 +4,7 @@ import { FileText, Download } from 'lucide-react';
 
 function Dashboard() {
   const [history, setHistory] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null);
   const [files, setFiles] = useState([]);
   const [loading, setLoading] = useState(false);
 
@@ -11,12 +12,13 @@ function Dashboard() {
   const fetchData = async () => {
     try {
       const token = localStorage.getItem('token');
-      const [historyData, filesData] = await Promise.all([
-        getUserHistory(token).then(res => res.json()), // для истории
-        getUserFiles(token) // для файлов (уже содержит .json())
+      const [historyPage, filesPage] = await Promise.all([
+        getUserHistory(token), // первая страница истории
+        getUserFiles(token) // первая страница файлов
       ]);
-      setHistory(historyData);
-      setFiles(filesData);
+      setHistory(historyPage.items);
+      setHistoryCursor(historyPage.nextCursor);
+      setFiles(filesPage.items);
     } catch (error) {
       console.error('Error fetching data:', error);
     }
@@ -24,6 +26,20 @@ function Dashboard() {
   fetchData();
 }, []);
 
+  const handleLoadMoreHistory = async () => {
+    try {
+      setLoading(true);
+      const token = localStorage.getItem('token');
+      const page = await getUserHistory(token, historyCursor);
+      setHistory(prev => [...prev, ...page.items]);
+      setHistoryCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Error fetching data:', error);
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const handleDownloadJson = async (requestId, fileName) => {
     try {
       setLoading(true);
@@ -105,30 +121,37 @@ function Dashboard() {
                       <FileText className="text-green-500" />
                       <span className="font-medium">Analyze #{item.id}</span>
                     </div>
-                    {item.report_path && (
-                      <div className="flex gap-4">
-                        <button
-                          onClick={() => handleDownloadReport(item.id, `report_${item.id}.pdf`)}
-                          className="text-green-600 hover:text-green-800 flex items-center gap-1 cursor-pointer"
-                        >
-                          <Download size={18} />
-                          PDF
-                        </button>
-                        <button
-                          onClick={() => handleDownloadJson(item.id, `report_${item.id}.json`)}
-                          className="text-blue-600 hover:text-blue-800 flex items-center gap-1 cursor-pointer"
-                        >
-                          <Download size={18} />
-                          JSON
-                        </button>
-                      </div>
-                    )}
+                    <div className="flex gap-4">
+                      <button
+                        onClick={() => handleDownloadReport(item.id, `report_${item.id}.pdf`)}
+                        className="text-green-600 hover:text-green-800 flex items-center gap-1 cursor-pointer"
+                      >
+                        <Download size={18} />
+                        PDF
+                      </button>
+                      <button
+                        onClick={() => handleDownloadJson(item.id, `report_${item.id}.json`)}
+                        className="text-blue-600 hover:text-blue-800 flex items-center gap-1 cursor-pointer"
+                      >
+                        <Download size={18} />
+                        JSON
+                      </button>
+                    </div>
                   </div>
                   <div className="text-sm text-gray-500 mt-1">
                     Created at: {new Date(item.request_date).toLocaleString()}
                   </div>
                 </div>
               ))}
+              {historyCursor && (
+                <button
+                  onClick={handleLoadMoreHistory}
+                  disabled={loading}
+                  className="text-gray-600 hover:text-gray-800 cursor-pointer"
+                >
+                  Load more
+                </button>
+              )}
             </div>
           )}
         </section>
@@ -1,13 +1,14 @@
 import React, { useState, useRef } from 'react';
-import { uploadFile, analyzeFile, downloadReport, downloadJsonReport } from '../api/api';
+import { uploadFile, analyzeFile, streamJobEvents, downloadReport, downloadJsonReport } from '../api/api';
 import { UploadCloud, Loader2, CheckCircle, Download } from 'lucide-react';
-import { API_URL } from '../api/api';
 
 function Upload() {
   const [file, setFile] = useState(null);
   const [reportId, setReportId] = useState(null);
   const [loading, setLoading] = useState(false);
   const [dragging, setDragging] = useState(false);
+  const [stage, setStage] = useState(null);
+  const [partialHits, setPartialHits] = useState([]);
   const inputRef = useRef(null);
 
   const handleFileSelect = (f) => {
@@ -29,6 +30,7 @@ function Upload() {
 
     setFile(f);
     setReportId(null);
+    setPartialHits([]);
   };
 
   const handleDrop = (e) => {
@@ -43,6 +45,7 @@ function Upload() {
     e.preventDefault();
     if (!file) return;
     setLoading(true);
+    setPartialHits([]);
     const token = localStorage.getItem('token');
 
     try {
@@ -53,25 +56,23 @@ function Upload() {
 
       const analyzeResponse = await analyzeFile(uploadData.file_id, token);
       if (!analyzeResponse.ok) throw new Error('Analysis failed');
-      const analyzeData = await analyzeResponse.json();
-      console.log('Analyze response:', analyzeData);
+      const job = await analyzeResponse.json();
+      console.log('Analyze job:', job);
 
-      const historyResponse = await fetch(`${API_URL}/user/history`, {
-        headers: { Authorization: `Bearer ${token}` },
+      // Hits arrive per transcribed chunk, before the whole file is done.
+      const last = await streamJobEvents(job.job_id, token, ({ type, data }) => {
+        if (type === 'stage' || type === 'chunk') setStage(data);
+        if (type === 'hits') setPartialHits((prev) => [...prev, ...data.hits]);
       });
-      if (!historyResponse.ok) throw new Error('Failed to fetch history');
-      const historyData = await historyResponse.json();
-      console.log('History data:', historyData);
+      if (!last || last.type !== 'completed') throw new Error(last?.data?.error || 'Analysis failed');
 
-      const latestRequest = historyData.find((req) => req.file_id === uploadData.file_id);
-      if (!latestRequest) throw new Error('Request not found in history');
-
-      setReportId(latestRequest.id);
+      setReportId(last.data.request_id);
     } catch (err) {
       console.error('Upload error:', err);
       alert('Error: ' + (err.message || 'Operation failed'));
     } finally {
       setLoading(false);
+      setStage(null);
     }
   };
 
@@ -159,13 +160,26 @@ function Upload() {
           {loading ? (
             <>
               <Loader2 className="w-5 h-5 animate-spin cursor-pointer" />
-              Analyzing...
+              {stage ? `Analyzing: ${stage.stage}${stage.chunks ? ` ${stage.chunk}/${stage.chunks}` : ''}...` : 'Analyzing...'}
             </>
           ) : (
             'Analyze File'
           )}
         </button>
 
+        {loading && partialHits.length > 0 && (
+          <div className="mt-6 text-left text-sm text-gray-600">
+            <p className="font-medium mb-2">Keyword hits so far: {partialHits.length}</p>
+            <ul className="space-y-1">
+              {partialHits.map((hit, index) => (
+                <li key={index}>
+                  {hit.timestamp.toFixed(1)}s: {hit.keywords.join(', ')}
+                </li>
+              ))}
+            </ul>
+          </div>
+        )}
+
         {reportId && (
           <div className="mt-6 text-center">
             <CheckCircle className="w-6 h-6 text-green-600 mx-auto mb-2" />